@@ -0,0 +1,87 @@
+"""Microbenchmark of the Torque ``qstat -f`` parser
+
+Parses synthetic ``qstat -f`` output for many jobs, as
+prisms_jobs.interface.torque.job_status does with the text output. Each record
+has the attributes Torque usually reports, a queued or running job_state, and
+a Variable_List wrapped over tab-continued lines. The output is generated in
+memory; no job management software is needed.
+
+Times, as the best of --repeat runs:
+
+    * _parse_qstat_f(raw=True): single-pass parsing, keeping the record text
+    * _parse_qstat_f(raw=False): single-pass parsing only
+    * job_status(raw=True): parsing and conversion to job status dicts, as
+      used by JobDB.update
+    * job_status(raw=False)
+
+Usage:
+
+    python examples/bench_parsers.py [--jobs 10000] [--repeat 5]
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import argparse
+import timeit
+
+from prisms_jobs.interface import torque
+
+
+def _record(i):
+    """Return the ``qstat -f`` text of synthetic job 'i'"""
+    running = i % 2 == 1
+    text = "Job Id: {0}.host.example.edu\n".format(i)
+    text += "    Job_Name = job{0}\n".format(i)
+    text += "    Job_Owner = user@login1.example.edu\n"
+    text += "    resources_used.cput = 01:02:03\n"
+    text += "    resources_used.walltime = 00:30:00\n"
+    text += "    job_state = {0}\n".format("R" if running else "Q")
+    text += "    queue = batch\n"
+    text += "    server = host.example.edu\n"
+    text += "    Account_Name = acct\n"
+    text += "    ctime = Mon Jan  1 10:00:00 2024\n"
+    text += "    Resource_List.nodes = 2:ppn=8\n"
+    text += "    Resource_List.walltime = 24:00:00\n"
+    if running:
+        text += "    start_time = Mon Jan  1 10:05:00 2024\n"
+    text += "    Variable_List = PBS_O_QUEUE=batch,PBS_O_HOME=/home/user,PBS_O_LOGNAME=user,\n"
+    text += "\tPBS_O_PATH=/usr/bin:/bin:/usr/local/bin,PBS_O_SHELL=/bin/bash,\n"
+    text += "\tPBS_O_WORKDIR=/home/user/project/run{0},PBS_O_HOST=login1\n".format(i)
+    text += "    etime = Mon Jan  1 10:00:00 2024\n"
+    text += "    submit_args = run.sh\n"
+    text += "\n"
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark of the Torque qstat -f parser")
+    parser.add_argument('--jobs', type=int, default=10000, help='Number of jobs in the output')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs of each case')
+    args = parser.parse_args()
+
+    text = "".join(_record(i) for i in range(args.jobs))
+    lines = text.splitlines(True)
+    print("synthetic qstat -f output: {0} jobs, {1:.1f} MB".format(args.jobs, len(text)/1e6))
+
+    # job_status reads the text output of the synthetic 'qstat -f', without
+    # running qstat, qselect, or 'qstat --version'
+    torque._use_xml = lambda: False     #pylint: disable=protected-access
+    torque._qstat_opt = lambda jobid=None, full=False: ["qstat", "-f"]     #pylint: disable=protected-access
+    torque.run_stream = lambda cmd: iter(lines)
+
+    status = torque.job_status()
+    assert len(status) == args.jobs
+    assert sum(1 for s in status.values() if s["jobstatus"] == "R") == args.jobs//2
+
+    cases = [
+        ("_parse_qstat_f(raw=True)", lambda: list(torque._parse_qstat_f(lines, raw=True))),    #pylint: disable=protected-access
+        ("_parse_qstat_f(raw=False)", lambda: list(torque._parse_qstat_f(lines, raw=False))),  #pylint: disable=protected-access
+        ("job_status(raw=True)", lambda: torque.job_status(raw=True)),
+        ("job_status(raw=False)", lambda: torque.job_status(raw=False))]
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print("{0:<28} {1:7.3f} s".format(name, best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Startup benchmark for the pstat, psub and taskmaster scripts
+
+Times, in a fresh python interpreter each, the imports done by the
+command line scripts before they do any work, and opening the jobs database.
+An empty interpreter and 'from builtins import *' are timed for reference.
+
+Uses a temporary PRISMS_JOBS_DIR configured for Torque, with a fake 'qstat'
+on the PATH that sleeps --probe-delay seconds, as a loaded server may, and
+counts its calls. Startup should not call it: the Torque version is probed on
+first use, and then cached in config.json.
+
+Usage:
+
+    python examples/bench_startup.py [--repeat 5] [--probe-delay 0.3]
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+CASES = [
+    "pass",
+    "from builtins import *",
+    "import prisms_jobs",
+    "from prisms_jobs.scripts import pstat",
+    "from prisms_jobs.scripts import psub",
+    "from prisms_jobs.scripts import taskmaster",
+    "import prisms_jobs; prisms_jobs.JobDB()",
+]
+
+
+def _setup(tmpdir, probe_delay):
+    """Write the configuration and fake 'qstat'; return the environment to run with"""
+    bindir = os.path.join(tmpdir, "bin")
+    os.mkdir(bindir)
+    qstat = os.path.join(bindir, "qstat")
+    with open(qstat, 'w') as f:
+        f.write("#!/bin/sh\n")
+        f.write("echo \"$*\" >> {0}\n".format(os.path.join(tmpdir, "qstat_calls")))
+        f.write("sleep {0}\n".format(probe_delay))
+        f.write("echo \"Version: 6.1.2\"\n")
+    os.chmod(qstat, 0o755)
+
+    with open(os.path.join(tmpdir, "config.json"), 'w') as f:
+        f.write(json.dumps({'dbpath': os.path.join(tmpdir, "jobs.db"), 'software': 'torque',
+                            'write_submit_script': False, 'update_method': 'default'}))
+
+    env = dict(os.environ)
+    env['PATH'] = bindir + os.pathsep + env.get('PATH', '')
+    env['PRISMS_JOBS_DIR'] = tmpdir
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = package + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def _ncalls(tmpdir):
+    """Number of times the fake 'qstat' was called"""
+    try:
+        with open(os.path.join(tmpdir, "qstat_calls")) as f:
+            return len(f.readlines())
+    except (IOError, OSError):
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark for pstat, psub and taskmaster")
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs of each case')
+    parser.add_argument('--probe-delay', type=float, default=0.3,
+                        help='Seconds the fake qstat takes to respond')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="prisms_jobs_startup")
+    try:
+        env = _setup(tmpdir, args.probe_delay)
+        with open(os.devnull, 'w') as devnull:
+            for code in CASES:
+                ncalls = _ncalls(tmpdir)
+                best = None
+                for _ in range(args.repeat):
+                    start = time.time()
+                    returncode = subprocess.call([sys.executable, "-c", code], env=env,
+                                                 stdout=devnull, stderr=devnull)
+                    elapsed = time.time() - start
+                    if returncode != 0:
+                        print("{0:<45} failed".format(code))
+                        break
+                    best = elapsed if best is None else min(best, elapsed)
+                if best is not None:
+                    print("{0:<45} {1:6.3f} s   qstat calls: {2}".format(
+                        code, best, _ncalls(tmpdir) - ncalls))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
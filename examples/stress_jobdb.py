@@ -0,0 +1,118 @@
+"""Stress test concurrent writers of a jobs database
+
+Many processes at once call prisms_jobs.complete_job and prisms_jobs.error_job
+on their own jobs in one jobs database, as jobs finishing together on compute
+nodes do. The test fails if any update is lost, or if any writer gives up
+because the database is locked.
+
+By default, runs with the "wal" journal mode, the default journal mode, and the
+default journal mode with a 1 ms busy timeout (exercising the retry backoff).
+Uses a temporary PRISMS_JOBS_DIR; no job management software is needed.
+
+Usage:
+
+    python examples/stress_jobdb.py [--procs 32] [--jobs 20]
+
+Exits with status 1 if any scenario fails.
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# scenario name, 'db_connection' settings
+SCENARIOS = [
+    ("wal", {'journal_mode': 'wal'}),
+    ("default journal", {}),
+    ("1 ms busy timeout", {'busy_timeout': 0.001}),
+]
+
+
+def _setup(dbpath, policy):
+    """Configure prisms_jobs in this process"""
+    from prisms_jobs import config
+    config.configure({'dbpath': dbpath, 'software': 'default', 'write_submit_script': False,
+                      'update_method': 'default', 'db_connection': policy})
+
+
+def _jobid(proc, i, njobs):
+    """ID of job i of writer process 'proc'"""
+    return str(100000 + proc*njobs + i)
+
+
+def _writer(args):
+    """Complete even jobs and error odd jobs of one writer; return number of failures"""
+    dbpath, policy, proc, njobs = args
+    _setup(dbpath, policy)
+    import prisms_jobs
+    failures = 0
+    for i in range(njobs):
+        try:
+            if i % 2 == 0:
+                prisms_jobs.complete_job(jobid=_jobid(proc, i, njobs))
+            else:
+                prisms_jobs.error_job("stress", jobid=_jobid(proc, i, njobs))
+        except Exception as e:  #pylint: disable=broad-except, invalid-name
+            print("writer", proc, "failed:", e)
+            failures += 1
+    return failures
+
+
+def run(name, policy, nprocs, njobs, tmpdir):
+    """Run one scenario; return True if no updates were lost"""
+    dbpath = os.path.join(tmpdir, name.replace(" ", "_") + ".db")
+    _setup(dbpath, policy)
+    from prisms_jobs import jobdb
+    db = jobdb.JobDB()
+    db.add_many([jobdb.job_status_dict(jobid=_jobid(proc, i, njobs), jobname="stress",
+                                       rundir=tmpdir, jobstatus="C", auto=1)
+                 for proc in range(nprocs) for i in range(njobs)])
+    db.close()
+
+    start = time.time()
+    pool = multiprocessing.Pool(nprocs)
+    try:
+        failures = sum(pool.map(_writer, [(dbpath, policy, proc, njobs)
+                                          for proc in range(nprocs)]))
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    db = jobdb.JobDB()
+    counts = dict((r[0], r[1]) for r in db.curs.execute(
+        "SELECT taskstatus, COUNT(*) FROM jobs GROUP BY taskstatus"))
+    db.close()
+    ncomplete = counts.get("Complete", 0)
+    nerror = counts.get("Error: stress", 0)
+    expected = nprocs*njobs
+    ok = failures == 0 and ncomplete + nerror == expected \
+        and ncomplete == nprocs*((njobs + 1)//2)
+    print("{0:<20} {1:>6} updates in {2:6.2f} s: {3} complete, {4} error, {5} failed writes  {6}"
+          .format(name, expected, elapsed, ncomplete, nerror, failures, "OK" if ok else "FAIL"))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test concurrent writers of a jobs database")
+    parser.add_argument('--procs', type=int, default=32, help='Number of writer processes')
+    parser.add_argument('--jobs', type=int, default=20, help='Number of jobs per writer')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="prisms_jobs_stress")
+    os.environ['PRISMS_JOBS_DIR'] = tmpdir
+    try:
+        ok = [run(name, policy, args.procs, args.jobs, tmpdir) for name, policy in SCENARIOS]
+    finally:
+        shutil.rmtree(tmpdir)
+    sys.exit(0 if all(ok) else 1)
+
+
+if __name__ == "__main__":
+    main()
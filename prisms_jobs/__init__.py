@@ -11,12 +11,15 @@ class JobsError(Exception):
         return self.jobid + ": " + self.msg
 
 # import into 'prisms_jobs'
-from prisms_jobs.job import Job
+from prisms_jobs.job import Job, JobArray
 from prisms_jobs.jobdb import JobDB, JobDBError, EligibilityError, complete_job, error_job
+from prisms_jobs.workflow import Workflow
 
 __version__ = '4.0.2'
 __all__ = [
     'Job',
+    'JobArray',
+    'Workflow',
     'JobDB',
     'JobsError',
     'JobDBError',
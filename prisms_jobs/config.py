@@ -5,10 +5,15 @@ from builtins import *
 import imp
 import json
 import os
+import re
 import six
 import socket
 import warnings
-from distutils.spawn import find_executable
+try:
+    from shutil import which as find_executable
+except ImportError:
+    # python 2
+    from distutils.spawn import find_executable
 
 import prisms_jobs
 
@@ -17,6 +22,36 @@ __software = None
 __write_submit_script = None
 __update_selection_method = None
 
+_DEFAULT_DB_CONNECTION = {
+    'journal_mode': None,
+    'synchronous': None,
+    'busy_timeout': 30.0,
+    'retries': 10,
+    'compress_scripts': True
+}
+
+_DEFAULT_STATUS_CACHE = {
+    'ttl': 15.0
+}
+
+_DEFAULT_INCREMENTAL_UPDATE = {
+    'enabled': False,
+    'full_interval': 3600.0,
+    'overlap': 60.0
+}
+
+_DEFAULT_SUBMIT_LIMITS = {
+    'total': None,
+    'queue': {},
+    'account': {}
+}
+
+# Slurm's default MaxArraySize is 1001 (indices 0-1000)
+_DEFAULT_MAX_ARRAY_SIZE = 1000
+
+# seconds that finished jobs are queried again, if job accounting lags
+_DEFAULT_ACCOUNTING_RETRY = 3600.0
+
 _IMPORT_WARNING_MSG = """\
 prisms_jobs does not detect any job management software
 and the 'PRISMS_JOBS_SOFTWARE' environment variable is not set.
@@ -79,18 +114,69 @@ def set_software(software_name=None):
     __software = software
 
 def software():
-    """The job management software interface module"""
+    """The job management software interface module
+
+    The interface module is imported on first use.
+    """
     if __software is None:
-        configure()
+        set_software(settings()['software'])
     return __software
 
 
-def _default_update_selection(curs):
-    """Select jobs with jobstatus!='C'"""
-    curs.execute("SELECT jobid FROM jobs WHERE jobstatus!='C'")
+def cached_probe(name, executable, probe):
+    """Return a detected capability of the job management software
+
+    Detected values are cached in the 'capabilities' setting of the
+    configuration file. A cached value is used as long as 'executable' is
+    found at the same path, with the same modification time, so that it is
+    detected again if the job management software is changed or upgraded.
 
-def _check_hostname_update_selection(curs):
-    """Select jobs with jobstatus!='C' and matching hostname"""
+    Args:
+        name (str): Name of the capability, for example 'torque_version'.
+        executable (str): Name of the command the capability depends on, for
+            example 'qstat'.
+        probe (function): Called without arguments to detect the capability.
+            Must return a value that can be stored as JSON.
+
+    Returns:
+        The value returned by probe, or None if 'executable' is not found.
+    """
+    path = find_executable(executable)
+    if path is None:
+        return None
+    mtime = os.path.getmtime(os.path.realpath(path))
+    cache = settings().setdefault('capabilities', {})
+    cached = cache.get(name)
+    if cached is not None and cached.get('path') == path and cached.get('mtime') == mtime:
+        return cached['value']
+    value = probe()
+    cache[name] = {'path': path, 'mtime': mtime, 'value': value}
+    try:
+        write_config()
+    except (IOError, OSError) as e:
+        warnings.warn("Could not cache " + name + " in " + config_path() + ": " + str(e))
+    return value
+
+
+def _default_update_selection(curs, retry_since=None):
+    """Select jobs with jobstatus!='C'
+
+    If 'retry_since' is given, instead select jobs with jobstatus=='C' and no
+    'finalstate', modified at or after 'retry_since' (seconds since the epoch).
+    """
+    if retry_since is None:
+        curs.execute("SELECT jobid FROM jobs WHERE jobstatus!='C'")
+    else:
+        curs.execute("SELECT jobid FROM jobs WHERE modifytime>=? AND jobstatus='C'\
+                      AND finalstate IS NULL", (int(retry_since), ))
+
+def _check_hostname_update_selection(curs, retry_since=None):
+    """Select jobs with jobstatus!='C' and matching hostname
+
+    If 'retry_since' is given, instead select jobs with jobstatus=='C', no
+    'finalstate', and matching hostname, modified at or after 'retry_since'
+    (seconds since the epoch).
+    """
     hostname = socket.gethostname()
 
     # Parse our hostname so we can only select jobs from THIS host
@@ -102,8 +188,13 @@ def _check_hostname_update_selection(curs):
     else:
         hostname_regex = hostname + ".*"
 
-    curs.execute("SELECT jobid FROM jobs WHERE jobstatus!='C' AND hostname REGEXP ?",
-                 (hostname_regex, ))
+    if retry_since is None:
+        curs.execute("SELECT jobid FROM jobs WHERE jobstatus!='C' AND hostname REGEXP ?",
+                     (hostname_regex, ))
+    else:
+        curs.execute("SELECT jobid FROM jobs WHERE modifytime>=? AND jobstatus='C'\
+                      AND finalstate IS NULL AND hostname REGEXP ?",
+                     (int(retry_since), hostname_regex))
 
 
 def set_update_selection_method(update_method=None):
@@ -234,9 +325,14 @@ def write_config(dir=None, settings=None):
         dir = config_dir()
     if settings is None:
         settings = __settings
-    with open(config_path(dir), 'w') as f:
+    # write to a temporary file and rename, so that other processes never
+    # read a partially written file
+    path = config_path(dir)
+    tmppath = path + "." + socket.gethostname() + "." + str(os.getpid())
+    with open(tmppath, 'w') as f:
         # for python2/3 compatibility don't use json.dump:
         f.write(json.dumps(settings, indent=2, ensure_ascii=False))
+    os.rename(tmppath, path)
 
 def settings():
     """Settings dictionary"""
@@ -250,6 +346,62 @@ def dbpath():
         configure()
     return __settings['dbpath']
 
+def db_connection():
+    """Jobs database connection policy dictionary
+
+    Returns the 'db_connection' settings, with default values for any that are
+    not set. See configure for details.
+    """
+    policy = dict(_DEFAULT_DB_CONNECTION)
+    policy.update(settings().get('db_connection', {}))
+    return policy
+
+def status_cache():
+    """Job status cache settings dictionary
+
+    Returns the 'status_cache' settings, with default values for any that are
+    not set. See configure for details.
+    """
+    cache = dict(_DEFAULT_STATUS_CACHE)
+    cache.update(settings().get('status_cache', {}))
+    return cache
+
+def incremental_update():
+    """Incremental update settings dictionary
+
+    Returns the 'incremental_update' settings, with default values for any
+    that are not set. See configure for details.
+    """
+    policy = dict(_DEFAULT_INCREMENTAL_UPDATE)
+    policy.update(settings().get('incremental_update', {}))
+    return policy
+
+def submit_limits():
+    """Submission limits settings dictionary
+
+    Returns the 'submit_limits' settings, with default values for any that are
+    not set. See configure for details.
+    """
+    limits = dict(_DEFAULT_SUBMIT_LIMITS)
+    limits.update(settings().get('submit_limits', {}))
+    return limits
+
+def max_array_size():
+    """Maximum number of jobs submitted in one job array
+
+    Returns the 'max_array_size' setting, or the default. See configure for
+    details.
+    """
+    return int(settings().get('max_array_size', _DEFAULT_MAX_ARRAY_SIZE))
+
+def accounting_retry():
+    """Seconds to keep querying job accounting for the final state of a job
+
+    Returns the 'accounting_retry' setting, or the default. See configure for
+    details.
+    """
+    return float(settings().get('accounting_retry', _DEFAULT_ACCOUNTING_RETRY))
+
 def configure(settings=None):
     """Set configuration
 
@@ -265,9 +417,66 @@ def configure(settings=None):
         * 'update_method': (str, default='default')
             Controls which jobs are updated when JobDB.update() is called.
             See set_update_selection_method for options.
+        * 'db_connection': (dict, optional)
+            Connection policy for the jobs database, used by JobDB.connect:
+
+            * 'journal_mode': (str, default=None) SQLite journal mode, for
+              example "wal". None leaves the database's journal mode unchanged.
+            * 'synchronous': (str, default=None) SQLite synchronous level, for
+              example "normal". None uses the SQLite default.
+            * 'busy_timeout': (float, default=30.0) Seconds to wait for a lock
+              held by another connection.
+            * 'retries': (int, default=10) Number of times to retry a write,
+              after a random backoff, if the database is still locked.
+            * 'compress_scripts': (bool, default=True) Store submit scripts
+              zlib-compressed in the jobs database.
+        * 'status_cache': (dict, optional)
+            Cache of the job status snapshot, shared by processes using this
+            configuration directory (see prisms_jobs.status_cache):
+
+            * 'ttl': (float, default=15.0) Seconds a snapshot is re-used
+              before the job management software is queried again. 0 disables
+              the cache.
+        * 'incremental_update': (dict, optional)
+            Controls polling of only the jobs that changed state by
+            JobDB.update(), if the interface supports it:
+
+            * 'enabled': (bool, default=False) Enable incremental polling.
+            * 'full_interval': (float, default=3600.0) Seconds between full
+              queries of all jobs.
+            * 'overlap': (float, default=60.0) Seconds before the previous poll
+              to query changes from, to allow for clock differences.
+        * 'submit_limits': (dict, optional)
+            Maximum numbers of jobs that may be submitted and not yet
+            completed, checked by Job.submit and JobDB.continue_job. Jobs over
+            a limit are held in the jobs database and submitted later by
+            JobDB.submit_pending (see prisms_jobs.governor):
+
+            * 'total': (int, default=None) Limit for all jobs. None for no
+              limit.
+            * 'queue': (dict, default={}) Limit for jobs in each queue, as
+              {queue: limit}.
+            * 'account': (dict, default={}) Limit for jobs charged to each
+              account, as {account: limit}.
+        * 'max_array_size': (int, default=1000)
+            Maximum number of jobs submitted in one job array by
+            JobArray.submit. Larger JobArray are submitted as several arrays.
+            Set to at most Slurm's MaxArraySize or Torque's
+            max_job_array_size.
+        * 'accounting_retry': (float, default=3600.0)
+            Job accounting (for example, Slurm's slurmdbd) may not report the
+            final state of a job until some time after it leaves the queue.
+            JobDB.update() queries it again for finished jobs without a
+            final state, until this many seconds after they were last
+            modified.
+        * 'capabilities': (dict, optional)
+            Detected capabilities of the job management software, such as the
+            Torque version, written by cached_probe. Each entry is detected
+            again if the path or modification time of its command changes.
 
     The values are then used to update:
-        * software: Module used to interface with job submission software
+        * software: Module used to interface with job submission software,
+          imported on first use
         * update_selection_method: Function used by JobDB.update()
 
     Args:
@@ -276,8 +485,9 @@ def configure(settings=None):
     """
     if settings is None:
         settings = read_config()
-    global __settings
+    global __settings, __software
     __settings = settings
-    set_software(__settings['software'])
+    # the interface module is imported by software(), on first use
+    __software = None
     set_write_submit_script(__settings['write_submit_script'])
     set_update_selection_method(__settings['update_method'])
@@ -0,0 +1,121 @@
+"""Limit the number of jobs submitted to the job management software
+
+Clusters limit how many jobs a user may have submitted at once, and
+submissions over the limit fail. The 'submit_limits' setting gives the maximum
+numbers of submitted jobs that are not yet completed: in total, per queue, and
+per account. Job.submit and JobDB.continue_job check these limits before
+submitting. Jobs over a limit are held in the 'pending' table of the jobs
+database instead, and are submitted by JobDB.submit_pending (called each
+``taskmaster`` cycle) as jobs complete.
+
+The current numbers of jobs are counted from the status snapshot of
+prisms_jobs.status_cache, plus the jobs submitted by this process since the
+snapshot was taken.
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import re
+import time
+
+from six import itervalues
+
+from prisms_jobs import config, status_cache
+
+# [snapshottime, {(kind, name): count}], for kind in 'total', 'queue', 'account'
+__counts = None
+
+
+def enabled():
+    """Return True if any submission limits are set"""
+    limits = config.submit_limits()
+    return limits['total'] is not None or bool(limits['queue']) or bool(limits['account'])
+
+
+def _keys(queue, account):
+    """Return the count keys a job in 'queue' charged to 'account' counts against"""
+    return [('total', None), ('queue', queue), ('account', account)]
+
+
+def counts():
+    """Return the numbers of submitted jobs that are not yet completed
+
+    The counts are re-read from the status snapshot once it is older than the
+    'ttl' of the 'status_cache' setting.
+
+    Returns:
+        dict: {(kind, name): count}, with kind one of 'total', 'queue', or
+            'account', and name the queue or account name (None for 'total').
+    """
+    global __counts
+    ttl = config.status_cache()['ttl']
+    if __counts is None or time.time() - __counts[0] >= ttl:
+        snapshottime, status = status_cache.snapshot()
+        current = dict()
+        for jobstatus in itervalues(status):
+            if jobstatus.get("jobstatus") == "C":
+                continue
+            for key in _keys(jobstatus.get("queue"), jobstatus.get("account")):
+                current[key] = current.get(key, 0) + 1
+        __counts = [snapshottime, current]
+    return __counts[1]
+
+
+def has_capacity(queue=None, account=None, njobs=1):
+    """Return True if 'njobs' more jobs may be submitted without exceeding a limit
+
+    Args:
+        queue (str, optional): Queue the jobs are submitted to.
+        account (str, optional): Account the jobs are charged to.
+        njobs (int, optional, default=1): Number of jobs.
+    """
+    return fits([(queue, account)]*njobs)
+
+
+def fits(requests):
+    """Return True if all of some jobs may be submitted without exceeding a limit
+
+    Args:
+        requests (List((str, str))): The (queue, account) of each job, as from
+            script_resources. Either may be None.
+    """
+    if not enabled():
+        return True
+    limits = config.submit_limits()
+    current = counts()
+    needed = dict()
+    for queue, account in requests:
+        for key in _keys(queue, account):
+            needed[key] = needed.get(key, 0) + 1
+    for key, njobs in needed.items():
+        kind, name = key
+        limit = limits['total'] if kind == 'total' else limits[kind].get(name)
+        if limit is not None and current.get(key, 0) + njobs > limit:
+            return False
+    return True
+
+
+def record(queue=None, account=None, njobs=1):
+    """Count jobs submitted by this process, until the next status snapshot
+
+    Args:
+        queue (str, optional): Queue the jobs were submitted to.
+        account (str, optional): Account the jobs are charged to.
+        njobs (int, optional, default=1): Number of jobs.
+    """
+    if __counts is None:
+        return
+    for key in _keys(queue, account):
+        __counts[1][key] = __counts[1].get(key, 0) + njobs
+
+
+def script_resources(substr):
+    """Return the (queue, account) requested by a submit script
+
+    Reads ``#SBATCH -p/--partition`` and ``#SBATCH -A/--account``, or
+    ``#PBS -q`` and ``#PBS -A``. Values not found are None.
+    """
+    # '#PBS -p' is a priority, and '#SBATCH -q' a QOS, not the queue
+    queue = re.search(r"^#(?:SBATCH\s+(?:-p|--partition=)|PBS\s+-q)\s*(\S+)", substr, re.MULTILINE)
+    account = re.search(r"^#(?:SBATCH|PBS)\s+(?:-A|--account=)\s*(\S+)", substr, re.MULTILINE)
+    return (queue.group(1) if queue else None, account.group(1) if account else None)
@@ -8,10 +8,28 @@ one of the included interfaces for specifics of arguments and return values.
 * job_id(all=False, name=None): Get job ID(s)
 * job_rundir(): Get job run directories
 * job_status(jobid=None): Get job status
-* submit(substr): Submit a job
+* submit(substr, rundir=None, dependency=None): Submit a job, from directory
+  rundir (default: current directory), to start once the dependency (for
+  example "afterany:123") is satisfied
 * delete(jobid): Delete a job
 * hold(jobid): Hold / delay a job
 * release(jobid): Release a job
 * alter(jobid, arg): Alter job options
 * read(jobid, arg): Read prisms_jobs.Job instance from a submit script
+
+Interfaces may also have the following optional functions:
+
+* job_accounting(jobid): Get the final state, exit code, and timing of
+  finished jobs. Jobs not found, or not yet in a final state, are left out.
+  Used by JobDB.update() for jobs that are no longer found by job_status,
+  and again on later updates for jobs it left out.
+* job_status_changes(since, jobid=None): Get the status of jobs that changed
+  state since the time of the previous query, including jobs that have
+  finished (jobstatus "C"). Jobs not returned are assumed unchanged. Used by
+  JobDB.update() if the 'incremental_update' setting is enabled.
+* array_jobid(jobid, index): Get the ID of an element of a job array, given
+  the ID returned by submit. Interfaces with array_jobid must also write the
+  array indices of a prisms_jobs.Job with an 'array' attribute in sub_string,
+  and include array elements individually in job_status. Used by
+  prisms_jobs.JobArray.
 """
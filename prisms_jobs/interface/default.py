@@ -18,7 +18,7 @@ def job_status(jobid=None):
     """Raise exception"""
     raise Exception("No job management software found")
 
-def submit(substr):
+def submit(substr, rundir=None, dependency=None):
     """Raise exception"""
     raise Exception("No job management software found")
 
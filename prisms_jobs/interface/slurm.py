@@ -16,7 +16,7 @@ from io import StringIO
 ### Internal ###
 import prisms_jobs
 from prisms_jobs import JobsError
-from prisms_jobs.misc import getlogin, run, seconds
+from prisms_jobs.misc import getlogin, run, run_stream, seconds
 
 def _squeue(jobid=None, username=getlogin(), full=False, sformat=None):    #pylint: disable=unused-argument
     """Return the stdout of squeue minus the header lines.
@@ -32,61 +32,168 @@ def _squeue(jobid=None, username=getlogin(), full=False, sformat=None):    #pyli
 
     # If Full is true, we need to use scontrol:
     if full is True:
-        if jobid is None:
-            if username is None:
-                # Clearly we want ALL THE JOBS
-                sopt = ["scontrol", "show", "job"]
-
-                # Submit the command
-                # Nothing to strip, as scontrol provides no headers
-                return run(sopt)[0]
-
-            else:
-                # First, get jobids that belong to that username using
-                # squeue (-h strips the header)
-                sopt = ["squeue", "-h", "-u", username]
-
-                qsout = run(sopt)[0]
-
-                # Get the jobids
-                jobid = []
-                for line in StringIO(qsout):
-                    jobid += [line.rstrip("\n")]
-                # Great, now we have some jobids to pass along
-
-        # Ensure the jobids are a list, even if they're a list of 1...
-        if not isinstance(jobid, list) and jobid is not None:
-            jobid = [jobid]
-        if isinstance(jobid, list):
-            opt = ["scontrol", "show", "job"]
-            sreturn = ""
-            for my_id in jobid:
-                sopt = opt + [str(my_id)]
-                sreturn = sreturn + run(sopt)[0] + "\n"
-
-            return sreturn
+        # Nothing to strip, as scontrol provides no headers
+        return "".join(_scontrol_show_job(jobid=jobid, username=username))
 
     else:
         sopt = ["squeue", "-h"]
         if username is not None:
             sopt += ["-u", username]
         if jobid is not None:
-            sopt += ["--job="]
             if isinstance(jobid, list):
-                sopt += ["'"+",".join([str(i) for i in jobid])+"'"]
+                sopt += ["--jobs=" + ",".join([str(i) for i in jobid])]
             else:
-                sopt += [str(jobid)]
+                sopt += ["--jobs=" + str(jobid)]
         if sformat is not None:
-            sopt += ["-o", "'" + sformat + "'"]
+            sopt += ["-o", sformat]
         else:
             if jobid is None and username is None:
-                sopt += ["-o", "'%i %u %P %j %U %D %C %m %l %t %M'"]
+                sopt += ["-o", "%i %u %P %j %U %D %C %m %l %t %M"]
             else:
-                sopt += ["-o", "'%i %j %u %M %t %P'"]
+                sopt += ["-o", "%i %j %u %M %t %P"]
 
         return run(sopt)[0]
 
 
+def _scontrol_records(lines):
+    """Split the output of ``scontrol show job`` into one str per job
+
+    Records are separated by blank lines, and each keeps its trailing newline.
+
+    Args:
+        lines (iterable of str): Lines of ``scontrol show job`` output
+
+    Returns:
+        A generator of str, one per record
+    """
+    record = []
+    for line in lines:
+        if line.strip():
+            record.append(line)
+        elif record:
+            yield "".join(record)
+            record = []
+    if record:
+        yield "".join(record)
+
+
+def _scontrol_show_job(jobid=None, username=getlogin()):
+    """Stream the output of ``scontrol show job`` for some jobs
+
+    All jobs are queried with one scontrol call, rather than one per job, and
+    only the records for the requested jobs or user are kept. Records are
+    separated by blank lines. Used only for the full record of jobs (see
+    _squeue); job_status uses ``squeue``, which filters by user itself.
+
+    Args:
+        jobid (None, str, or List(str)): IDs of jobs to query. None for all
+            jobs of 'username'.
+        username (str, optional): If jobid is None, query jobs of this user.
+            None for all jobs. By default, the current user.
+
+    Returns:
+        A generator of str, the lines of the selected records
+    """
+    if jobid is not None and not isinstance(jobid, list):
+        for line in run_stream(["scontrol", "show", "job", str(jobid)]):
+            yield line
+        return
+
+    lines = run_stream(["scontrol", "show", "job"])
+    if jobid is None and username is None:
+        for line in lines:
+            yield line
+        return
+    if jobid is not None:
+        jobid = set([str(i) for i in jobid])
+    for record in _scontrol_records(lines):
+        m = re.match(r"\s*JobId=(\S*)", record)   #pylint: disable=invalid-name
+        if m is None:
+            continue
+        if jobid is not None:
+            if m.group(1) not in jobid and jobid.isdisjoint(_header_jobids(record.split("\n", 1)[0])):
+                continue
+        elif not re.search(r"\sUserId=" + re.escape(username) + r"\(", record):
+            continue
+        for line in StringIO(record):
+            yield line
+        yield "\n"
+
+
+def _array_jobids(arrayjobid, tasks):
+    """Expand a job array task specification to job IDs
+
+    Args:
+        arrayjobid (str): ID of the array job. Ex: ``"123"``
+        tasks (str): Slurm array task specification. Ex: ``"1,3,5-7:2%2"``
+
+    Returns:
+        List(str): IDs of the array elements. Ex: ``["123_1", "123_3", "123_5", "123_7"]``
+    """
+    jobid = []
+    for part in tasks.split("%")[0].split(","):
+        m = re.match(r"(\d+)(?:-(\d+)(?::(\d+))?)?$", part)  #pylint: disable=invalid-name
+        if m is None:
+            continue
+        first = int(m.group(1))
+        last = int(m.group(2)) if m.group(2) is not None else first
+        step = int(m.group(3)) if m.group(3) is not None else 1
+        jobid += [arrayjobid + "_" + str(i) for i in range(first, last + 1, step)]
+    return jobid
+
+
+def _header_jobids(line):
+    """Return the job IDs described by the first line of a ``scontrol show job`` record
+
+    Array elements are identified as "<ArrayJobId>_<ArrayTaskId>", as by
+    ``sbatch`` and ``squeue``, rather than by their own JobId. A pending
+    array may be one record listing a range of tasks, which are expanded.
+
+    Returns:
+        List(str): Job IDs, or an empty list if 'line' is not a header line
+    """
+    m = re.match(r"\s*JobId=(\S*)", line)   #pylint: disable=invalid-name
+    if m is None:
+        return []
+    arrayjobid = re.search(r"\sArrayJobId=(\d+)", line)
+    tasks = re.search(r"\sArrayTaskId=(\S+)", line)
+    if arrayjobid is not None and tasks is not None:
+        return _array_jobids(arrayjobid.group(1), tasks.group(1))
+    return [m.group(1)]
+
+
+def _jobstatus(state):
+    """Convert a Slurm job state ("RUNNING", "PENDING", etc.) to a jobstatus ("R", "Q", etc.)"""
+    if state == "RUNNING" or state == "CONFIGURING":
+        return "R"
+    elif state in ["BOOT_FAIL", "FAILED", "NODE_FAIL", "CANCELLED", "COMPLETED", "PREEMPTED",
+                   "TIMEOUT", "OUT_OF_MEMORY", "DEADLINE"]:
+        return "C"
+    elif state == "COMPLETING" or state == "STOPPED":
+        return "E"
+    elif state == "PENDING" or state == "SPECIAL_EXIT":
+        return "Q"
+    elif state == "SUSPENDED":
+        return "S"
+    else:
+        return "?"
+
+
+# fields of the ``squeue`` output parsed by job_status; the job name must be last
+_SQUEUE_FIELDS = ["%i", "%T", "%D", "%C", "%l", "%M", "%S", "%P", "%a", "%j"]
+
+def _duration(value):
+    """Convert a Slurm duration ("[DD-[HH:]]MM:SS") to seconds as int
+
+    Returns None for "UNLIMITED", "INVALID", "NOT_SET", etc.
+    """
+    m = re.match(r"(?:(\d+)-)?(?:(\d+):)?(\d+):(\d+)$", value.strip())  #pylint: disable=invalid-name
+    if m is None:
+        return None
+    days, hrs, mns, scs = [int(g) if g is not None else 0 for g in m.groups()]
+    return ((days*24 + hrs)*60 + mns)*60 + scs
+
+
 ### Required ###
 
 NAME = 'slurm'
@@ -103,6 +210,8 @@ def sub_string(job):
     ###    auto
     jobstr = "#!/bin/sh\n"
     jobstr += "#SBATCH -J {0}\n".format(job.name)
+    if getattr(job, "array", None) is not None:
+        jobstr += "#SBATCH --array={0}\n".format(job.array)
     if job.account is not None:
         jobstr += "#SBATCH -A {0}\n".format(job.account)
     jobstr += "#SBATCH -t {0}\n".format(job.walltime)
@@ -134,7 +243,8 @@ def job_id(all=False, name=None):       #pylint: disable=redefined-builtin
 
     Args:
         all (bool): If True, use ``squeue`` to query all user jobs. Else, check
-        ``SLURM_JOBID`` environment variable for ID of current job.
+        ``SLURM_JOBID`` environment variable for ID of current job. For an
+        element of a job array, the ID is "<SLURM_ARRAY_JOB_ID>_<SLURM_ARRAY_TASK_ID>".
 
         name (str): If all==True, use name to filter results.
 
@@ -149,13 +259,15 @@ def job_id(all=False, name=None):       #pylint: disable=redefined-builtin
         sout = _squeue()
         for line in StringIO(sout):
             if name is not None:
-                if line.split()[3] == name:
+                if line.split()[1] == name:
                     jobid.append((line.split()[0]).split(".")[0])
             else:
                 jobid.append((line.split()[0]).split(".")[0])
         return jobid
     else:
-        if 'SLURM_JOBID' in os.environ:
+        if 'SLURM_ARRAY_JOB_ID' in os.environ and 'SLURM_ARRAY_TASK_ID' in os.environ:
+            return os.environ['SLURM_ARRAY_JOB_ID'] + "_" + os.environ['SLURM_ARRAY_TASK_ID']
+        elif 'SLURM_JOBID' in os.environ:
             return os.environ['SLURM_JOBID'].split(".")[0]
         else:
             return None
@@ -173,20 +285,27 @@ def job_rundir(jobid):
     """
     rundir = dict()
 
-    if isinstance(jobid, (list)):
-        for i in jobid:
-            stdout = _squeue(jobid=i, full=True)
-            match = re.search("WorkDir=(.*),", stdout)
+    if not isinstance(jobid, list):
+        jobid = [jobid]
+    jobid = set([str(i) for i in jobid])
+    # one scontrol call for all of the jobs
+    query = sorted(jobid) if len(jobid) > 1 else list(jobid)[0]
+    for record in _scontrol_records(_scontrol_show_job(jobid=query)):
+        match = re.search("WorkDir=(.*),", record) or re.search(r"WorkDir=(\S*)", record)
+        if match is None:
+            continue
+        for i in jobid.intersection(_header_jobids(record.split("\n", 1)[0])):
             rundir[i] = match.group(1)
-    else:
-        stdout = _squeue(jobid=jobid, full=True)
-        match = re.search("WorkDir=(.*),", stdout)
-        rundir[i] = match.group(1)
     return rundir
 
 def job_status(jobid=None):
     """Return job status using ``squeue``
 
+    Only the current user's jobs are queried, filtered by ``squeue`` itself
+    (``-u``, and ``--jobs`` if 'jobid' is given), so the output does not
+    grow with the number of jobs on the cluster. Elements of job arrays are
+    listed one per line (``-r``), as "<ArrayJobId>_<ArrayTaskId>".
+
     Args:
         jobid (None, str, or List(str)):
             IDs of jobs to query for status. None for all user jobs.
@@ -198,126 +317,186 @@ def job_status(jobid=None):
             The outer dict uses jobid as key; the inner dict contains:
 
             ================    ======================================================
-            "name"              Job name
+            "jobname"           Job name
             "nodes"             Number of nodes
             "procs"             Number of processors
-            "walltime"          Walltime
+            "walltime"          Walltime, in seconds as int, or None if unlimited
             "jobstatus"         status ("Q","C","R", etc.)
-            "qstatstr"          result of ``squeue -f jobid``, None if not found
+            "qstatstr"          summary of the ``squeue`` output, None if not found
             "elapsedtime"       None if not started, else seconds as int
             "starttime"         None if not started, else seconds since epoch as int
             "completiontime"    None if not completed, else seconds since epoch as int
+            "queue"             Partition
+            "account"           Account, or None
             ================    ======================================================
 
     """
     status = dict()
 
-    sout = _squeue(jobid=jobid, full=True)
-
-    jobstatus = {
-        "jobid" : None,
-        "name" : None,
-        "nodes" : None,
-        "procs" : None,
-        "walltime" : None,
-        "qstatstr" : None,
-        "elapsedtime" : None,
-        "starttime" : None,
-        "completiontime" : None,
-        "jobstatus" : None,
-        "cluster": None}
-
-    for line in StringIO(sout):
-        # Check for if we're at a new job header line
-        m = re.search(r"JobId=\s*(\S*)\s*", line)      #pylint: disable=invalid-name
-        if m:
-            if jobstatus["jobstatus"] is not None:
-                status[jobstatus["jobid"]] = jobstatus
-            jobstatus = {"jobid" : None, "name" : None, "nodes" : None, "procs" : None, "walltime" : None, "qstatstr" : None, "elapsedtime" : None, "starttime" : None, "completiontime" : None, "jobstatus" : None, "cluster" : None}
-            jobstatus["jobid"] = m.group(1)
-
-            # Grab the job name
-            m = re.match(r"\S*\s*Name=\s*(.*)\s?", line)       #pylint: disable=invalid-name
-            if m:
-                jobstatus["jobname"] = m.group(1)
-
-            # Save the full output
-            jobstatus["qstatstr"] = line
+    sopt = ["squeue", "-h", "-r", "-u", getlogin(), "-o", "|".join(_SQUEUE_FIELDS)]
+    if jobid is not None:
+        if not isinstance(jobid, list):
+            jobid = [jobid]
+        if not len(jobid):
+            return status
+        sopt += ["--jobs=" + ",".join([str(i) for i in jobid])]
+
+    for line in run_stream(sopt):
+        # the job name is last, so that it may contain the delimiter;
+        # other lines (errors, such as "Invalid job id specified") are skipped
+        fields = line.rstrip("\n").split("|", len(_SQUEUE_FIELDS) - 1)
+        if len(fields) != len(_SQUEUE_FIELDS) or not re.match(r"\d+(_\d+)?$", fields[0]):
             continue
+        key, state, nodes, procs, timelimit, runtime, start, partition, account, name = fields
+        jobstatus = {
+            "jobid": key,
+            "jobname": name,
+            "nodes": int(nodes) if nodes.isdigit() else None,
+            "procs": int(procs) if procs.isdigit() else None,
+            "walltime": _duration(timelimit),
+            "qstatstr": ("JobId={0} JobName={1} JobState={2} NumNodes={3} NumCPUs={4} "
+                         "TimeLimit={5} RunTime={6} StartTime={7} Partition={8} Account={9}\n"
+                         .format(key, name, state, nodes, procs, timelimit, runtime, start,
+                                 partition, account)),
+            "elapsedtime": None,
+            "starttime": None,
+            "completiontime": None,
+            "jobstatus": _jobstatus(state),
+            "queue": partition or None,
+            "account": account if account not in ("", "(null)") else None}
+        # for pending jobs, %S is the expected start time
+        if jobstatus["jobstatus"] != "Q":
+            jobstatus["elapsedtime"] = _duration(runtime)
+            jobstatus["starttime"] = _sacct_time(start)
+        status[key] = jobstatus
 
-        jobstatus["qstatstr"] += line
+    return status
 
-        # Look for the Nodes/PPN Info
-        m = re.search(r"NumNodes=\s*([0-9]*)\s", line) #pylint: disable=invalid-name
-        if m:
-            jobstatus["nodes"] = int(m.group(1))
-            m = re.match(r"\S*\s*NumCPUs=\s*([0-9]*)\s", line) #pylint: disable=invalid-name
-            if m:
-                jobstatus["procs"] = int(m.group(1))
-            continue
+def _sacct_time(value):
+    """Convert a ``sacct`` time ("2024-01-31T13:45:00") to seconds since the epoch
 
+    Returns None for "Unknown", "None", etc.
+    """
+    try:
+        t = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")  #pylint: disable=invalid-name
+    except ValueError:
+        return None
+    return int(time.mktime(t.timetuple()))
 
-        # Look for timing info
-        m = re.search(r"RunTime=\s*([0-9]*:[0-9]*:[0-9]*)\s", line) #pylint: disable=invalid-name
-        if m:
-            if m.group(1) == "Unknown":
-                continue
-            hrs, mns, scs = m.group(1).split(":")
-            runtime = datetime.timedelta(hours=int(hrs), minutes=int(mns), seconds=int(scs))
-            jobstatus["elapsedtime"] = runtime.seconds
-
-            m = re.match(r"\S*\s*TimeLimit=\s*([0-9]*:[0-9]*:[0-9]*)\s", line) #pylint: disable=invalid-name
-            if m:
-                walltime = datetime.timedelta(hours=int(hrs), minutes=int(mns), seconds=int(scs))
-                jobstatus["walltime"] = walltime.seconds
-            continue
+def job_accounting(jobid, batch_size=500):
+    """Return the final state of finished jobs using ``sacct``
 
-        # Grab the job start time
-        m = re.search(r"StartTime=\s*([0-9]*\-[0-9]*\-[0-9]*T[0-9]*:[0-9]*:[0-9]*)\s", line) #pylint: disable=invalid-name
-        if m:
-            if m.group(1) == "Unknown":
-                continue
-            year, month, day = m.group(1).split("T")[0].split("-")
-            hrs, mns, scs = m.group(1).split("T")[1].split(":")
-            starttime = datetime.datetime(year=int(year), month=int(month), day=int(day), hour=int(hrs), minute=int(mns), second=int(scs))
-            jobstatus["starttime"] = time.mktime(starttime.timetuple())
-            continue
+    Jobs are queried in batches of 'batch_size' jobs per ``sacct`` call. Jobs
+    not found by ``sacct`` (for example, if accounting is disabled), or not
+    yet in a terminal state (because ``slurmdbd`` lags the controller), are not
+    included in the result.
 
-        # Grab the job status
-        m = re.search(r"JobState=\s*([a-zA-Z]*)\s", line) #pylint: disable=invalid-name
-        if m:
-            my_status = m.group(1)
-            if my_status == "RUNNING" or my_status == "CONFIGURING":
-                jobstatus["jobstatus"] = "R"
-            elif my_status == "BOOT_FAIL" or my_status == "FAILED" or my_status == "NODE_FAIL" or my_status == "CANCELLED" or my_status == "COMPLETED" or my_status == "PREEMPTED" or my_status == "TIMEOUT":
-                jobstatus["jobstatus"] = "C"
-            elif my_status == "COMPLETING" or my_status == "STOPPED":
-                jobstatus["jobstatus"] = "E"
-            elif my_status == "PENDING" or my_status == "SPECIAL_EXIT":
-                jobstatus["jobstatus"] = "Q"
-            elif my_status == "SUSPENDED":
-                jobstatus["jobstatus"] = "S"
-            else:
-                jobstatus["jobstatus"] = "?"
+    Args:
+        jobid (List(str)): IDs of finished jobs
+        batch_size (int, optional, default=500): Number of jobs per ``sacct`` call
+
+    Returns:
+
+        dict of dict:
+
+            The outer dict uses jobid as key; the inner dict contains:
+
+            ================    ======================================================
+            "finalstate"        Final job state ("COMPLETED", "TIMEOUT", "FAILED", etc.)
+            "exitcode"          Exit code, as "returncode:signal"
+            "elapsedtime"       Elapsed time, in seconds as int
+            "starttime"         None if not started, else seconds since epoch as int
+            "completiontime"    None if unknown, else seconds since epoch as int
+            ================    ======================================================
+
+    """
+    acct = dict()
+    jobid = [str(j) for j in jobid]
+    for i in range(0, len(jobid), batch_size):
+        stdout, _, returncode = run(["sacct", "-n", "-P", "-X", "-j", ",".join(jobid[i:i+batch_size]),
+                                     "--format=JobID,State,ExitCode,ElapsedRaw,Start,End"])
+        if returncode != 0:
             continue
+        for line in StringIO(stdout):
+            fields = line.rstrip("\n").split("|")
+            if len(fields) != 6:
+                continue
+            key, state, exitcode, elapsed, start, end = fields
+            # "CANCELLED by 1234" -> "CANCELLED"
+            state = state.split()[0] if state.strip() else "?"
+            # while slurmdbd lags, a finished job may still be "RUNNING", etc.
+            if _jobstatus(state) != "C":
+                continue
+            acct[key] = {
+                "finalstate": state,
+                "exitcode": exitcode,
+                "elapsedtime": int(elapsed) if elapsed.isdigit() else None,
+                "starttime": _sacct_time(start),
+                "completiontime": _sacct_time(end)}
+    return acct
 
-        # Grab the cluster/allocating node:
-        m = re.search(r"AllocNode:\s*.*=(.*):.*", line) #pylint: disable=invalid-name
-        if m:
-            raw_str = m.group(1)
-            m = re.search(r"(.*?)(?=[^a-zA-Z0-9]*login.*)", raw_str)    #pylint: disable=invalid-name
-            if m:
-                jobstatus["cluster"] = m.group(1)
-            else:
-                jobstatus["cluster"] = raw_str
+def job_status_changes(since, jobid=None, username=getlogin()):
+    """Return the status of jobs that changed state since a given time, using ``sacct``
 
+    A job changed state if it was submitted, started, or ended at or after
+    'since'. Jobs that did not change state are not included.
 
-    if jobstatus["jobstatus"] is not None:
-        status[jobstatus["jobid"]] = jobstatus
+    Args:
+        since (float): Time, in seconds since the epoch, of the previous query.
+        jobid (List(str), optional): IDs of jobs being tracked. Not needed
+            by Slurm, which finds all of the user's changed jobs.
+        username (str, optional): Query jobs of this user. By default, the
+            current user.
 
+    Returns:
+
+        dict of dict:
+
+            The outer dict uses jobid as key; the inner dict contains the
+            keys of the job_status result, with "qstatstr" None. Jobs that have
+            finished (jobstatus "C") also include the keys of the
+            job_accounting result.
+
+    """
+    status = dict()
+    opt = ["sacct", "-n", "-P", "-X", "-u", username,
+           "-S", time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(since)),
+           "--format=JobID,State,ExitCode,ElapsedRaw,Submit,Start,End,NNodes,NCPUS,TimelimitRaw,JobName"]
+    for line in run_stream(opt):
+        # JobName is last, so that it may contain the delimiter
+        fields = line.rstrip("\n").split("|", 10)
+        if len(fields) != 11:
+            continue
+        key, state, exitcode, elapsed, submit, start, end, nodes, procs, timelimit, name = fields
+        state = state.split()[0] if state.strip() else "?"
+        submittime, starttime, endtime = _sacct_time(submit), _sacct_time(start), _sacct_time(end)
+        if max(t or 0 for t in (submittime, starttime, endtime)) < since:
+            continue
+        jobstatus = {
+            "jobid": key,
+            "jobname": name,
+            "nodes": int(nodes) if nodes.isdigit() else None,
+            "procs": int(procs) if procs.isdigit() else None,
+            "walltime": int(timelimit)*60 if timelimit.isdigit() else None,
+            "qstatstr": None,
+            "elapsedtime": int(elapsed) if elapsed.isdigit() else None,
+            "starttime": starttime,
+            "completiontime": None,
+            "jobstatus": _jobstatus(state)}
+        if jobstatus["jobstatus"] == "C":
+            jobstatus["completiontime"] = endtime
+            jobstatus["exitcode"] = exitcode
+            jobstatus["finalstate"] = state
+        # a pending job array is listed once, as "123_[0-99%10]"
+        m = re.match(r"(\d+)_\[(.*)\]$", key)    #pylint: disable=invalid-name
+        if m:
+            for i in _array_jobids(m.group(1), m.group(2)):
+                status[i] = dict(jobstatus, jobid=i)
+        else:
+            status[key] = jobstatus
     return status
 
-def submit(substr, write_submit_script=None):
+def submit(substr, write_submit_script=None, rundir=None, dependency=None):
     """Submit a job using ``sbatch``.
 
     Args:
@@ -325,6 +504,11 @@ def submit(substr, write_submit_script=None):
         write_submit_script (bool, optional): If true, submit via file skipping
             lines containing '#SBATCH -J'; otherwise, submit via commandline. If
             not specified, uses ``prisms_jobs.config['write_submit_script']``.
+        rundir (str, optional): Directory to submit the job from, and run it 
+            in. By default, the current working directory. The submit script
+            file, if written, is written in this directory.
+        dependency (str, optional): Only start the job once the dependency is
+            satisfied. Ex: ``"afterany:123"`` or ``"afterok:123:124"``.
 
 
     Returns:
@@ -345,21 +529,26 @@ def submit(substr, write_submit_script=None):
     if write_submit_script is None:
         write_submit_script = prisms_jobs.config.write_submit_script()
 
+    opt = [] if rundir is None else ["--chdir=" + rundir]
+    if dependency is not None:
+        opt += ["--dependency=" + dependency]
+
     if write_submit_script:
-        if os.path.exists(jobname):
+        path = jobname if rundir is None else os.path.join(rundir, jobname)
+        if os.path.exists(path):
             index = 0
-            while os.path.exists(jobname + ".bak." + str(index)):
+            while os.path.exists(path + ".bak." + str(index)):
                 index += 1
-            print("Backing up existing submit script:", jobname, "->", jobname + ".bak." + str(index))
-            os.rename(jobname, jobname + ".bak." + str(index))
+            print("Backing up existing submit script:", path, "->", path + ".bak." + str(index))
+            os.rename(path, path + ".bak." + str(index))
         # write submit script, without -N line
-        with open(jobname, 'w') as f:
+        with open(path, 'w') as f:
             for line in substr.splitlines():
                 if not re.search(r"SBATCH\s+-J\s+(.*)", line):
                     f.write(line + '\n')
-        stdout, stderr, returncode = run(["sbatch", jobname])  #pylint: disable=unused-variable
+        stdout, stderr, returncode = run(["sbatch"] + opt + [jobname], cwd=rundir)  #pylint: disable=unused-variable
     else:
-        stdout, stderr, returncode = run(["sbatch"], input=substr, stdin=subprocess.PIPE)  #pylint: disable=unused-variable
+        stdout, stderr, returncode = run(["sbatch"] + opt, input=substr, stdin=subprocess.PIPE, cwd=rundir)  #pylint: disable=unused-variable
     print(stdout[:-1])
     if re.search("error", stdout):
         raise JobsError(0, "Submission error.\n" + stdout + "\n" + stderr)
@@ -367,6 +556,18 @@ def submit(substr, write_submit_script=None):
         jobid = stdout.rstrip().split()[-1]
         return jobid
 
+def array_jobid(jobid, index):
+    """Return the ID of an element of a job array
+
+    Args:
+        jobid (str): ID of the array job, as returned by submit. Ex: ``"123"``
+        index (int): Array index. Ex: 4
+
+    Returns:
+        str: ID of the array element. Ex: ``"123_4"``
+    """
+    return "{0}_{1}".format(jobid, index)
+
 def delete(jobid):
     """``scancel`` a job.
 
@@ -2,28 +2,25 @@
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 from builtins import *
 
-import datetime
 import os
 import re
 import subprocess
 import sys
 import time
 
-from distutils.spawn import find_executable
 from io import StringIO
+from xml.etree import ElementTree
 from six import iteritems, string_types
 
 import prisms_jobs
-from prisms_jobs import JobsError
-from prisms_jobs.misc import getlogin, run, seconds
+from prisms_jobs import JobsError, config
+from prisms_jobs.misc import getlogin, run, run_stream, seconds
 
 ### Internal ###
 
 
-def _getversion():
-    """Returns the torque version as string or None if no ``qstat`` """
-    if find_executable("qstat") is None:
-        return None
+def _probe_version():
+    """Returns the torque version as string, using ``qstat --version``"""
     opt = ["qstat", "--version"]
 
     # call 'qstat' using subprocess
@@ -32,22 +29,40 @@ def _getversion():
     # return the version number
     return stdout.rstrip("\n").lower().lstrip("version: ")
 
-torque_version = _getversion()
+__torque_version = None
 
+def _getversion():
+    """Returns the torque version as string or None if no ``qstat``
 
-def _qstat(jobid=None, username=getlogin(), full=False):
-    """Return the stdout of ``qstat`` minus the header lines.
+    The version is detected on first use, rather than on import, and cached in
+    the configuration file (see prisms_jobs.config.cached_probe).
+    """
+    global __torque_version
+    if __torque_version is None:
+        __torque_version = config.cached_probe('torque_version', 'qstat', _probe_version)
+    return __torque_version
 
-       By default, 'username' is set to the current user.
-       'full' is the '-f' option
-       'jobid' is a string or list of strings of job ids
 
-    Returns:
-        str: the text of qstat, minus the header lines
-    """
+def _version_tuple(version):
+    """Returns the leading numbers of a version string as a tuple of int"""
+    m = re.match(r"(\d+(?:\.\d+)*)", version or "")  #pylint: disable=invalid-name
+    if m is None:
+        return ()
+    return tuple(int(x) for x in m.group(1).split("."))
+
+# XML output ('qstat -f -x') is used for Torque versions >= this
+_XML_VERSION = (2, 5)
+
+def _use_xml():
+    """True if the detected torque version supports ``qstat -f -x``"""
+    return _version_tuple(_getversion()) >= _XML_VERSION
+
+
+def _qstat_opt(jobid=None, username=getlogin(), full=False):
+    """Return the ``qstat`` command for _qstat, or None if no jobs would be found"""
 
     # -u and -f contradict in earlier versions of Torque
-    if full and username is not None and int(torque_version.split(".")[0]) < 5 and jobid is None:
+    if full and username is not None and _version_tuple(_getversion()) < (5,) and jobid is None:
         # First get all jobs by the user
         qopt = ["qselect"]
         qopt += ["-u", username]
@@ -59,6 +74,8 @@ def _qstat(jobid=None, username=getlogin(), full=False):
         jobid = []
         for line in StringIO(stdout):
             jobid += [line.rstrip("\n")]
+        if len(jobid) == 0:
+            return None
 
     opt = ["qstat"]
     # If there are jobid(s), you don't need a username
@@ -68,8 +85,9 @@ def _qstat(jobid=None, username=getlogin(), full=False):
     elif username is not None and jobid is not None and not full:
         opt += ["-a"]
     # By this point we're guaranteed torque ver >= 5.0, so -u and -f are safe together
+    # -t lists the elements of job arrays individually
     if full:
-        opt += ["-f"]
+        opt += ["-f", "-t"]
     if jobid is not None:
         if isinstance(jobid, string_types):
             jobid = [jobid]
@@ -79,6 +97,22 @@ def _qstat(jobid=None, username=getlogin(), full=False):
             print("Error in prisms_jobs.interface.torque.qstat(). type(jobid):", type(jobid))
             sys.exit()
         opt += jobid
+    return opt
+
+
+def _qstat(jobid=None, username=getlogin(), full=False):
+    """Return the stdout of ``qstat`` minus the header lines.
+
+       By default, 'username' is set to the current user.
+       'full' is the '-f' option
+       'jobid' is a string or list of strings of job ids
+
+    Returns:
+        str: the text of qstat, minus the header lines
+    """
+    opt = _qstat_opt(jobid=jobid, username=username, full=full)
+    if opt is None:
+        return ""
 
     # call 'qstat' using subprocess
     stdout, stderr, returncode = run(opt)        #pylint: disable=unused-variable
@@ -92,6 +126,51 @@ def _qstat(jobid=None, username=getlogin(), full=False):
     # return the remaining text
     return sout.read()
 
+
+def _qstat_xml(jobid=None, username=getlogin()):
+    """Parse ``qstat -f -x`` output incrementally, as the subprocess writes it
+
+    Each <Job> element is cleared once parsed, so memory use does not grow
+    with the number of jobs.
+
+    Returns:
+        A generator of (jobid, attributes) tuples, with 'attributes' a dict of
+        str using the ``qstat -f`` names ("Resource_List.nodes", etc.).
+
+    Raises:
+        xml.etree.ElementTree.ParseError: If the output is not valid XML
+    """
+    opt = _qstat_opt(jobid=jobid, username=username, full=True)
+    if opt is None:
+        return
+    with open(os.devnull, 'w') as devnull:
+        p = subprocess.Popen(opt + ["-x"], stdout=subprocess.PIPE, stderr=devnull)  #pylint: disable=invalid-name
+        try:
+            root = None
+            for event, elem in ElementTree.iterparse(p.stdout, events=("start", "end")):
+                if event == "start":
+                    if root is None:
+                        root = elem
+                    continue
+                if elem.tag != "Job":
+                    continue
+                attr = dict()
+                for child in elem:
+                    if len(child):
+                        for sub in child:
+                            attr[child.tag + "." + sub.tag] = (sub.text or "").strip()
+                    else:
+                        attr[child.tag] = (child.text or "").strip()
+                yield attr.pop("Job_Id", ""), attr
+                root.clear()
+        except ElementTree.ParseError as e:  #pylint: disable=invalid-name
+            # no output at all (no jobs) is not an error
+            if root is not None or e.position != (1, 0):
+                raise
+        finally:
+            p.stdout.close()
+            p.wait()
+
 ### Required ###
 
 NAME = 'torque'
@@ -105,6 +184,8 @@ def sub_string(job):
     jobstr = "#!/bin/sh\n"
     jobstr += "#PBS -S /bin/sh\n"
     jobstr += "#PBS -N {0}\n".format(job.name)
+    if getattr(job, "array", None) is not None:
+        jobstr += "#PBS -t {0}\n".format(job.array)
     if job.exetime is not None:
         jobstr += "#PBS -a {0}\n".format(job.exetime)
     if job.account is not None:
@@ -185,12 +266,120 @@ def job_rundir(jobid):
         rundir[i] = match.group(1)
     return rundir
 
-def job_status(jobid=None):
+_MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+           "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+
+def _ctime(value):
+    """Convert a ``qstat -f`` time ("Mon Jan  1 10:00:00 2024") to seconds since the epoch
+
+    Equivalent to strptime(value, "%a %b %d %H:%M:%S %Y"), without its overhead.
+    """
+    _, mon, day, hms, year = value.split()
+    hrs, mns, scs = hms.split(":")
+    return int(time.mktime((int(year), _MONTHS[mon], int(day), int(hrs), int(mns), int(scs), 0, 0, -1)))
+
+def _parse_qstat_f(lines, raw=False):
+    """Parse ``qstat -f`` output in a single pass
+
+    Records start with a "Job Id: <jobid>" line, followed by "key = value"
+    attribute lines. Long values are continued on following lines that start
+    with a tab.
+
+    Args:
+        lines (iterable of str): Lines of ``qstat -f`` output
+        raw (bool, optional, default=False): If True, also return the text of
+            each record
+
+    Returns:
+        A generator of (jobid, attributes, qstatstr) tuples, with 'attributes'
+        a dict of str, and 'qstatstr' the record text if raw is True, else None.
+    """
+    jobid = None
+    attr = None
+    text = None
+    key = None
+    for line in lines:
+        if line.startswith("Job Id:"):
+            if jobid is not None:
+                yield jobid, attr, "".join(text) if raw else None
+            jobid = line[7:].strip()
+            attr = dict()
+            text = [line] if raw else None
+            key = None
+            continue
+        if jobid is None:
+            continue
+        if raw:
+            text.append(line)
+        if line.startswith("\t"):
+            if key is not None:
+                attr[key] += line.strip()
+            continue
+        name, sep, value = line.partition(" = ")
+        if sep:
+            key = name.strip()
+            attr[key] = value.strip()
+    if jobid is not None:
+        yield jobid, attr, "".join(text) if raw else None
+
+def _time(value):
+    """Convert a ``qstat -f`` time, in seconds since the epoch (XML output) or
+    as "Mon Jan  1 10:00:00 2024" (text output), to seconds since the epoch"""
+    if value.isdigit():
+        return int(value)
+    return _ctime(value)
+
+def _qstatstr(jobid, attr):
+    """Format attributes from ``qstat -f -x`` as ``qstat -f`` text"""
+    return "Job Id: " + jobid + "\n" + "".join(
+        ["    " + key + " = " + value + "\n" for key, value in iteritems(attr)])
+
+def _job_status_dict(fulljobid, attr, qstatstr, now):
+    """Return the job_status dict for one job from its ``qstat -f`` attributes"""
+    jobstatus = dict()
+    jobstatus["jobid"] = fulljobid.split(".")[0]
+    jobstatus["qstatstr"] = qstatstr
+    jobstatus["attributes"] = attr
+    jobstatus["jobname"] = attr.get("Job_Name")
+    jobstatus["jobstatus"] = attr.get("job_state")
+    jobstatus["queue"] = attr.get("queue")
+    jobstatus["account"] = attr.get("Account_Name")
+
+    # "nodes:ppn=procs_per_node"
+    jobstatus["nodes"] = None
+    jobstatus["procs"] = None
+    nodes, _, ppn = attr.get("Resource_List.nodes", "").partition(":ppn=")
+    if nodes.isdigit():
+        jobstatus["nodes"] = int(nodes)
+        if ppn.isdigit():
+            jobstatus["procs"] = int(nodes)*int(ppn)
+
+    jobstatus["walltime"] = None
+    if "Resource_List.walltime" in attr:
+        jobstatus["walltime"] = int(seconds(attr["Resource_List.walltime"]))
+
+    jobstatus["starttime"] = None
+    if "start_time" in attr:
+        jobstatus["starttime"] = _time(attr["start_time"])
+
+    jobstatus["completiontime"] = None
+    if "comp_time" in attr:
+        jobstatus["completiontime"] = _time(attr["comp_time"])
+
+    jobstatus["elapsedtime"] = None
+    if jobstatus["jobstatus"] == "R" and jobstatus["starttime"] is not None:
+        jobstatus["elapsedtime"] = now - jobstatus["starttime"]
+
+    return jobstatus
+
+def job_status(jobid=None, raw=True):
     """Return job status using ``qstat``
 
     Args:
         jobid (None, str, or List(str)):
             IDs of jobs to query for status. None for all user jobs.
+        raw (bool, optional, default=True):
+            If True, include the text of each record as "qstatstr".
 
     Returns:
 
@@ -204,105 +393,69 @@ def job_status(jobid=None):
             "procs"             Number of processors
             "walltime"          Walltime
             "jobstatus"         status ("Q","C","R", etc.)
-            "qstatstr"          result of ``squeue -f jobid``, None if not found
+            "qstatstr"          result of ``qstat -f jobid``, None if not found or not raw
             "elapsedtime"       None if not started, else seconds as int
             "starttime"         None if not started, else seconds since epoch as int
             "completiontime"    None if not completed, else seconds since epoch as int
+            "queue"             Queue
+            "account"           Account, or None
+            "attributes"        dict of all ``qstat -f`` attributes, as str
             ================    ======================================================
 
+        Uses ``qstat -f -x`` (XML) output if the detected torque version
+        supports it, falling back to ``qstat -f`` text output if it can not be
+        parsed.
     """
     status = dict()
+    now = int(time.time())
+
+    if _use_xml():
+        try:
+            for fulljobid, attr in _qstat_xml(jobid=jobid):
+                qstatstr = _qstatstr(fulljobid, attr) if raw else None
+                jobstatus = _job_status_dict(fulljobid, attr, qstatstr, now)
+                status[jobstatus["jobid"]] = jobstatus
+            return status
+        except ElementTree.ParseError:
+            # fall back to the text output
+            status = dict()
+
+    opt = _qstat_opt(jobid=jobid, full=True)
+    lines = run_stream(opt) if opt is not None else []
+    for fulljobid, attr, qstatstr in _parse_qstat_f(lines, raw=raw):
+        jobstatus = _job_status_dict(fulljobid, attr, qstatstr, now)
+        status[jobstatus["jobid"]] = jobstatus
 
-    sout = _qstat(jobid=jobid, full=True)
-    jobstatus = None
-
-    for line in StringIO(sout):
-
-        m = re.search(r"Job Id:\s*(.*)\s", line)      #pylint: disable=invalid-name
-        if m:
-            if jobstatus is not None:
-                if jobstatus["jobstatus"] == "R":           #pylint: disable=unsubscriptable-object
-                    jobstatus["elapsedtime"] = int(time.time()) - jobstatus["starttime"]    #pylint: disable=unsubscriptable-object
-                status[jobstatus["jobid"]] = jobstatus #pylint: disable=unsubscriptable-object
-            jobstatus = dict()
-            jobstatus["jobid"] = m.group(1).split(".")[0]
-            jobstatus["qstatstr"] = line
-            jobstatus["elapsedtime"] = None
-            jobstatus["starttime"] = None
-            jobstatus["completiontime"] = None
-            continue
-
-        jobstatus["qstatstr"] += line
-
-        #results = line.split()
-        #jobid = results[0].split(".")[0]
-        #jobstatus = dict()
-        #jobstatus["jobid"] = jobid
-
-        #jobstatus["jobname"] = results[3]
-        m = re.match(r"\s*Job_Name\s*=\s*(.*)\s", line)       #pylint: disable=invalid-name
-        if m:
-            jobstatus["jobname"] = m.group(1)
-            continue
+    return status
 
-        #jobstatus["nodes"] = int(results[5])
-        #jobstatus["procs"] = int(results[6])
-        m = re.match(r"\s*Resource_List\.nodes\s*=\s*(.*):ppn=(.*)\s", line)  #pylint: disable=invalid-name
-        if m:
-            jobstatus["nodes"] = m.group(1)
-            jobstatus["procs"] = int(m.group(1))*int(m.group(2))
-            continue
+def job_status_changes(since, jobid=None):     #pylint: disable=unused-argument
+    """Return the status of tracked jobs using ``qstat``
 
-        #jobstatus["walltime"] = int(seconds(results[8]))
-        m = re.match(r"\s*Resource_List\.walltime\s*=\s*(.*)\s", line)      #pylint: disable=invalid-name
-        if m:
-            jobstatus["walltime"] = int(seconds(m.group(1)))
-            continue
+    Torque can not select jobs by the time they changed state, so rather than
+    all of the user's jobs, only the tracked jobs in 'jobid' are queried. Those
+    that are no longer found are returned with jobstatus "C".
 
-        #jobstatus["jobstatus"] = results[9]
-        m = re.match(r"\s*job_state\s*=\s*(.*)\s", line)        #pylint: disable=invalid-name
-        if m:
-            jobstatus["jobstatus"] = m.group(1)
-            continue
-
-        #elapsedtime = line.split()[10]
-        #if elapsedtime == "--":
-        #    jobstatus["elapsedtime"] = None
-        #else:
-        #    jobstatus["elapsedtime"] = int(seconds(elapsedtime))
-        #
-        #qstatstr = qstat(jobid, full=True)
-        #if not re.match("^qstat: Unknown Job Id Error.*",qstatstr):
-        #    jobstatus["qstatstr"] = qstatstr
-        #    m = re.search("Job_Name = (.*)\n",qstatstr)
-        #    if m:
-        #        jobstatus["jobname"] = m.group(1)
-
-        #m = re.match("\s*resources_used.walltime\s*=\s*(.*)\s",line)
-        #if m:
-        #    print line
-        #    jobstatus["elapsedtime"] = int(seconds(m.group(1)))
-
-        m = re.match(r"\s*start_time\s*=\s*(.*)\s", line)    #pylint: disable=invalid-name
-        if m:
-            jobstatus["starttime"] = int(time.mktime(datetime.datetime.strptime(
-                m.group(1), "%a %b %d %H:%M:%S %Y").timetuple()))
-            continue
+    Args:
+        since (float): Time, in seconds since the epoch, of the previous query.
+            Not used.
+        jobid (List(str), optional): IDs of jobs being tracked.
 
-        m = re.search(r"\s*comp_time\s*=\s*(.*)\s", line)   #pylint: disable=invalid-name
-        if m:
-            jobstatus["completiontime"] = int(time.mktime(datetime.datetime.strptime(
-                m.group(1), "%a %b %d %H:%M:%S %Y").timetuple()))
-            continue
+    Returns:
 
-    if jobstatus is not None:
-        if jobstatus["jobstatus"] == "R":
-            jobstatus["elapsedtime"] = int(time.time()) - jobstatus["starttime"]
-        status[jobstatus["jobid"]] = jobstatus
+        dict of dict: As for job_status, for the jobs in 'jobid'.
 
+    """
+    if not jobid:
+        return dict()
+    status = job_status(jobid=list(jobid))
+    for j in jobid:
+        if j not in status:
+            status[j] = {"jobid": j, "jobname": None, "nodes": None, "procs": None,
+                         "walltime": None, "qstatstr": None, "elapsedtime": None,
+                         "starttime": None, "completiontime": None, "jobstatus": "C"}
     return status
 
-def submit(substr, write_submit_script=None):
+def submit(substr, write_submit_script=None, rundir=None, dependency=None):
     """Submit a job using ``qsub``.
 
     Args:
@@ -310,6 +463,11 @@ def submit(substr, write_submit_script=None):
         write_submit_script (bool, optional): If true, submit via file skipping
             lines containing '#PBS -N'; otherwise, submit via commandline. If
             not specified, uses ``prisms_jobs.config['write_submit_script']``.
+        rundir (str, optional): Directory to submit the job from, and run it 
+            in. By default, the current working directory. The submit script
+            file, if written, is written in this directory.
+        dependency (str, optional): Only start the job once the dependency is
+            satisfied. Ex: ``"afterany:123"`` or ``"afterok:123:124"``.
 
     Returns:
         str: ID of submitted job
@@ -329,21 +487,26 @@ def submit(substr, write_submit_script=None):
     if write_submit_script is None:
         write_submit_script = prisms_jobs.config.write_submit_script()
 
+    opt = [] if rundir is None else ["-d", rundir]
+    if dependency is not None:
+        opt += ["-W", "depend=" + dependency]
+
     if write_submit_script:
-        if os.path.exists(jobname):
+        path = jobname if rundir is None else os.path.join(rundir, jobname)
+        if os.path.exists(path):
             index = 0
-            while os.path.exists(jobname + ".bak." + str(index)):
+            while os.path.exists(path + ".bak." + str(index)):
                 index += 1
-            print("Backing up existing submit script:", jobname, "->", jobname + ".bak." + str(index))
-            os.rename(jobname, jobname + ".bak." + str(index))
+            print("Backing up existing submit script:", path, "->", path + ".bak." + str(index))
+            os.rename(path, path + ".bak." + str(index))
         # write submit script, without -N line
-        with open(jobname, 'w') as f:
+        with open(path, 'w') as f:
             for line in substr.splitlines():
                 if not re.search(r"#PBS\s+-N\s+(.*)", line):
                     f.write(line + '\n')
-        stdout, stderr, returncode = run(["qsub", jobname])       #pylint: disable=unused-variable
+        stdout, stderr, returncode = run(["qsub"] + opt + [jobname], cwd=rundir)       #pylint: disable=unused-variable
     else:
-        stdout, stderr, returncode = run(["qsub"], input=substr, stdin=subprocess.PIPE)  #pylint: disable=unused-variable
+        stdout, stderr, returncode = run(["qsub"] + opt, input=substr, stdin=subprocess.PIPE, cwd=rundir)  #pylint: disable=unused-variable
     print(stdout[:-1])
     if re.search("error", stdout):
         raise JobsError(0, "Submission error.\n" + stdout + "\n" + stderr)
@@ -351,6 +514,20 @@ def submit(substr, write_submit_script=None):
         jobid = stdout.split(".")[0]
         return jobid
 
+def array_jobid(jobid, index):
+    """Return the ID of an element of a job array
+
+    Args:
+        jobid (str): ID of the array job, as returned by submit. Ex: ``"123[]"``
+        index (int): Array index. Ex: 4
+
+    Returns:
+        str: ID of the array element. Ex: ``"123[4]"``
+    """
+    if jobid.endswith("[]"):
+        jobid = jobid[:-2]
+    return "{0}[{1}]".format(jobid, index)
+
 def delete(jobid):
     """``qdel`` a PBS job.
 
@@ -429,6 +606,7 @@ def read(job, qsubstr):    #pylint: disable=too-many-branches, too-many-statemen
     job.account = None
     job.exetime = None
     job.qos = None
+    job.array = None
 
     optional = dict()
     optional["account"] = "Default: None"
@@ -470,6 +648,10 @@ def read(job, qsubstr):    #pylint: disable=too-many-branches, too-many-statemen
                 job.exetime = m.group(1)
                 optional["exetime"] = job.exetime
 
+            m = re.search(r"\s-t\s+(\S+)", line)  #pylint: disable=invalid-name
+            if m:
+                job.array = m.group(1)
+
             m = re.search(r"\s-l\s", line)   #pylint: disable=invalid-name
             if m:
                 m = re.search(r"walltime=([0-9:]+)", line)   #pylint: disable=invalid-name
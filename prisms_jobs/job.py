@@ -8,9 +8,11 @@ import os
 import re
 import sys
 
+from six.moves import shlex_quote
+
 ### Local ###
 import prisms_jobs
-from prisms_jobs import config, jobdb, misc
+from prisms_jobs import config, governor, jobdb, misc, status_cache
 
 class Job(object):  #pylint: disable=too-many-instance-attributes
     """Represents a computational job
@@ -89,6 +91,9 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
         constraint (str): Constraint. Ex: ``"haswell"``
         command (str):   String with command to run by script. Ex: ``"echo \"hello\" > test.txt"``
         auto (bool):     Indicates an automatically re-submitting job.  Ex: ``True``
+        array (str):     Job array indices, or None if not a job array. Ex: ``"0-99"``
+
+            Set by prisms_jobs.JobArray.
 
     """
 
@@ -97,6 +102,9 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
                  pmem=None, qos=None, queue=None, exetime=None, message="a", email=None,
                  priority="0", constraint=None, command=None, auto=False, substr=None):
 
+        # job array indices, if submitted as a job array
+        self.array = None
+
         if substr != None:
             self.read(substr)
             return
@@ -190,31 +198,57 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
         with open(filename, "w") as myfile:
             myfile.write(self.sub_string())
 
-    def submit(self, add=True, dbpath=None):
+    def submit(self, add=True, dbpath=None, rundir=None, prequeue=False):
         """
         Submit this Job using the appropriate command for prisms_jobs.config.software().
 
+        If the job is to be added to the JobDB database, and submitting it
+        would exceed the 'submit_limits' setting, it is held in the database
+        instead, to be submitted by JobDB.submit_pending, and 'jobID' is None.
+
         Args:
            add (bool): Should this job be added to the JobDB database?
            dbpath (str): Specify a non-default JobDB database
+           rundir (str): Directory to submit the job from. Default is the
+               current working directory.
+           prequeue (bool): For 'auto' jobs added to the JobDB database. If
+               True, while the job runs, its continuation is submitted to
+               start when it ends, rather than after it ends and is found by
+               JobDB.continue_all. See JobDB.prequeue_job.
 
         Raises:
             prisms_jobs.JobsError: If error submitting the job.
 
         """
+        if rundir is not None:
+            rundir = os.path.abspath(rundir)
 
-        self.jobID = config.software().submit(substr=self.sub_string())
+        if add and not governor.has_capacity(self.queue, self.account):
+            self.jobID = None
+            db = jobdb.JobDB(dbpath=dbpath) #pylint: disable=invalid-name
+            db.hold(self._status(rundir, prequeue), self.queue, self.account)
+            db.close()
+            print("Submission limit reached, holding job:", self.name)
+            return
+
+        self.jobID = config.software().submit(substr=self.sub_string(), rundir=rundir)
+        governor.record(self.queue, self.account)
+        status_cache.invalidate()
 
         if add:
             db = jobdb.JobDB(dbpath=dbpath) #pylint: disable=invalid-name
-            status = jobdb.job_status_dict(jobid=self.jobID, jobname=self.name,
-                                           rundir=os.getcwd(), jobstatus="?",
-                                           auto=self.auto, qsubstr=self.sub_string(),
-                                           walltime=misc.seconds(self.walltime),
-                                           nodes=self.nodes, procs=self.nodes*self.ppn)
-            db.add(status)
+            db.add(self._status(rundir, prequeue))
             db.close()
 
+    def _status(self, rundir=None, prequeue=False):
+        """Return the job_status_dict for a JobDB record of this Job"""
+        return jobdb.job_status_dict(jobid=self.jobID, jobname=self.name,
+                                     rundir=os.getcwd() if rundir is None else rundir,
+                                     jobstatus="?", auto=self.auto, qsubstr=self.sub_string(),
+                                     walltime=misc.seconds(self.walltime),
+                                     nodes=self.nodes, procs=self.nodes*self.ppn,
+                                     prequeue=prequeue)
+
 
     def read(self, qsubstr):    #pylint: disable=too-many-branches, too-many-statements
         """
@@ -226,3 +260,183 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
 
         """
         config.software().read(self, qsubstr)
+
+
+class JobArray(object):
+    """Jobs submitted together as one job array
+
+    A job array is submitted with one call to the job management software,
+    rather than one per job. Each job's command is run by one element of the
+    array, in its own run directory. The resource requests (account, nodes,
+    ppn, walltime, pmem, qos, queue, exetime, message, email, priority, and
+    constraint) of all the jobs must be the same.
+
+    Each element is added to the JobDB as a separate record, with the submit
+    script of the individual job, so that it can be continued on its own.
+
+    Job arrays larger than the 'max_array_size' setting (by default 1000, to
+    fit Slurm's default MaxArraySize) are submitted as several arrays of at
+    most that size.
+
+    Args:
+        jobs (List(prisms_jobs.Job)): Jobs to submit. Element i of the array
+            runs jobs[i].command.
+        name (str, optional): Name of the job array. Default uses jobs[0].name.
+        rundir (List(str), optional): Directory to run each job in. Default
+            uses the current working directory for all jobs.
+
+    Attributes:
+        jobs (List(prisms_jobs.Job)): Jobs in the array
+        name (str): Name of the job array
+        rundir (List(str)): Directory each job is run in
+        jobID (str): ID of the (first) job array, as returned by the job
+            management software. None if not submitted.
+        arrayIDs (List(str)): IDs of each job array submitted. None if not
+            submitted.
+        jobIDs (List(str)): IDs of the array elements, in the order of 'jobs'.
+            None if not submitted.
+
+    Raises:
+        prisms_jobs.JobsError: If the jobs request different resources.
+
+    """
+
+    _RESOURCES = ["account", "nodes", "ppn", "walltime", "pmem", "qos", "queue",
+                  "exetime", "message", "email", "priority", "constraint"]
+
+    def __init__(self, jobs, name=None, rundir=None):
+        if len(jobs) == 0:
+            raise prisms_jobs.JobsError(str(name), "JobArray requires at least one job")
+        if name is None:
+            name = jobs[0].name
+        for job in jobs[1:]:
+            for attr in JobArray._RESOURCES:
+                if getattr(job, attr) != getattr(jobs[0], attr):
+                    raise prisms_jobs.JobsError(
+                        name, "JobArray jobs must request the same resources. Differing: '" + attr + "'")
+        if rundir is None:
+            rundir = [os.getcwd()]*len(jobs)
+        elif len(rundir) != len(jobs):
+            raise prisms_jobs.JobsError(name, "JobArray requires one 'rundir' per job")
+
+        self.jobs = list(jobs)
+        self.name = name
+        self.rundir = [os.path.abspath(d) for d in rundir]
+
+        self.jobID = None   #pylint: disable=invalid-name
+        self.jobIDs = None  #pylint: disable=invalid-name
+        self.arrayIDs = None  #pylint: disable=invalid-name
+
+    def job(self, start=0, stop=None):
+        """Return a Job representing the job array, or a part of it
+
+        The command selects the job to run using the array index, given by
+        ``SLURM_ARRAY_TASK_ID`` or ``PBS_ARRAYID``.
+
+        Args:
+            start (int, optional, default=0): Index in 'jobs' of the first job
+            stop (int, optional): Index in 'jobs' after the last job. Default
+                is len(jobs). Array index i runs jobs[start+i].
+        """
+        if stop is None:
+            stop = len(self.jobs)
+        first = self.jobs[0]
+        command = "index=${SLURM_ARRAY_TASK_ID:-$PBS_ARRAYID}\n"
+        command += "case $index in\n"
+        for i, (job, rundir) in enumerate(zip(self.jobs[start:stop], self.rundir[start:stop])):
+            command += "{0})\n".format(i)
+            command += "cd {0}\n".format(shlex_quote(rundir))
+            command += "{0}\n".format(job.command)
+            command += ";;\n"
+        command += "esac"
+        array = Job(name=self.name, account=first.account, nodes=first.nodes, ppn=first.ppn,
+                    walltime=first.walltime, pmem=first.pmem, qos=first.qos, queue=first.queue,
+                    exetime=first.exetime, message=first.message, email=first.email,
+                    priority=first.priority, constraint=first.constraint, command=command,
+                    auto=False)
+        array.array = "0-{0}".format(stop - start - 1)
+        return array
+
+    def sub_string(self, start=0, stop=None):
+        """ Output JobArray, or a part of it (see job), as a string suitable for prisms_jobs.config.software() """
+        return self.job(start, stop).sub_string()
+
+    def submit(self, add=True, dbpath=None, max_size=None):
+        """
+        Submit the job array using the appropriate command for prisms_jobs.config.software().
+
+        The jobs are submitted as arrays of at most 'max_size' jobs, one
+        submission per array. If the array elements are to be added to the
+        JobDB database, and submitting them would exceed the 'submit_limits'
+        setting, each job is held in the database instead, to be submitted
+        individually by JobDB.submit_pending, and 'jobID', 'jobIDs', and
+        'arrayIDs' are None.
+
+        Args:
+           add (bool): Should the array elements be added to the JobDB database?
+               All elements are added in one transaction.
+           dbpath (str): Specify a non-default JobDB database
+           max_size (int, optional): Maximum number of jobs per array. Default
+               uses prisms_jobs.config.max_array_size().
+
+        Raises:
+            prisms_jobs.JobsError: If error submitting the job array, or if
+                prisms_jobs.config.software() does not support job arrays. If
+                submitting a later array fails, the jobs of the arrays already
+                submitted are still added to the JobDB database.
+
+        """
+        software = config.software()
+        if not hasattr(software, "array_jobid"):
+            raise prisms_jobs.JobsError(
+                self.name, "Job arrays are not supported by software: " + software.NAME)
+
+        first = self.jobs[0]
+        if add and not governor.has_capacity(first.queue, first.account, len(self.jobs)):
+            self.jobID = None
+            self.jobIDs = None
+            self.arrayIDs = None
+            db = jobdb.JobDB(dbpath=dbpath) #pylint: disable=invalid-name
+            for job, rundir in zip(self.jobs, self.rundir):
+                job.jobID = None
+                db.hold(job._status(rundir), job.queue, job.account)   #pylint: disable=protected-access
+            db.close()
+            print("Submission limit reached, holding jobs:", self.name)
+            return
+
+        if max_size is None:
+            max_size = config.max_array_size()
+        max_size = max(int(max_size), 1)
+
+        self.arrayIDs = []
+        self.jobIDs = []
+        error = None
+        for start in range(0, len(self.jobs), max_size):
+            stop = min(start + max_size, len(self.jobs))
+            try:
+                arrayid = software.submit(substr=self.sub_string(start, stop))
+            except Exception as e:  #pylint: disable=broad-except, invalid-name
+                error = e
+                break
+            self.arrayIDs.append(arrayid)
+            self.jobIDs += [software.array_jobid(arrayid, i) for i in range(stop - start)]
+            governor.record(first.queue, first.account, stop - start)
+        if len(self.arrayIDs):
+            status_cache.invalidate()
+        if not len(self.arrayIDs):
+            self.jobID, self.jobIDs, self.arrayIDs = None, None, None
+        else:
+            self.jobID = self.arrayIDs[0]
+
+        if self.jobIDs is not None:
+            for job, jobid in zip(self.jobs, self.jobIDs):
+                job.jobID = jobid
+
+            if add:
+                db = jobdb.JobDB(dbpath=dbpath) #pylint: disable=invalid-name
+                db.add_many([job._status(rundir)    #pylint: disable=protected-access
+                             for job, rundir in list(zip(self.jobs, self.rundir))[:len(self.jobIDs)]])
+                db.close()
+
+        if error is not None:
+            raise error
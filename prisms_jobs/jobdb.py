@@ -3,19 +3,24 @@
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 from builtins import *
 
+import hashlib
 import json
 import os
+import random
 import re
 import socket
 import sqlite3
 import sys
 import time
+import uuid
 import warnings
+import zlib
+from multiprocessing.pool import ThreadPool
 
 from six import iteritems, string_types
 
 import prisms_jobs
-from prisms_jobs import config, misc
+from prisms_jobs import config, governor, misc, status_cache
 
 def trunc(data, maxlen):
     return (data[:maxlen-2] + '..') if len(data) > maxlen else data
@@ -44,13 +49,51 @@ class EligibilityError(Exception):
 # columns in database (see job_status_dict()):
 # username, hostname, jobid, jobname, rundir, jobstatus, auto, taskstatus,
 # continuation_jobid, qsubstr, qstatstr, nodes, proc, walltime, starttime,
-# completiontime, elapsedtime
+# completiontime, elapsedtime, jobnum, arrayindex, exitcode, finalstate
 
 # allowed values (not checked at this time):
 # taskstatus = ["Incomplete","Complete","Continued","Check","Error:.*","Aborted"]
 # jobstatus = ["C","Q","R","E","W","H","M"]
 # auto=[1,0]
 
+_JOBID_REGEX = re.compile(r"(\d+)(?:[_\[](\d+)\]?)?")
+
+# seconds after which a claim to continue a job (see JobDB._continue) is
+# taken to be abandoned, for instance by a process that was killed
+_CLAIM_TIMEOUT = 3600
+
+def _claimed(continuation_jobid, now=None):
+    """Return True if 'continuation_jobid' is an unexpired "claim:<time>:<token>" """
+    if not (continuation_jobid or "").startswith("claim:"):
+        return False
+    try:
+        claimtime = int(continuation_jobid.split(":")[1])
+    except (IndexError, ValueError):
+        return False
+    return (time.time() if now is None else now) - claimtime < _CLAIM_TIMEOUT
+
+def parse_jobid(jobid):
+    """Return the job number and array index from a job ID
+
+    Examples: "123" -> (123, None), "123_4" (Slurm) -> (123, 4),
+    "123[4]" (TORQUE) -> (123, 4), "abc" -> (None, None)
+
+    Args:
+        jobid (str): A job ID, or None
+
+    Returns:
+        (jobnum, arrayindex): int or None
+    """
+    if jobid is None:
+        return (None, None)
+    m = _JOBID_REGEX.match(jobid)   #pylint: disable=invalid-name
+    if m is None:
+        return (None, None)
+    if m.group(2) is None:
+        return (int(m.group(1)), None)
+    return (int(m.group(1)), int(m.group(2)))
+
+
 def job_status_dict(username=misc.getlogin(),        #pylint: disable=too-many-arguments, too-many-locals
                     hostname=socket.gethostname(),
                     jobid="-",
@@ -67,7 +110,10 @@ def job_status_dict(username=misc.getlogin(),        #pylint: disable=too-many-a
                     walltime=None,
                     elapsedtime=None,
                     starttime=None,
-                    completiontime=None):
+                    completiontime=None,
+                    exitcode=None,
+                    finalstate=None,
+                    prequeue=0):
     """Return a dict() with job_status fields.
 
        This is used to add records to the JobDB database through JobDB().add().
@@ -103,6 +149,16 @@ def job_status_dict(username=misc.getlogin(),        #pylint: disable=too-many-a
     status["completiontime"] = completiontime
     status["modifytime"] = modifytime
 
+    # integer, parsed from jobid for range selection:
+    status["jobnum"], status["arrayindex"] = parse_jobid(jobid)
+
+    # from job accounting, once a job has finished (None if not available):
+    status["exitcode"] = exitcode
+    status["finalstate"] = finalstate
+
+    # if 1, continuations are submitted while the job runs, to start after it ends:
+    status["prequeue"] = int(bool(prequeue))
+
     return status
 
 
@@ -141,6 +197,11 @@ def job_status_type_dict():
     status["completiontime"] = "integer"
     status["modifytime"] = "integer"
 
+    status["jobnum"] = "integer"
+    status["arrayindex"] = "integer"
+
+    status["prequeue"] = "integer"
+
     return status
 
 
@@ -156,6 +217,7 @@ def sql_create_str():
 def sql_insert_str(job_status):
     """ Accepts job_status dict, Returns strings and tuple used for SQL INSERT INTO."""
     job_status["auto"] = int(bool(job_status["auto"]))
+    job_status["jobnum"], job_status["arrayindex"] = parse_jobid(job_status["jobid"])
     colstr = "("
     questionstr = "("
     val = []
@@ -168,6 +230,295 @@ def sql_insert_str(job_status):
     return colstr, questionstr, tuple(val)
 
 
+# Submit scripts are stored once in the 'scripts' table, keyed by the SHA-1
+# hash of their text, and referenced by jobs.qsubhash. The jobs.qsubstr column
+# is NULL for such records, and only holds scripts added before schema version 3
+# that have not been migrated.
+SCRIPTS_CREATE_STR = "CREATE TABLE IF NOT EXISTS scripts \
+    (hash text PRIMARY KEY, compressed integer, data blob)"
+
+# Jobs held back by the submission limits (see prisms_jobs.governor), in the
+# order they were held. 'continues' is the jobid of the job a held
+# continuation continues, or NULL.
+PENDING_CREATE_STR = "CREATE TABLE IF NOT EXISTS pending \
+    (id integer PRIMARY KEY AUTOINCREMENT, holdtime integer, jobname text, rundir text, \
+    auto integer, qsubhash text, walltime integer, nodes integer, procs integer, \
+    queue text, account text, continues text, prequeue integer)"
+
+# Jobs of workflows (see prisms_jobs.workflow), and their dependencies: 'child'
+# starts after 'parent' completes successfully. Jobs without dependencies have
+# one row with 'parent' NULL.
+EDGES_CREATE_STR = "CREATE TABLE IF NOT EXISTS edges \
+    (workflow text, parent text, child text)"
+
+# Tasks of task pools (see prisms_jobs.packing). 'status' is one of 'Pending',
+# 'Running' (claimed by the worker job 'jobid'), 'Complete', or 'Error'. Tasks
+# claimed together share a random 'claim' token.
+TASKS_CREATE_STR = "CREATE TABLE IF NOT EXISTS tasks \
+    (id integer primary key autoincrement, pool text, command text, rundir text, \
+     status text, claim text, jobid text, starttime integer, endtime integer, \
+     returncode integer)"
+
+# SQL expression for a held job's submit script
+PENDING_QSUBSTR_EXPR = "(SELECT SCRIPT_TEXT(scripts.data, scripts.compressed) \
+    FROM scripts WHERE scripts.hash=pending.qsubhash)"
+
+# SQL expression for a record's submit script, from the scripts table or jobs.qsubstr
+QSUBSTR_EXPR = "COALESCE((SELECT SCRIPT_TEXT(scripts.data, scripts.compressed) \
+    FROM scripts WHERE scripts.hash=jobs.qsubhash), jobs.qsubstr)"
+
+
+def script_hash(qsubstr):
+    """Return the hash (hex digest str) used to store a submit script"""
+    return hashlib.sha1(qsubstr.encode('utf-8')).hexdigest()
+
+
+def script_text(data, compressed):
+    """Return a submit script (str) stored in the scripts table"""
+    data = bytes(data)
+    if compressed:
+        data = zlib.decompress(data)
+    return data.decode('utf-8')
+
+
+def store_script(curs, qsubstr, compress=True):
+    """Store a submit script in the scripts table, if not already stored
+
+    Args:
+        curs (sqlite3.Cursor): Cursor of a jobs database connection.
+        qsubstr (str): Submit script.
+        compress (bool, optional, default=True): If True, store the script
+            zlib-compressed, if that is smaller.
+
+    Returns:
+        str: The hash of the script, referenced by jobs.qsubhash.
+    """
+    key = script_hash(qsubstr)
+    data = qsubstr.encode('utf-8')
+    compressed = 0
+    if compress:
+        zdata = zlib.compress(data)
+        if len(zdata) < len(data):
+            data, compressed = zdata, 1
+    curs.execute("INSERT OR IGNORE INTO scripts (hash, compressed, data) VALUES (?, ?, ?)",
+                 (key, compressed, sqlite3.Binary(data)))
+    return key
+
+
+def column_expr(key):
+    """Return the SQL expression that selects column 'key' of the jobs table"""
+    if key == "qsubstr":
+        return QSUBSTR_EXPR
+    return "jobs." + key
+
+
+def select_columns_str(columns=None):
+    """Return the SQL result columns to select 'columns' (default: all columns)"""
+    if columns is None:
+        columns = list(job_status_dict())
+    return ", ".join([column_expr(c) + " AS " + c for c in columns])
+
+
+# Version of the jobs database schema, stored via 'PRAGMA user_version':
+#   0: original jobs table, without indexes
+#   1: indexes on jobid (unique), continuation_jobid, taskstatus/jobstatus,
+#      modifytime, and hostname
+#   2: indexed integer jobnum and arrayindex columns, parsed from jobid
+#   3: submit scripts stored once in the 'scripts' table, keyed by hash, and
+#      referenced by jobs.qsubhash
+#   4: exitcode and finalstate columns, from job accounting
+#   5: 'meta' key/value table, holding the incremental update poll cursors
+#   6: 'pending' table, holding jobs held back by the submission limits
+#   7: prequeue column, for jobs whose continuations are pre-queued
+#   8: 'edges' table, holding the dependencies between the jobs of workflows
+#   9: 'tasks' table, holding the tasks of task pools run by packing workers
+SCHEMA_VERSION = 9
+
+
+def _add_column(curs, name, sqltype):
+    """Add a column to the jobs table if it does not exist"""
+    curs.execute("PRAGMA table_info(jobs)")
+    if name not in [r[1] for r in curs.fetchall()]:
+        curs.execute("ALTER TABLE jobs ADD COLUMN " + name + " " + sqltype)
+
+
+def _schema_v1(curs):
+    """Add indexes for the common jobs table lookups"""
+    curs.execute("SELECT jobid FROM jobs GROUP BY jobid HAVING COUNT(*) > 1 LIMIT 1")
+    if curs.fetchone() is None:
+        curs.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_jobid ON jobs (jobid)")
+    else:
+        warnings.warn("Duplicate jobid in prisms_jobs jobs table, jobid index is not unique.")
+        curs.execute("CREATE INDEX IF NOT EXISTS jobs_jobid ON jobs (jobid)")
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_continuation_jobid ON jobs (continuation_jobid)")
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (taskstatus, jobstatus)")
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_modifytime ON jobs (modifytime)")
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_hostname ON jobs (hostname)")
+
+
+def _schema_v2(curs):
+    """Add and backfill the jobnum and arrayindex columns"""
+    _add_column(curs, "jobnum", "integer")
+    _add_column(curs, "arrayindex", "integer")
+    curs.execute("SELECT rowid, jobid FROM jobs WHERE jobnum IS NULL")
+    curs.executemany("UPDATE jobs SET jobnum=?, arrayindex=? WHERE rowid=?",
+                     [parse_jobid(jobid) + (rowid, ) for rowid, jobid in curs.fetchall()])
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_jobnum ON jobs (jobnum, arrayindex)")
+
+
+def _schema_v3(curs):
+    """Move submit scripts from jobs.qsubstr to the deduplicated scripts table
+
+    Returns:
+        int: Number of scripts moved
+    """
+    _add_column(curs, "qsubhash", "text")
+    curs.execute(SCRIPTS_CREATE_STR)
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_qsubhash ON jobs (qsubhash)")
+    compress = config.db_connection()['compress_scripts']
+    moved = 0
+    while True:
+        curs.execute("SELECT rowid, qsubstr FROM jobs WHERE qsubhash IS NULL\
+                      AND qsubstr IS NOT NULL LIMIT 1000")
+        rows = curs.fetchall()
+        if len(rows) == 0:
+            break
+        curs.executemany("UPDATE jobs SET qsubhash=?, qsubstr=NULL WHERE rowid=?",
+                         [(store_script(curs, qsubstr, compress), rowid)
+                          for rowid, qsubstr in rows])
+        moved += len(rows)
+    return moved
+
+
+def _schema_v4(curs):
+    """Add the exitcode and finalstate columns"""
+    _add_column(curs, "exitcode", "text")
+    _add_column(curs, "finalstate", "text")
+
+
+def _schema_v5(curs):
+    """Add the meta table"""
+    curs.execute("CREATE TABLE IF NOT EXISTS meta (key text PRIMARY KEY, value)")
+
+
+def _schema_v6(curs):
+    """Add the pending table"""
+    curs.execute(PENDING_CREATE_STR)
+
+
+def _schema_v7(curs):
+    """Add the prequeue column to the jobs and pending tables"""
+    _add_column(curs, "prequeue", "integer")
+    curs.execute("PRAGMA table_info(pending)")
+    if "prequeue" not in [r[1] for r in curs.fetchall()]:
+        curs.execute("ALTER TABLE pending ADD COLUMN prequeue integer")
+
+
+def _schema_v8(curs):
+    """Add the edges table"""
+    curs.execute(EDGES_CREATE_STR)
+    curs.execute("CREATE INDEX IF NOT EXISTS edges_workflow ON edges (workflow)")
+    curs.execute("CREATE INDEX IF NOT EXISTS edges_parent ON edges (parent)")
+    curs.execute("CREATE INDEX IF NOT EXISTS edges_child ON edges (child)")
+
+
+def _schema_v9(curs):
+    """Add the tasks table"""
+    curs.execute(TASKS_CREATE_STR)
+    curs.execute("CREATE INDEX IF NOT EXISTS tasks_pool_status ON tasks (pool, status)")
+    curs.execute("CREATE INDEX IF NOT EXISTS tasks_status_jobid ON tasks (status, jobid)")
+    curs.execute("CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (claim)")
+
+
+# _SCHEMA_MIGRATIONS[i] migrates the jobs database from version i to i+1.
+# Migrations must be idempotent, so that an interrupted migration can be re-run.
+_SCHEMA_MIGRATIONS = [_schema_v1, _schema_v2, _schema_v3, _schema_v4, _schema_v5,
+                      _schema_v6, _schema_v7, _schema_v8, _schema_v9]
+
+
+def migrate_schema(conn, vacuum=False):
+    """Migrate a jobs database in place to the current SCHEMA_VERSION
+
+    If a migration frees space (moving submit scripts to the scripts table),
+    a VACUUM is flagged in the meta table. Because VACUUM rewrites the whole
+    database while holding its lock, it is only run if 'vacuum' is True.
+
+    Args:
+        conn (sqlite3.Connection): Connection to a jobs database.
+        vacuum (bool, optional, default=False): If True, run a flagged VACUUM.
+
+    Returns:
+        int: The schema version of the jobs database before migration.
+    """
+    curs = conn.cursor()
+    curs.execute("PRAGMA user_version")
+    version = curs.fetchone()[0]
+    freed = False
+    for i in range(version, SCHEMA_VERSION):
+        if _SCHEMA_MIGRATIONS[i](curs):
+            freed = True
+        curs.execute("PRAGMA user_version = {0}".format(i+1))
+        conn.commit()
+    if freed:
+        curs.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('vacuum_pending', 1)")
+        conn.commit()
+    if vacuum:
+        vacuum_if_pending(conn)
+    return version
+
+
+def vacuum_if_pending(conn):
+    """Run VACUUM if flagged by migrate_schema, to return freed space to the file system
+
+    Args:
+        conn (sqlite3.Connection): Connection to a jobs database at the
+            current SCHEMA_VERSION.
+    """
+    curs = conn.cursor()
+    if curs.execute("SELECT 1 FROM meta WHERE key='vacuum_pending'").fetchone() is None:
+        return
+    curs.execute("DELETE FROM meta WHERE key='vacuum_pending'")
+    conn.commit()
+    curs.execute("VACUUM")
+
+
+def verify_schema(conn, vacuum=False):
+    """Check the jobs table columns and migrate to the current SCHEMA_VERSION
+
+    Only reads table metadata; databases already at SCHEMA_VERSION are not
+    checked further. Missing columns are added.
+
+    Args:
+        conn (sqlite3.Connection): Connection to a jobs database.
+        vacuum (bool, optional, default=False): If True, run a VACUUM flagged
+            by a migration (see migrate_schema).
+    """
+    curs = conn.cursor()
+    curs.execute("PRAGMA user_version")
+    if curs.fetchone()[0] >= SCHEMA_VERSION:
+        if vacuum:
+            vacuum_if_pending(conn)
+        return
+    curs.execute("PRAGMA table_info(jobs)")
+    cols = [r[1] for r in curs.fetchall()]
+    for c, sqltype in iteritems(job_status_type_dict()):
+        if c not in cols:
+            curs.execute("ALTER TABLE jobs ADD COLUMN " + c + " " + sqltype)
+    migrate_schema(conn, vacuum=vacuum)
+
+
+# realpaths of the jobs databases checked by verify_schema in this process
+_checked_dbpaths = set()
+
+
+# columns shown in the record summary (see JobDB.print_header)
+SUMMARY_COLUMNS = ["jobid", "jobname", "nodes", "procs", "walltime", "jobstatus",
+                   "starttime", "elapsedtime", "taskstatus", "auto", "continuation_jobid"]
+
+# large text columns, which JobDB.select(lazy=True) only fetches when accessed
+LARGE_COLUMNS = ["qsubstr", "qstatstr"]
+
+
 class CompatibilityRow(object):
     """Python2/3 compatibility wrapper of sqlite3.Row"""
     def __init__(self, row):
@@ -184,6 +535,35 @@ class CompatibilityRow(object):
     def __str__(self):
         return str(self._row)
 
+class LazyRecord(object):
+    """Job record that fetches its LARGE_COLUMNS from the database when accessed
+
+    Args:
+        row (CompatibilityRow): Record selected without the LARGE_COLUMNS
+        conn (sqlite3.Connection): Connection used to fetch the LARGE_COLUMNS
+        keys (List[str]): All column names, in table order
+    """
+    def __init__(self, row, conn, keys):
+        self._row = row
+        self._conn = conn
+        self._keys = keys
+        self._large = dict()
+
+    def __getitem__(self, key):
+        if key not in LARGE_COLUMNS:
+            return self._row[key]
+        if key not in self._large:
+            self._large[key] = self._conn.execute(
+                "SELECT " + column_expr(key) + " FROM jobs WHERE jobid=?",
+                (self._row["jobid"],)).fetchone()[0]
+        return self._large[key]
+
+    def keys(self):
+        return list(self._keys)
+
+    def __str__(self):
+        return str(dict((k, self[k]) for k in self._keys))
+
 def sql_iter(curs, arraysize=1000):
     """ Iterate over the results of a SELECT statement """
     while True:
@@ -195,10 +575,54 @@ def sql_iter(curs, arraysize=1000):
                 yield CompatibilityRow(r)
 
 
+def _is_locked(err):
+    """True if a sqlite3.OperationalError is due to a locked or busy database"""
+    msg = str(err).lower()
+    return "locked" in msg or "busy" in msg
+
+
 def regexp(pattern, string):
     """ Regexp to bool wrapper"""
     return re.match(pattern, string) is not None
 
+
+# Select all jobs in the series containing job 'jobid' (given twice) with
+# 'position' relative to 'jobid': parents are found by following
+# continuation_jobid backwards, children by following it forwards.
+SERIES_CTE = """
+WITH RECURSIVE
+  parents(jobid, position) AS (
+    SELECT jobid, 0 FROM jobs WHERE jobid=?
+    UNION ALL
+    SELECT jobs.jobid, parents.position-1 FROM jobs
+      JOIN parents ON jobs.continuation_jobid=parents.jobid),
+  children(jobid, continuation_jobid, position) AS (
+    SELECT jobid, continuation_jobid, 0 FROM jobs WHERE jobid=?
+    UNION ALL
+    SELECT jobs.jobid, jobs.continuation_jobid, children.position+1 FROM jobs
+      JOIN children ON jobs.jobid=children.continuation_jobid
+      WHERE children.continuation_jobid!='-'),
+  series(jobid, position) AS (
+    SELECT jobid, position FROM parents
+    UNION
+    SELECT jobid, position FROM children)
+"""
+
+
+def _series_from_last(last_jobid, parent):
+    """Return list of jobids for the series ending with 'last_jobid'
+
+    Args:
+        last_jobid (str): The last jobid in a series (continuation_jobid = "-").
+        parent (dict): Map of jobid -> jobid of its parent (the job with
+            continuation_jobid = jobid), as from JobDB._parent_map().
+    """
+    series = [last_jobid]
+    while series[-1] in parent:
+        series.append(parent[series[-1]])
+    series.reverse()
+    return series
+
 class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-public-methods
     """A primsms_jobs Job Database object
     
@@ -208,54 +632,109 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
     Args:
         dbpath (str, optional): Path to JobDB sqlite database. By default,
             uses ``prisms_jobs.config.dbpath()``.
+        check_schema (bool, optional, default=True): If True, check the jobs
+            table and migrate it to the current schema version, once per
+            process. Use False for a lightweight connection that only updates
+            records, as by ``complete_job`` and ``error_job``.
         
     """
 
-    def __init__(self, dbpath=None):
+    def __init__(self, dbpath=None, check_schema=True):
 
         self.conn = None
         self.curs = None
-        self.connect(dbpath)
+        self.connect(dbpath, check_schema=check_schema)
+
+        # count of temporary tables created by select()
+        self._nselection = 0
 
         # list of dict() from misc.job_status for jobs not tracked in database:
         # refreshed upon update()
         self.untracked = []
 
 
-    def connect(self, dbpath=None):    #pylint: disable=too-many-branches, too-many-statements
+    def connect(self, dbpath=None, check_schema=True):    #pylint: disable=too-many-branches, too-many-statements
         """Open a connection to the jobs database.
 
         Args:
             dbpath (str, optional): path to a JobDB database file. By default,
-            uses ``prisms_jobs.config.dbpath()``.
+                uses ``prisms_jobs.config.dbpath()``.
+            check_schema (bool, optional, default=True): If True, check the 
+                jobs table and migrate it to the current schema version, if 
+                not already done by this process. If False, only read the 
+                schema version, and migrate if it is older than SCHEMA_VERSION,
+                because records can not be read from older databases. A VACUUM
+                after migration (see migrate_schema) is left to a connection
+                with check_schema=True, such as from ``pstat`` or ``taskmaster``.
 
         """
 
         if dbpath is None:
             dbpath = config.dbpath()
 
+        # connection policy: see prisms_jobs.config.configure
+        self.policy = config.db_connection()
+
         if not os.path.isfile(dbpath):
             print("Creating Database:", dbpath)
-            self.conn = sqlite3.connect(dbpath)
-            self.conn.row_factory = sqlite3.Row
-            self.conn.create_function("REGEXP", 2, regexp)
-            self.curs = self.conn.cursor()
-            self.curs.execute("CREATE TABLE jobs " + sql_create_str())
+            self._open(dbpath)
+            self.curs.execute("CREATE TABLE IF NOT EXISTS jobs " + sql_create_str())
             self.conn.commit()
+            check_schema = True
         else:
-            self.conn = sqlite3.connect(dbpath)
-            self.conn.row_factory = sqlite3.Row
-            self.conn.create_function("REGEXP", 2, regexp)
-            self.curs = self.conn.cursor()
-            
-            # check columns
-            status_type = job_status_type_dict()
-            self.curs.execute("SELECT * from jobs")
-            cols = [desc[0] for desc in self.curs.description]
-            
-            for c in status_type:
-                if c not in cols:
-                    warnings.warn("Column '" + c + "' not in prisms_jobs jobs table.")
+            self._open(dbpath)
+
+        # add indexes, etc. to new databases or those created by older versions
+        # (records can not be read from databases older than SCHEMA_VERSION)
+        realpath = os.path.realpath(dbpath)
+        if realpath not in _checked_dbpaths:
+            if check_schema or self._schema_version() < SCHEMA_VERSION:
+                self._retry(lambda curs: verify_schema(self.conn, vacuum=check_schema))
+                _checked_dbpaths.add(realpath)
+
+
+    def _schema_version(self):
+        """Return the schema version of the jobs database"""
+        return self._retry(lambda curs: curs.execute("PRAGMA user_version").fetchone()[0])
+
+
+    def _open(self, dbpath):
+        """Open the sqlite3 connection and apply the connection policy"""
+        self.conn = sqlite3.connect(dbpath, timeout=self.policy['busy_timeout'])
+        self.conn.row_factory = sqlite3.Row
+        self.conn.create_function("REGEXP", 2, regexp)
+        self.conn.create_function("SCRIPT_TEXT", 2, script_text)
+        self.curs = self.conn.cursor()
+        if self.policy['journal_mode'] is not None:
+            self._retry(lambda curs: curs.execute(
+                "PRAGMA journal_mode=" + self.policy['journal_mode']).fetchall())
+        if self.policy['synchronous'] is not None:
+            self.curs.execute("PRAGMA synchronous=" + self.policy['synchronous'])
+
+
+    def _retry(self, func):
+        """Call func(self.curs) and commit, retrying if the database is locked
+
+        If the database is still locked after the busy timeout, the transaction
+        is rolled back and retried, up to self.policy['retries'] times, after a
+        random ("jittered") exponential backoff.
+
+        Returns:
+            The value returned by func.
+        """
+        retries = self.policy['retries']
+        attempt = 0
+        while True:
+            try:
+                result = func(self.curs)
+                self.conn.commit()
+                return result
+            except sqlite3.OperationalError as e:   #pylint: disable=invalid-name
+                self.conn.rollback()
+                if not _is_locked(e) or attempt >= retries:
+                    raise
+                time.sleep(random.uniform(0.0, min(0.1*2**attempt, 10.0)))
+                attempt += 1
 
 
     def close(self):
@@ -273,72 +752,206 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                 Create ``job_status`` using prisms_jobs.jobdb.job_status_dict().
 
         """
+        self._retry(lambda curs: self._insert(curs, job_status))
+
+
+    def add_many(self, job_status_list):
+        """Add several records to the jobs database in one transaction.
+
+        Args:
+            job_status_list (List(dict)):
+                Dictionaries of data comprising the records. Create each using
+                prisms_jobs.jobdb.job_status_dict().
+
+        """
+        def _add(curs):
+            for job_status in job_status_list:
+                self._insert(curs, job_status)
+        self._retry(_add)
+
+
+    def _insert(self, curs, job_status):
+        """Insert a record, storing its submit script in the scripts table"""
+        job_status = dict(job_status)
+        if job_status.get("qsubstr") is not None:
+            job_status["qsubhash"] = store_script(
+                curs, job_status["qsubstr"], self.policy['compress_scripts'])
+            job_status["qsubstr"] = None
         (colstr, questionstr, valtuple) = sql_insert_str(job_status)
-        insertstr = "INSERT INTO jobs {0} VALUES {1}".format(colstr, questionstr)
-        self.curs.execute(insertstr, valtuple)
-        self.conn.commit()
+        curs.execute("INSERT INTO jobs {0} VALUES {1}".format(colstr, questionstr), valtuple)
 
 
-    def update(self):
+    def update(self, refresh=False):
         """Update records using qstat.
 
         Any jobs found using qstat that are not in the jobs database are saved 
         in 'self.untracked'.
+        
+        The scheduler snapshot is staged in a temporary table and all records 
+        are updated in a single transaction. A record is only written, and its 
+        'modifytime' only changed, if its jobstatus, starttime, or 
+        completiontime changed. The 'elapsedtime' and 'qstatstr' of a record 
+        are refreshed along with those changes.
+        
+        Jobs no longer found are marked 'C'. If the interface provides 
+        ``job_accounting``, their final 'elapsedtime', 'starttime', 
+        'completiontime', 'exitcode' and 'finalstate' are queried in one batch 
+        and stored. Job accounting may lag the scheduler, so 'C' jobs without 
+        a 'finalstate' are queried again on later updates, until the 
+        'accounting_retry' setting has passed since they were modified. They 
+        are selected by the same update selection method (the 'update_method' 
+        setting) as the jobs polled for status.
+        
+        The job status is read from the shared snapshot of 
+        prisms_jobs.status_cache, if fresh. Jobs added to the database after 
+        a cached snapshot was taken are not marked 'C'.
+        
+        If the 'incremental_update' setting is enabled and the interface 
+        provides ``job_status_changes``, only jobs that changed state since the
+        previous poll are queried, and merged into the database. A poll 
+        cursor for each host is kept in the 'meta' table. A full query is made
+        every 'full_interval' seconds, or if 'refresh' is True. In incremental
+        mode, 'self.untracked' only includes untracked jobs that changed state.
+        
+        Args:
+            refresh (bool, optional, default=False): If True, query the job 
+                management software even if the cached snapshot is fresh.
+        
+        Returns:
+            int: The number of records changed.
         """
 
         # update jobstatus
         # * this method can be configured/customized via set_update_selection_method
+        selecttime = time.time()
         config.update_selection_method()(self.curs)
-
-        # newstatus will contain the updated info
-        newstatus = dict()
-
-        # any jobs that we don't find with qstat should be marked as 'C'
-        for f in sql_iter(self.curs):   #pylint: disable=invalid-name
-            newstatus[f["jobid"]] = "C"
-
-        # get job_status dict for all jobs found with qstat
-        active_status = config.software().job_status()
-
-        # reset untracked
-        self.untracked = []
-
-        # collect job status
-        for k in active_status:
-            if k in newstatus:
-                newstatus[k] = active_status[k]
-            else:
-                self.curs.execute("SELECT jobid FROM jobs WHERE jobid=?", (k,))
-                if self.curs.fetchone() is None:
-                    self.untracked.append(active_status[k])
-
-        # update database with latest job status
-        for key, jobstatus in iteritems(newstatus):
-            if jobstatus == "C":
-                self.curs.execute(
-                    "UPDATE jobs SET jobstatus=?, elapsedtime=?, modifytime=? WHERE jobid=?",
-                    ("C", None, int(time.time()), key))
-            #elif jobstatus["qstatstr"] is None:
-            #    self.curs.execute(
-            #    "UPDATE jobs SET jobstatus=?, elapsedtime=?, modifytime=? WHERE jobid=?",
-            #    (jobstatus["jobstatus"], jobstatus["elapsedtime"], int(time.time()), key))
-            else:
-                self.curs.execute(
-                    "UPDATE jobs SET jobstatus=?, elapsedtime=?, starttime=?,\
-                     completiontime=?, qstatstr=?, modifytime=? WHERE jobid=?",
-                    (
-                        jobstatus["jobstatus"], jobstatus["elapsedtime"],
-                        jobstatus["starttime"], jobstatus["completiontime"],
-                        jobstatus["qstatstr"], int(time.time()), key))
-        
+        tracked = set(r["jobid"] for r in sql_iter(self.curs))
+
+        # get job_status dict for all jobs found with qstat, or, in incremental
+        # mode, only for jobs that changed state since the previous poll
+        software = config.software()
+        policy = config.incremental_update()
+        host = socket.gethostname()
+        cursor = self._get_meta("poll_cursor." + host)
+        lastfull = self._get_meta("full_poll." + host)
+        polltime = time.time()
+        incremental = (policy['enabled'] and not refresh
+                       and hasattr(software, 'job_status_changes')
+                       and cursor is not None and lastfull is not None
+                       and polltime - lastfull < policy['full_interval'])
+
+        accounting = dict()
+        if incremental:
+            # jobs not found in 'changes' are unchanged
+            changes = software.job_status_changes(cursor - policy['overlap'], jobid=sorted(tracked))
+            snapshottime = polltime
+            active_status = dict((k, v) for k, v in iteritems(changes) if v["jobstatus"] != "C")
+            completed = tracked.intersection(
+                [k for k, v in iteritems(changes) if v["jobstatus"] == "C"])
+            accounting = dict((k, changes[k]) for k in completed if "finalstate" in changes[k])
+        else:
+            snapshottime, active_status = status_cache.snapshot(refresh=refresh)
+            # any jobs that we don't find with qstat should be marked as 'C'
+            completed = tracked.difference(active_status)
+        active = tracked.intersection(active_status)
+
+        # don't mark jobs added since a cached snapshot was taken; a snapshot
+        # taken after the jobs were selected includes all of them. Times are
+        # stored in whole seconds, so jobs added in the same second as a
+        # cached snapshot are left for the next update.
+        if len(completed) and snapshottime < selecttime:
+            self.curs.execute("SELECT jobid FROM jobs WHERE modifytime>=? AND creationtime>=?",
+                              (int(snapshottime), int(snapshottime)))
+            completed.difference_update(r["jobid"] for r in self.curs.fetchall())
+
+        # final state of the completed jobs, if the interface provides it, and
+        # of recently completed jobs that job accounting had not reported yet
+        retry = set()
+        if hasattr(software, 'job_accounting'):
+            # the same selection as the status poll, so jobs of other hosts are not queried
+            config.update_selection_method()(self.curs,
+                                             retry_since=polltime - config.accounting_retry())
+            retry = set(r["jobid"] for r in sql_iter(self.curs)).difference(completed)
+            missing = sorted(completed.union(retry).difference(accounting))
+            if len(missing):
+                accounting.update(software.job_accounting(missing))
+
+        # stage the qstat snapshot, to find jobs that are not in the database
+        self.curs.execute("CREATE TEMP TABLE IF NOT EXISTS snapshot (jobid text PRIMARY KEY)")
+        self.curs.execute("DELETE FROM snapshot")
+        self.curs.executemany("INSERT OR IGNORE INTO snapshot (jobid) VALUES (?)",
+                              [(k,) for k in active_status])
+        self.curs.execute("SELECT snapshot.jobid FROM snapshot LEFT JOIN jobs\
+                           ON jobs.jobid=snapshot.jobid WHERE jobs.jobid IS NULL")
+        self.untracked = [active_status[r["jobid"]] for r in self.curs.fetchall()]
         self.conn.commit()
 
-        # update taskstatus for non-auto jobs
-        self.curs.execute(
-            "UPDATE jobs SET taskstatus='Check', modifytime=? \
-            WHERE jobstatus='C' AND taskstatus='Incomplete' AND auto=0",
-            (int(time.time()),))
-        self.conn.commit()
+        def _apply(curs):
+            """Update database with latest job status, only writing changed records"""
+            now = int(time.time())
+            nchanged = 0
+            curs.executemany(
+                "UPDATE jobs SET jobstatus=?, elapsedtime=?, modifytime=? WHERE jobid=?",
+                [("C", None, now, key) for key in completed if key not in accounting])
+            nchanged += max(curs.rowcount, 0)
+            curs.executemany(
+                "UPDATE jobs SET jobstatus=?, elapsedtime=?, starttime=IFNULL(?, starttime),\
+                 completiontime=?, exitcode=?, finalstate=?, modifytime=? WHERE jobid=?",
+                [(
+                    "C", accounting[key]["elapsedtime"], accounting[key]["starttime"],
+                    accounting[key]["completiontime"], accounting[key]["exitcode"],
+                    accounting[key]["finalstate"], now, key)
+                 for key in completed if key in accounting])
+            nchanged += max(curs.rowcount, 0)
+            curs.executemany(
+                "UPDATE jobs SET elapsedtime=?, starttime=IFNULL(?, starttime),\
+                 completiontime=?, exitcode=?, finalstate=?, modifytime=? WHERE jobid=? AND\
+                 jobstatus='C' AND finalstate IS NULL",
+                [(
+                    accounting[key]["elapsedtime"], accounting[key]["starttime"],
+                    accounting[key]["completiontime"], accounting[key]["exitcode"],
+                    accounting[key]["finalstate"], now, key)
+                 for key in retry if key in accounting])
+            nchanged += max(curs.rowcount, 0)
+            curs.executemany(
+                "UPDATE jobs SET jobstatus=?, elapsedtime=?, starttime=?,\
+                 completiontime=?, qstatstr=IFNULL(?, qstatstr), modifytime=? WHERE jobid=? AND\
+                 (jobstatus IS NOT ? OR starttime IS NOT ? OR completiontime IS NOT ?)",
+                [(
+                    active_status[key]["jobstatus"], active_status[key]["elapsedtime"],
+                    active_status[key]["starttime"], active_status[key]["completiontime"],
+                    active_status[key]["qstatstr"], now, key,
+                    active_status[key]["jobstatus"], active_status[key]["starttime"],
+                    active_status[key]["completiontime"]) for key in active])
+            nchanged += max(curs.rowcount, 0)
+
+            # update taskstatus for non-auto jobs
+            curs.execute(
+                "UPDATE jobs SET taskstatus='Check', modifytime=? \
+                WHERE jobstatus='C' AND taskstatus='Incomplete' AND auto=0",
+                (now,))
+            nchanged += max(curs.rowcount, 0)
+
+            # the next incremental poll queries changes since this snapshot
+            if policy['enabled']:
+                self._set_meta(curs, "poll_cursor." + host, snapshottime)
+                if not incremental:
+                    self._set_meta(curs, "full_poll." + host, snapshottime)
+            return nchanged
+
+        return self._retry(_apply)
+
+
+    def _get_meta(self, key):
+        """Return a value stored in the meta table, or None"""
+        r = self._retry(lambda curs: curs.execute(     #pylint: disable=invalid-name
+            "SELECT value FROM meta WHERE key=?", (key,)).fetchone())
+        return None if r is None else r[0]
+
+
+    def _set_meta(self, curs, key, value):  #pylint: disable=no-self-use
+        """Store a value in the meta table"""
+        curs.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
 
 
     def select_job(self, jobid):
@@ -347,8 +960,9 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
             print("Error in prisms_jobs.JobDB.select_job(). type(id):", type(jobid), "expected str.")
             sys.exit()
 
-        self.curs.execute("SELECT * FROM jobs WHERE jobid=?", (jobid,))
-        r = self.curs.fetchall()    #pylint: disable=invalid-name
+        r = self._retry(lambda curs: curs.execute(     #pylint: disable=invalid-name
+            "SELECT " + select_columns_str() + " FROM jobs WHERE jobid=?",
+            (jobid,)).fetchall())
         if len(r) == 0:
             raise JobDBError("Error in prisms_jobs.JobDB.select_job(). jobid: '"
                              + jobid + "' not found in jobs database.")
@@ -361,16 +975,12 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
 
     def select_series(self, jobid):
         """Return records (sqlite3.Row objects) for a series of auto jobs"""
-        r = self.select_job(jobid)  #pylint: disable=invalid-name
-        series = [r]
-        parent = self.select_parent(jobid)
-        while parent is not None:
-            series.insert(0, parent)
-            parent = self.select_parent(parent["jobid"])
-        child = self.select_child(jobid)
-        while child is not None:
-            series.append(child)
-            child = self.select_child(child["jobid"])
+        self.curs.execute(SERIES_CTE + "SELECT " + select_columns_str() + " FROM series JOIN jobs"
+                          " ON jobs.jobid=series.jobid ORDER BY series.position",
+                          (jobid, jobid))
+        series = [CompatibilityRow(r) for r in self.curs.fetchall()]
+        if len(series) == 0:
+            self.select_job(jobid)  # raises JobDBError
         return series
 
 
@@ -383,7 +993,8 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
             print("Error in prisms_jobs.JobDB.select_parent(). type(id):", type(jobid), "expected str.")
             sys.exit()
 
-        self.curs.execute("SELECT * FROM jobs WHERE continuation_jobid=?", (jobid,))
+        self.curs.execute("SELECT " + select_columns_str() + " FROM jobs WHERE continuation_jobid=?",
+                          (jobid,))
         r = self.curs.fetchall()    #pylint: disable=invalid-name
         if len(r) == 0:
             return None
@@ -396,6 +1007,254 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         return CompatibilityRow(r[0])
 
 
+    def select_dependencies(self, jobid):
+        """Return the IDs (List(str)) of the workflow jobs a job depends on"""
+        return [r["parent"] for r in self._retry(lambda curs: curs.execute(
+            "SELECT parent FROM edges WHERE child=? AND parent IS NOT NULL", (jobid,)).fetchall())]
+
+
+    def select_dependents(self, jobid):
+        """Return the IDs (List(str)) of the workflow jobs that depend on a job"""
+        return [r["child"] for r in self._retry(lambda curs: curs.execute(
+            "SELECT child FROM edges WHERE parent=?", (jobid,)).fetchall())]
+
+
+    def select_workflow(self, workflow):
+        """Return the IDs (List(str)) of the jobs of a workflow, in the order submitted"""
+        return [r["child"] for r in self._retry(lambda curs: curs.execute(
+            "SELECT child FROM edges WHERE workflow=? GROUP BY child ORDER BY MIN(rowid)",
+            (workflow,)).fetchall())]
+
+
+    def add_workflow_jobs(self, workflow, job_status_list, edges):
+        """Add records of workflow jobs, and their dependencies, in one transaction.
+
+        Args:
+            workflow (str): Name of the workflow
+            job_status_list (List(dict)):
+                Dictionaries of data comprising the records. Create each using
+                prisms_jobs.jobdb.job_status_dict().
+            edges (List((str, str))): (parent, child) job IDs, for each child
+                that starts after parent completes successfully. Jobs that do
+                not depend on other jobs are given as (None, child).
+
+        """
+        def _add(curs):
+            for job_status in job_status_list:
+                self._insert(curs, job_status)
+            curs.executemany("INSERT INTO edges (workflow, parent, child) VALUES (?, ?, ?)",
+                             [(workflow, parent, child) for parent, child in edges])
+        self._retry(_add)
+
+
+    def workflow_progress(self, workflow=None):
+        """Return the progress of workflows
+
+        Args:
+            workflow (str, optional): Name of a workflow. By default, all
+                workflows.
+
+        Returns:
+            List(sqlite3.Row): One per workflow, with columns 'workflow',
+                'jobs' (number of jobs), 'queued' (jobstatus not 'R' or 'C'),
+                'running' (jobstatus 'R'), 'complete' (taskstatus 'Complete',
+                'Continued', or 'Check'), and 'failed' (taskstatus 'Error:...'
+                or 'Aborted').
+        """
+        sql = "SELECT w.workflow AS workflow, COUNT(*) AS jobs,\
+               SUM(jobs.jobstatus!='R' AND jobs.jobstatus!='C') AS queued,\
+               SUM(jobs.jobstatus='R') AS running,\
+               SUM(jobs.taskstatus IN ('Complete', 'Continued', 'Check')) AS complete,\
+               SUM(jobs.taskstatus LIKE 'Error:%' OR jobs.taskstatus='Aborted') AS failed\
+               FROM (SELECT DISTINCT workflow, child FROM edges) AS w\
+               JOIN jobs ON jobs.jobid=w.child"
+        params = ()
+        if workflow is not None:
+            sql += " WHERE w.workflow=?"
+            params = (workflow,)
+        sql += " GROUP BY w.workflow ORDER BY MIN(jobs.creationtime)"
+        return self._retry(lambda curs: curs.execute(sql, params).fetchall())
+
+
+    def print_workflows(self, workflow=None):
+        """Print the progress of workflows (see workflow_progress)"""
+        print("{0:<24} {1:>6} {2:>6} {3:>7} {4:>8} {5:>6}"
+              .format("Workflow", "Jobs", "Queued", "Running", "Complete", "Failed"))
+        print("{0:-<24} {1:->6} {2:->6} {3:->7} {4:->8} {5:->6}"
+              .format("", "", "", "", "", ""))
+        for r in self.workflow_progress(workflow):  #pylint: disable=invalid-name
+            print("{0:<24} {1:>6} {2:>6} {3:>7} {4:>8} {5:>6}"
+                  .format(trunc(r["workflow"], 24), r["jobs"], r["queued"], r["running"],
+                          r["complete"], r["failed"]))
+
+
+    def add_tasks(self, pool, commands, rundir=None):
+        """Add tasks to a task pool, in one transaction
+
+        Args:
+            pool (str): Name of the task pool
+            commands (List(str)): Shell command of each task
+            rundir (str or List(str), optional): Directory to run all the
+                tasks in, or each task in. Default is the current working
+                directory.
+
+        Returns:
+            List(int): IDs of the tasks added
+        """
+        if rundir is None or isinstance(rundir, string_types):
+            rundir = [os.path.abspath(rundir or os.getcwd())]*len(commands)
+        elif len(rundir) != len(commands):
+            raise JobDBError("add_tasks requires one 'rundir' per task")
+
+        def _add(curs):
+            ids = []
+            for command, taskdir in zip(commands, rundir):
+                curs.execute("INSERT INTO tasks (pool, command, rundir, status)\
+                              VALUES (?, ?, ?, 'Pending')",
+                             (pool, command, os.path.abspath(taskdir)))
+                ids.append(curs.lastrowid)
+            return ids
+        return self._retry(_add)
+
+
+    def _record_tasks(self, curs, results):  #pylint: disable=no-self-use
+        """Record (id, returncode, endtime) of finished tasks"""
+        curs.executemany("UPDATE tasks SET status=?, returncode=?, endtime=? WHERE id=?",
+                         [("Complete" if returncode == 0 else "Error", returncode, endtime, taskid)
+                          for taskid, returncode, endtime in results])
+
+
+    def claim_tasks(self, pool, ntasks, jobid, results=None):
+        """Claim 'Pending' tasks for a worker, and record finished tasks, in one transaction
+
+        Tasks are claimed with a single UPDATE, so concurrent workers never
+        claim the same task.
+
+        Args:
+            pool (str): Name of the task pool
+            ntasks (int): Maximum number of tasks to claim. May be 0, to only
+                record results.
+            jobid (str): ID of the worker job
+            results (List((int, int, int)), optional): (id, returncode,
+                endtime) of tasks finished since the last call. A returncode
+                of 0 marks the task 'Complete', anything else 'Error'.
+
+        Returns:
+            List(sqlite3.Row): The claimed tasks, with columns 'id', 'command',
+                and 'rundir', in the order added
+        """
+        claim = uuid.uuid4().hex
+
+        def _claim(curs):
+            self._record_tasks(curs, results or [])
+            if ntasks <= 0:
+                return []
+            curs.execute("UPDATE tasks SET status='Running', claim=?, jobid=?, starttime=?\
+                          WHERE id IN (SELECT id FROM tasks WHERE pool=? AND status='Pending'\
+                                       ORDER BY id LIMIT ?)",
+                         (claim, jobid, int(time.time()), pool, ntasks))
+            return curs.execute("SELECT id, command, rundir FROM tasks WHERE claim=? ORDER BY id",
+                                (claim,)).fetchall()
+        return self._retry(_claim)
+
+
+    def release_tasks(self, ids, results=None):
+        """Return claimed tasks to 'Pending', and record finished tasks, in one transaction
+
+        Args:
+            ids (List(int)): IDs of claimed tasks that did not finish
+            results (List((int, int, int)), optional): (id, returncode,
+                endtime) of finished tasks, as for claim_tasks
+        """
+        def _release(curs):
+            self._record_tasks(curs, results or [])
+            curs.executemany("UPDATE tasks SET status='Pending', claim=NULL, jobid=NULL,\
+                              starttime=NULL WHERE id=? AND status='Running'",
+                             [(taskid,) for taskid in ids])
+        self._retry(_release)
+
+
+    def requeue_tasks(self, pool=None):
+        """Return tasks claimed by worker jobs that have ended to 'Pending'
+
+        Tasks left 'Running' by a worker that was killed, for instance at the
+        end of its walltime, are found using the worker's jobstatus in the jobs
+        table. Called each ``taskmaster`` cycle, after JobDB.update.
+
+        Args:
+            pool (str, optional): Name of a task pool. By default, all pools.
+
+        Returns:
+            int: Number of tasks returned to 'Pending'
+        """
+        sql = "UPDATE tasks SET status='Pending', claim=NULL, jobid=NULL, starttime=NULL\
+               WHERE status='Running'\
+               AND jobid IN (SELECT jobid FROM jobs WHERE jobstatus='C')"
+        params = ()
+        if pool is not None:
+            sql += " AND pool=?"
+            params = (pool,)
+        return self._retry(lambda curs: curs.execute(sql, params).rowcount)
+
+
+    def delete_tasks(self, pool):
+        """Delete all the tasks of a task pool"""
+        self._retry(lambda curs: curs.execute("DELETE FROM tasks WHERE pool=?", (pool,)))
+
+
+    def select_tasks(self, pool, status=None):
+        """Return the tasks of a task pool
+
+        Args:
+            pool (str): Name of the task pool
+            status (str, optional): Only select tasks with this status
+
+        Returns:
+            List(sqlite3.Row): Tasks, with all columns, in the order added
+        """
+        sql = "SELECT * FROM tasks WHERE pool=?"
+        params = (pool,)
+        if status is not None:
+            sql += " AND status=?"
+            params = (pool, status)
+        return self._retry(lambda curs: curs.execute(sql + " ORDER BY id", params).fetchall())
+
+
+    def task_progress(self, pool=None):
+        """Return the progress of task pools
+
+        Args:
+            pool (str, optional): Name of a task pool. By default, all pools.
+
+        Returns:
+            List(sqlite3.Row): One per pool, with columns 'pool', 'tasks'
+                (number of tasks), and the number of tasks with each status:
+                'pending', 'running', 'complete', and 'error'.
+        """
+        sql = "SELECT pool, COUNT(*) AS tasks,\
+               SUM(status='Pending') AS pending, SUM(status='Running') AS running,\
+               SUM(status='Complete') AS complete, SUM(status='Error') AS error\
+               FROM tasks"
+        params = ()
+        if pool is not None:
+            sql += " WHERE pool=?"
+            params = (pool,)
+        sql += " GROUP BY pool ORDER BY MIN(id)"
+        return self._retry(lambda curs: curs.execute(sql, params).fetchall())
+
+
+    def print_tasks(self, pool=None):
+        """Print the progress of task pools (see task_progress)"""
+        print("{0:<24} {1:>7} {2:>7} {3:>7} {4:>8} {5:>6}"
+              .format("Pool", "Tasks", "Pending", "Running", "Complete", "Error"))
+        print("{0:-<24} {1:->7} {2:->7} {3:->7} {4:->8} {5:->6}"
+              .format("", "", "", "", "", ""))
+        for r in self.task_progress(pool):  #pylint: disable=invalid-name
+            print("{0:<24} {1:>7} {2:>7} {3:>7} {4:>8} {5:>6}"
+                  .format(trunc(r["pool"], 24), r["tasks"], r["pending"], r["running"],
+                          r["complete"], r["error"]))
+
+
     def select_child(self, jobid):
         """Return record for the child of a job
 
@@ -406,7 +1265,8 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         if r["continuation_jobid"] == "-":
             return None
 
-        self.curs.execute("SELECT * FROM jobs WHERE jobid=?", (r["continuation_jobid"],))
+        self.curs.execute("SELECT " + select_columns_str() + " FROM jobs WHERE jobid=?",
+                          (r["continuation_jobid"],))
         r = self.curs.fetchall()    #pylint: disable=invalid-name
         if len(r) == 0:
             print ("Error in prisms_jobs.JobDB.select_child(). jobid:",
@@ -422,6 +1282,123 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
 
 
 
+    def select(self, jobid=None, jobrange=None, recent=None, regex=None, active=False, #pylint: disable=too-many-arguments, too-many-locals, too-many-branches
+               series=False, columns=None, lazy=False):
+        """Select job records matching all given criteria with one SQL query
+
+        Args:
+            jobid (List[str], optional): Select jobs with these jobids.
+            jobrange ((str, str), optional): Select jobs with jobid between (and
+                including) jobrange[0] and jobrange[1].
+            recent (str, optional): Select jobs created or modified within the 
+                last ``[[[DD:]HH:]MM:]SS``.
+            regex ((str, str), optional): Select jobs in which the column 
+                regex[0] matches the regular expression regex[1].
+            active (bool, optional, default=False): Select only "active" jobs, 
+                those with taskstatus not 'Complete', 'Aborted', or 'Continued'.
+            series (bool, optional, default=False): If True, select all jobs in
+                each series that contains a matching job. Records are ordered
+                by series and include the column "series_id", the jobid of the
+                last job in the series.
+            columns (List[str], optional): Only fetch these columns (and
+                "jobid"). By default, fetch all columns.
+            lazy (bool, optional, default=False): If True, fetch the 
+                LARGE_COLUMNS ("qsubstr", "qstatstr") of a record only when
+                accessed. Records are then LazyRecord.
+
+        Returns:
+            An iterator over the selected records (CompatibilityRow). The query
+            is run when iteration starts, and uses its own cursor, so other 
+            JobDB methods may be called while iterating.
+
+        Raises:
+            JobDBError: For an invalid 'regex' key or 'jobrange'.
+        """
+        where = []
+        params = []
+        # a temporary table of many jobids, created when the query is run, and
+        # dropped when the records are consumed or the iterator is closed
+        table = None
+        if jobid is not None:
+            if len(jobid) <= 500:
+                where.append("jobid IN (" + ", ".join(["?"]*len(jobid)) + ")")
+                params += list(jobid)
+            else:
+                self._nselection += 1
+                table = "selection_" + str(self._nselection)
+                where.append("jobid IN (SELECT jobid FROM temp." + table + ")")
+        if jobrange is not None:
+            range_where, range_params = self._range_where(jobrange[0], jobrange[1])
+            where.append(range_where)
+            params += list(range_params)
+        if recent is not None:
+            where.append("modifytime>=?")
+            params.append(int(time.time() - misc.seconds(recent)))
+        if regex is not None:
+            if regex[0] not in job_status_dict():
+                raise JobDBError(regex[0] + " not a valid key")
+            where.append(column_expr(regex[0]) + " REGEXP ?")
+            params.append(regex[1])
+        if active:
+            where.append("taskstatus NOT IN ('Complete', 'Aborted', 'Continued')")
+        wherestr = " WHERE " + " AND ".join(where) if len(where) else ""
+
+        # projection: only fetch needed columns
+        all_columns = list(job_status_dict())
+        if lazy:
+            columns = [c for c in (columns or all_columns) if c not in LARGE_COLUMNS]
+        if columns is not None:
+            for c in columns:
+                if c not in all_columns:
+                    raise JobDBError(c + " not a valid key")
+            if "jobid" not in columns:
+                columns = ["jobid"] + list(columns)
+        colstr = select_columns_str(columns)
+
+        def _records(sql):
+            """Run the query and iterate over selected records"""
+            curs = self.conn.cursor()
+            try:
+                if table is not None:
+                    curs.execute("CREATE TEMP TABLE " + table + " (jobid text PRIMARY KEY)")
+                    curs.executemany("INSERT OR IGNORE INTO temp." + table + " (jobid) VALUES (?)",
+                                     [(j,) for j in jobid])
+                    self.conn.commit()
+                curs.execute(sql, params)
+                for r in sql_iter(curs):    #pylint: disable=invalid-name
+                    yield LazyRecord(r, self.conn, all_columns) if lazy else r
+            finally:
+                curs.close()
+                if table is not None:
+                    try:
+                        self.conn.execute("DROP TABLE IF EXISTS temp." + table)
+                    except sqlite3.Error:
+                        pass
+
+        if not series:
+            return _records("SELECT " + colstr + " FROM jobs" + wherestr + " ORDER BY rowid")
+
+        # find the last job of each series with a selected job, then collect
+        # each series by following continuation_jobid backwards
+        return _records("""
+            WITH RECURSIVE
+              tail(jobid, continuation_jobid) AS (
+                SELECT jobid, continuation_jobid FROM jobs""" + wherestr + """
+                UNION
+                SELECT jobs.jobid, jobs.continuation_jobid FROM jobs
+                  JOIN tail ON jobs.jobid=tail.continuation_jobid
+                  WHERE tail.continuation_jobid!='-'),
+              members(jobid, series_id, position) AS (
+                SELECT jobid, jobid, 0 FROM tail WHERE continuation_jobid='-'
+                UNION ALL
+                SELECT jobs.jobid, members.series_id, members.position-1 FROM jobs
+                  JOIN members ON jobs.continuation_jobid=members.jobid)
+            SELECT """ + colstr + """, members.series_id AS series_id FROM members
+              JOIN jobs ON jobs.jobid=members.jobid
+              JOIN jobs AS last ON last.jobid=members.series_id
+              ORDER BY last.rowid, members.position""")
+
+
     def select_all_id(self):
         """Return a list with all jobids."""
         job = []
@@ -444,15 +1421,32 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         return active_job
 
 
+    def _range_where(self, min_jobid, max_jobid):  #pylint: disable=no-self-use
+        """ Return SQL condition and parameters selecting jobs between (and
+                including) min_jobid and max_jobid, which may be array job IDs """
+        min_num, min_index = parse_jobid(min_jobid)
+        max_num, max_index = parse_jobid(max_jobid)
+        if min_num is None or max_num is None:
+            raise JobDBError("Could not parse job range: " + min_jobid + " " + max_jobid)
+        where = "jobnum BETWEEN ? AND ?"
+        params = [min_num, max_num]
+        # jobs without arrayindex are ordered before their array elements
+        if min_index is not None:
+            where += " AND NOT (jobnum=? AND IFNULL(arrayindex, -1)<?)"
+            params += [min_num, min_index]
+        if max_index is not None:
+            where += " AND NOT (jobnum=? AND IFNULL(arrayindex, -1)>?)"
+            params += [max_num, max_index]
+        return where, tuple(params)
+
+
     def select_range_id(self, min_jobid, max_jobid):
         """ Return a list of all jobids which are between (and including)
                 min_jobid and max_jobid. """
-        job = []
-        self.curs.execute("SELECT jobid FROM jobs")
-        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            if int(r["jobid"]) >= int(min_jobid) and int(r["jobid"]) <= int(max_jobid):
-                job.append(r["jobid"])
-        return job
+        where, params = self._range_where(min_jobid, max_jobid)
+        self.curs.execute("SELECT jobid FROM jobs WHERE " + where
+                          + " ORDER BY jobnum, arrayindex", params)
+        return [r["jobid"] for r in sql_iter(self.curs)]
 
 
     def select_recent_id(self, recent_time):
@@ -470,7 +1464,8 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                 regular expression 'regex' """
         job = []
         if key in job_status_dict():
-            self.curs.execute("SELECT jobid FROM jobs WHERE " + key + " REGEXP ?", (regex, ))
+            self.curs.execute("SELECT jobid FROM jobs WHERE " + column_expr(key) + " REGEXP ?",
+                              (regex, ))
             for r in sql_iter(self.curs):   #pylint: disable=invalid-name
                 job.append(r["jobid"])
         else:
@@ -481,27 +1476,39 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
 
     def select_series_id(self, jobid):
         """Return a list with all jobids for a series of auto jobs."""
-        job = [jobid]
-        r = self.select_job(jobid)  #pylint: disable=invalid-name, unused-variable
-        parent = self.select_parent(jobid)
-        while parent is not None:
-            job.insert(0, parent["jobid"])
-            parent = self.select_parent(parent["jobid"])
-        child = self.select_child(jobid)
-        while child is not None:
-            job.append(child["jobid"])
-            child = self.select_child(child["jobid"])
+        self.curs.execute(SERIES_CTE + "SELECT jobid FROM series ORDER BY position",
+                          (jobid, jobid))
+        job = [r["jobid"] for r in self.curs.fetchall()]
+        if len(job) == 0:
+            self.select_job(jobid)  # raises JobDBError
         return job
 
 
+    def _parent_map(self):
+        """Return dict of jobid -> jobid of parent, from one scan of the jobs table"""
+        parent = dict()
+        self.curs.execute("SELECT jobid, continuation_jobid FROM jobs WHERE continuation_jobid!='-'")
+        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
+            parent[r["continuation_jobid"]] = r["jobid"]
+        return parent
+
+
+    def _select_series_id_from_last(self, sql, params=()):
+        """Return a list of lists of jobids, one for each series whose last job
+           is selected by 'sql' (which must select 'jobid' and 'continuation_jobid')
+        """
+        self.curs.execute(sql, params)
+        last = [r["jobid"] for r in sql_iter(self.curs) if r["continuation_jobid"] == "-"]
+        if len(last) == 0:
+            return []
+        parent = self._parent_map()
+        return [_series_from_last(j, parent) for j in last]
+
+
     def select_all_series_id(self):
         """Return a list of lists of jobids (one list for each series)."""
-        all_series = []
-        self.curs.execute("SELECT * FROM jobs")
-        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            if r["continuation_jobid"] == "-":
-                all_series.append(self.select_series_id(r["jobid"]))
-        return all_series
+        return self._select_series_id_from_last(
+            "SELECT jobid, continuation_jobid FROM jobs")
 
 
     def select_active_series_id(self):
@@ -510,56 +1517,39 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
            "Active" series of auto jobs are those with one job with
                 taskstatus='Incomplete' or 'Check'
         """
-        active_series = []
-        self.curs.execute("SELECT jobid, continuation_jobid FROM jobs WHERE\
-                           taskstatus!='Complete' AND taskstatus!='Aborted'\
-                           AND taskstatus!='Continued'")
-        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            if r["continuation_jobid"] == "-":
-                active_series.append(self.select_series_id(r["jobid"]))
-        return active_series
+        return self._select_series_id_from_last(
+            "SELECT jobid, continuation_jobid FROM jobs WHERE\
+             taskstatus!='Complete' AND taskstatus!='Aborted'\
+             AND taskstatus!='Continued'")
 
 
     def select_range_series_id(self, min_jobid, max_jobid):
         """ Return a list of lists of all jobids for series (one list for each series)
             which have the last job between (and including) min_jobid and max_jobid.
         """
-        job = []
-        self.curs.execute("SELECT jobid, continuation_jobid FROM jobs")
-        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            if int(r["jobid"]) >= int(min_jobid) and int(r["jobid"]) <= int(max_jobid):
-                if r["continuation_jobid"] == "-":
-                    job.append(self.select_series_id(r["jobid"]))
-        return job
+        where, params = self._range_where(min_jobid, max_jobid)
+        return self._select_series_id_from_last(
+            "SELECT jobid, continuation_jobid FROM jobs WHERE " + where
+            + " ORDER BY jobnum, arrayindex", params)
 
 
     def select_recent_series_id(self, recent_time):
         """ Return a list of lists of jobids (one for each series) which were
                 modified in the last 'recent_time' """
         mintime = int(time.time() - misc.seconds(recent_time))
-        recent_job = []
-        self.curs.execute("SELECT jobid FROM jobs WHERE modifytime>=?", (mintime, ))
-        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            if r["continuation_jobid"] == "-":
-                recent_job.append(self.select_series_id(r["jobid"]))
-        return recent_job
+        return self._select_series_id_from_last(
+            "SELECT jobid, continuation_jobid FROM jobs WHERE modifytime>=?", (mintime, ))
 
 
     def select_regex_series_id(self, key, regex):
         """ Return a list of lists of jobids (one for each series) in which the column
             'key' matches the regular expression 'regex'
         """
-
-        job = []
-        if  key in job_status_dict():
-            self.curs.execute("SELECT jobid FROM jobs WHERE " + key + " REGEXP ?", (regex))
-            for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-                if r["continuation_jobid"] == "-":
-                    job.append(self.select_series_id(r["jobid"]))
-        else:
+        if key not in job_status_dict():
             raise JobDBError(key + " not a valid key")
-
-        return job
+        return self._select_series_id_from_last(
+            "SELECT jobid, continuation_jobid FROM jobs WHERE " + column_expr(key) + " REGEXP ?",
+            (regex, ))
 
 
 
@@ -609,28 +1599,314 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         if not eligible:
             raise EligibilityError(id, msg)
 
-        wd = os.getcwd()    #pylint: disable=invalid-name
-        os.chdir(job["rundir"])
+        self._continue([job])
 
-        new_jobid = config.software().submit(substr=job["qsubstr"])
 
-        self.curs.execute("UPDATE jobs SET taskstatus='Continued', modifytime=?,\
-                           continuation_jobid=? WHERE jobid=?",
-                          (int(time.time()), new_jobid, job["jobid"]))
-        status = job_status_dict(jobid=new_jobid, jobname=job["jobname"], rundir=os.getcwd(),
-                                 jobstatus="?", auto=job["auto"], qsubstr=job["qsubstr"],
-                                 nodes=job["nodes"], procs=job["procs"], walltime=job["walltime"])
-        self.add(status)
+    def _continue(self, jobs, nthreads=1, prequeue=False):
+        """Resubmit eligible jobs, and record the continuations in one transaction
 
-        os.chdir(wd)
+        Jobs are submitted from their 'rundir', without changing the current
+        working directory, by up to 'nthreads' threads at once. Jobs that would
+        exceed the 'submit_limits' setting are held. Jobs whose continuation
+        was pre-queued are only marked 'Continued'. If any submissions fail,
+        the others are still recorded, and then the first error is raised.
 
+        Before submitting, each job is claimed by setting its
+        'continuation_jobid' to a "claim:..." token, but only if it is still
+        'Incomplete' and has no continuation. So when several processes
+        continue jobs from the same database at once (for instance two
+        ``taskmaster`` instances), each job is continued only once. Jobs
+        claimed by another process are skipped. Claims include the time they
+        were made, and a claim older than _CLAIM_TIMEOUT seconds, left by a
+        process that died before recording its result, is taken over. If a
+        claimed job is completed, aborted, marked as an error, or deleted
+        while it is being continued, or its claim is taken over, its new job
+        is cancelled rather than recorded.
 
-    def continue_all(self):
-        """Resubmit all jobs eligible to continue"""
-        self.curs.execute("SELECT jobid FROM jobs WHERE auto=1 AND\
-                           taskstatus='Incomplete' AND jobstatus='C'")
-        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            self.continue_job(r["jobid"])
+        Args:
+            jobs (List(sqlite3.Row)): Records of jobs eligible to continue, or
+                if 'prequeue', of running jobs to pre-queue continuations of
+            nthreads (int, optional, default=1): Maximum number of concurrent
+                submissions
+            prequeue (bool, optional, default=False): If True, submit the
+                continuations to start after the jobs end ("afterany"), and
+                leave the jobs 'Incomplete'. Jobs that would exceed the
+                'submit_limits' setting are skipped, rather than held.
+        """
+        now = int(time.time())
+        claim = "claim:" + str(now) + ":" + uuid.uuid4().hex[:12]
+        continued = []
+        candidates = []
+        for job in jobs:
+            if _claimed(job["continuation_jobid"], now):
+                continue
+            if not prequeue and job["continuation_jobid"] not in (None, "-") \
+                    and not job["continuation_jobid"].startswith("claim:"):
+                continued.append(job)
+                continue
+            queue, account = governor.script_resources(job["qsubstr"])
+            if governor.has_capacity(queue, account):
+                candidates.append((job, queue, account, True))
+            elif not prequeue:
+                candidates.append((job, queue, account, False))
+
+        def _claim(curs):
+            """Return the candidates claimed, skipping those continued by another process"""
+            claimed = []
+            for candidate in candidates:
+                # an expired claim is replaced only if it is still the one read
+                if curs.execute("UPDATE jobs SET continuation_jobid=? WHERE jobid=?\
+                                 AND taskstatus='Incomplete'\
+                                 AND (continuation_jobid IS NULL OR continuation_jobid='-'\
+                                      OR continuation_jobid=?)",
+                                (claim, candidate[0]["jobid"],
+                                 candidate[0]["continuation_jobid"] or "-")).rowcount == 1:
+                    claimed.append(candidate)
+            return claimed
+
+        submit = []
+        held = []
+        for job, queue, account, fits in (self._retry(_claim) if len(candidates) else []):
+            if fits:
+                governor.record(queue, account)
+                submit.append(job)
+            else:
+                held.append((job, queue, account))
+
+        def _submit(job):
+            """Return (new_jobid, None), or (None, exception) if submission failed"""
+            dependency = "afterany:" + job["jobid"] if prequeue else None
+            try:
+                return (config.software().submit(substr=job["qsubstr"], rundir=job["rundir"],
+                                                 dependency=dependency), None)
+            except Exception as e:  #pylint: disable=broad-except, invalid-name
+                return (None, e)
+
+        if nthreads > 1 and len(submit) > 1:
+            pool = ThreadPool(min(nthreads, len(submit)))
+            try:
+                results = pool.map(_submit, submit)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_submit(job) for job in submit]
+        if len(submit):
+            status_cache.invalidate()
+
+        taskstatus = "Incomplete" if prequeue else "Continued"
+        # new jobs whose job was completed, aborted, etc. while being submitted
+        unclaimed = []
+
+        def _apply(curs):
+            """Mark the jobs 'Continued', and add the new jobs or hold their continuations"""
+            now = int(time.time())
+            del unclaimed[:]
+            curs.executemany("UPDATE jobs SET taskstatus='Continued', modifytime=? WHERE jobid=?",
+                             [(now, job["jobid"]) for job in continued])
+            for job, (new_jobid, _) in zip(submit, results):
+                if new_jobid is None:
+                    curs.execute("UPDATE jobs SET continuation_jobid='-' WHERE jobid=?\
+                                  AND continuation_jobid=?", (job["jobid"], claim))
+                    continue
+                if curs.execute("UPDATE jobs SET taskstatus=?, modifytime=?,\
+                                 continuation_jobid=? WHERE jobid=? AND continuation_jobid=?\
+                                 AND taskstatus='Incomplete'",
+                                (taskstatus, now, new_jobid, job["jobid"], claim)).rowcount != 1:
+                    curs.execute("UPDATE jobs SET continuation_jobid='-' WHERE jobid=?\
+                                  AND continuation_jobid=?", (job["jobid"], claim))
+                    unclaimed.append(new_jobid)
+                    continue
+                self._insert(curs, job_status_dict(
+                    jobid=new_jobid, jobname=job["jobname"], rundir=job["rundir"],
+                    jobstatus="?", auto=job["auto"], qsubstr=job["qsubstr"],
+                    nodes=job["nodes"], procs=job["procs"], walltime=job["walltime"],
+                    prequeue=job["prequeue"]))
+            for job, queue, account in held:
+                if curs.execute("UPDATE jobs SET taskstatus='Continued', modifytime=?,\
+                                 continuation_jobid='-' WHERE jobid=? AND continuation_jobid=?\
+                                 AND taskstatus='Incomplete'",
+                                (now, job["jobid"], claim)).rowcount != 1:
+                    curs.execute("UPDATE jobs SET continuation_jobid='-' WHERE jobid=?\
+                                  AND continuation_jobid=?", (job["jobid"], claim))
+                    continue
+                self._hold(curs, job_status_dict(
+                    jobname=job["jobname"], rundir=job["rundir"], auto=job["auto"],
+                    qsubstr=job["qsubstr"], nodes=job["nodes"], procs=job["procs"],
+                    walltime=job["walltime"], prequeue=job["prequeue"]),
+                           queue, account, continues=job["jobid"])
+        self._retry(_apply)
+
+        for new_jobid in unclaimed:
+            print("Job no longer eligible to continue, cancelling:", new_jobid)
+            try:
+                config.software().delete(new_jobid)
+            except Exception as e:  #pylint: disable=broad-except, invalid-name
+                print("Error cancelling", new_jobid + ":", e)
+        for job, _, _ in held:
+            print("Submission limit reached, holding continuation of:", job["jobid"])
+        for _, err in results:
+            if err is not None:
+                raise err
+
+
+    def _hold(self, curs, job_status, queue=None, account=None, continues=None):
+        """Add a job to the pending table"""
+        qsubhash = store_script(curs, job_status["qsubstr"], self.policy['compress_scripts'])
+        curs.execute("INSERT INTO pending (holdtime, jobname, rundir, auto, qsubhash, walltime,\
+                      nodes, procs, queue, account, continues, prequeue)\
+                      VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                     (int(time.time()), job_status["jobname"], job_status["rundir"],
+                      int(bool(job_status["auto"])), qsubhash, job_status["walltime"],
+                      job_status["nodes"], job_status["procs"], queue, account, continues,
+                      int(bool(job_status.get("prequeue")))))
+
+
+    def hold(self, job_status, queue=None, account=None):
+        """Hold a job, to be submitted later by submit_pending.
+
+        Used for jobs that would exceed the 'submit_limits' setting (see
+        prisms_jobs.governor).
+
+        Args:
+            job_status (dict):
+                The 'jobname', 'rundir', 'auto', 'qsubstr', 'walltime',
+                'nodes', and 'procs' of the job. Create ``job_status`` using
+                prisms_jobs.jobdb.job_status_dict().
+            queue (str, optional): Queue the job is submitted to.
+            account (str, optional): Account the job is charged to.
+
+        """
+        self._retry(lambda curs: self._hold(curs, job_status, queue, account))
+
+
+    def select_pending(self):
+        """Return records (List(sqlite3.Row)) of held jobs, in the order they were held.
+
+        Columns are those of the 'pending' table, and 'qsubstr'.
+        """
+        return self._retry(lambda curs: curs.execute(
+            "SELECT pending.*, " + PENDING_QSUBSTR_EXPR + " AS qsubstr FROM pending\
+             ORDER BY id").fetchall())
+
+
+    def submit_pending(self):
+        """Submit held jobs, as the submission limits allow.
+
+        Held jobs are submitted in the order they were held, and added to the
+        database. Held continuations are recorded as the 'continuation_jobid'
+        of the job they continue. Jobs that would still exceed a limit remain
+        held.
+
+        Returns:
+            List(str): IDs of the submitted jobs
+        """
+        submitted = []
+        for r in self.select_pending():     #pylint: disable=invalid-name
+            if not governor.has_capacity(r["queue"], r["account"]):
+                continue
+
+            # claim the held job, so that it is only submitted once
+            claimed = self._retry(lambda curs, r=r: curs.execute(
+                "DELETE FROM pending WHERE id=?", (r["id"],)).rowcount)
+            if claimed != 1:
+                continue
+
+            try:
+                new_jobid = config.software().submit(substr=r["qsubstr"], rundir=r["rundir"])
+            except Exception:
+                self._retry(lambda curs, r=r: self._hold(
+                    curs, dict(r), r["queue"], r["account"], r["continues"]))
+                raise
+            governor.record(r["queue"], r["account"])
+            status_cache.invalidate()
+            submitted.append(new_jobid)
+
+            status = job_status_dict(jobid=new_jobid, jobname=r["jobname"], rundir=r["rundir"],
+                                     jobstatus="?", auto=r["auto"], qsubstr=r["qsubstr"],
+                                     nodes=r["nodes"], procs=r["procs"], walltime=r["walltime"],
+                                     prequeue=r["prequeue"])
+
+            def _apply(curs, r=r, status=status):
+                """Add the new job, and record it as the continuation of the held job"""
+                if r["continues"] is not None:
+                    curs.execute("UPDATE jobs SET modifytime=?, continuation_jobid=? WHERE jobid=?",
+                                 (int(time.time()), status["jobid"], r["continues"]))
+                self._insert(curs, status)
+            self._retry(_apply)
+        return submitted
+
+
+    def next_expected_end(self):
+        """Return the time the first running job is expected to end.
+
+        A running job is expected to end at its 'starttime' plus its
+        'walltime'.
+
+        Returns:
+            float: Seconds since the epoch, or None if no running jobs have a
+                known 'starttime' and 'walltime'.
+        """
+        return self._retry(lambda curs: curs.execute(
+            "SELECT MIN(starttime + walltime) FROM jobs WHERE jobstatus='R'\
+             AND starttime IS NOT NULL AND walltime IS NOT NULL").fetchone())[0]
+
+
+    def prequeue_job(self, jobid=None, job=None):
+        """Submit the continuation of a running job, to start after it ends.
+
+        The continuation is submitted with an "afterany" dependency on the
+        job, and recorded as its 'continuation_jobid' immediately. If the job
+        is then marked 'Complete', the continuation is cancelled. Otherwise,
+        once the job ends, the continuation starts without waiting for
+        continue_all, and the job is marked 'Continued'.
+
+        Args:
+            jobid: jobid of the job to pre-queue a continuation of
+            job: (sqlite3.Row) If this is given, jobid is not necessary and is ignored if given
+
+        Raises:
+            EligibilityError if the job is not an 'auto' job that is running
+                and 'Incomplete', without a continuation
+        """
+        if job is None:
+            job = self.select_job(jobid)
+
+        if job["auto"] != 1 or job["taskstatus"] != "Incomplete" or job["jobstatus"] == "C" \
+                or (job["continuation_jobid"] not in (None, "-")
+                    and not job["continuation_jobid"].startswith("claim:")) \
+                or _claimed(job["continuation_jobid"]):
+            raise EligibilityError(job["jobid"], "Job not eligible to pre-queue a continuation.")
+
+        self._continue([job], prequeue=True)
+
+
+    def continue_all(self, nthreads=8):
+        """Resubmit all jobs eligible to continue
+
+        The eligible records are read before any are submitted. Jobs are
+        submitted concurrently, and all continuations are recorded in one
+        transaction.
+
+        Continuations of running 'auto' jobs with 'prequeue' set are also
+        pre-queued (see prequeue_job).
+
+        Args:
+            nthreads (int, optional, default=8): Maximum number of concurrent
+                submissions
+        """
+        jobs = self._retry(lambda curs: curs.execute(
+            "SELECT " + select_columns_str() + " FROM jobs WHERE auto=1 AND\
+             taskstatus='Incomplete' AND jobstatus='C'").fetchall())
+        if len(jobs):
+            self._continue(jobs, nthreads)
+
+        jobs = self._retry(lambda curs: curs.execute(
+            "SELECT " + select_columns_str() + " FROM jobs WHERE auto=1 AND\
+             taskstatus='Incomplete' AND jobstatus='R' AND prequeue=1 AND\
+             (continuation_jobid='-' OR continuation_jobid LIKE 'claim:%')").fetchall())
+        if len(jobs):
+            self._continue(jobs, nthreads, prequeue=True)
 
 
     def eligible_to_abort(self, job):   #pylint: disable=no-self-use
@@ -658,9 +1934,43 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                 + job["jobstatus"] + " and taskstatus = " + job["taskstatus"])
 
 
+    def _cancel_prequeued(self, job):
+        """Cancel and delete a pre-queued continuation of a job, if it has one
+
+        A job has a pre-queued continuation (see JobDB.prequeue_job) if its
+        taskstatus is still 'Incomplete' but it has a 'continuation_jobid'.
+        Because the continuation starts when the job ends for any reason
+        ("afterany"), it must be cancelled whenever the job is not to be
+        continued.
+
+        Args:
+            job (sqlite3.Row): Job record from database
+
+        A job being continued by another process has a "claim:..."
+        'continuation_jobid', not the ID of a job, so nothing is cancelled:
+        '-' is returned, and the other process cancels its new job when it
+        finds the claim is gone.
+
+        Returns:
+            str: The 'continuation_jobid' to store for the job: '-' if a
+                continuation was cancelled or claimed, else unchanged
+        """
+        if job["taskstatus"] != "Incomplete" or job["continuation_jobid"] in (None, "-"):
+            return job["continuation_jobid"]
+        if job["continuation_jobid"].startswith("claim:"):
+            return "-"
+        try:
+            self.delete_job(jobid=job["continuation_jobid"])
+        except JobDBError:
+            config.software().delete(job["continuation_jobid"])
+        return "-"
+
+
     def abort_job(self, jobid=None, job=None):
         """ Delete a job and mark job taskstatus as Aborted
 
+        A pre-queued continuation of the job is cancelled and deleted.
+
         Args:
             jobid: jobid of the job to continue
             job: (sqlite3.Row) If this is given, jobid is not necessary and is ignored if given
@@ -677,9 +1987,11 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
             raise EligibilityError(id, msg)
 
         config.software().delete(job["jobid"])
-        self.curs.execute("UPDATE jobs SET taskstatus='Aborted', modifytime=?\
-                           WHERE jobid=?", (int(time.time()), job["jobid"]))
-        self.conn.commit()
+        continuation_jobid = self._cancel_prequeued(job)
+        self._retry(lambda curs: curs.execute(
+            "UPDATE jobs SET taskstatus='Aborted', modifytime=?, continuation_jobid=?\
+             WHERE jobid=?",
+            (int(time.time()), continuation_jobid, job["jobid"])))
 
 
     def eligible_to_delete(self, job):  #pylint: disable=no-self-use
@@ -700,6 +2012,8 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
     def delete_job(self, jobid=None, job=None, series=False):
         """ Delete job if running, and delete job from the database.
 
+        A pre-queued continuation of the job is also cancelled and deleted.
+
         Args:
             jobid (str): jobid of the job to continue
             job (sqlite3.Row): If this is given, jobid is not necessary and is ignored if given
@@ -712,11 +2026,21 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
             jobseries = self.select_series_id(job["jobid"])
         else:
             jobseries = [job["jobid"]]
+            self._cancel_prequeued(job)
 
         for j in jobseries:
             config.software().delete(j)
-            self.curs.execute("DELETE from jobs WHERE jobid=?", (j, ))
-        self.conn.commit()
+
+        def _apply(curs):
+            """Delete the records, and any submit scripts no longer referenced"""
+            curs.executemany("DELETE from jobs WHERE jobid=?", [(j, ) for j in jobseries])
+            curs.executemany("DELETE from edges WHERE child=? OR parent=?",
+                             [(j, j) for j in jobseries])
+            curs.execute("DELETE FROM scripts WHERE NOT EXISTS\
+                          (SELECT 1 FROM jobs WHERE jobs.qsubhash=scripts.hash)\
+                          AND NOT EXISTS\
+                          (SELECT 1 FROM pending WHERE pending.qsubhash=scripts.hash)")
+        self._retry(_apply)
 
 
     def eligible_to_error(self, job):   #pylint: disable=no-self-use
@@ -737,7 +2061,8 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
     def error_job(self, message, jobid=None, job=None):
         """ Mark job taskstatus as 'Error: message'
 
-        Any job can be marked as error.
+        Any job can be marked as error. A pre-queued continuation of the job
+        is cancelled and deleted.
 
         Args:
             jobid: jobid of the job to mark as error
@@ -747,9 +2072,10 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         message = "Error: " + message
         if job is None:
             job = self.select_job(jobid)
-        self.curs.execute("UPDATE jobs SET taskstatus=?, modifytime=? WHERE\
-                           jobid=?", (message, int(time.time()), job["jobid"]))
-        self.conn.commit()
+        continuation_jobid = self._cancel_prequeued(job)
+        self._retry(lambda curs: curs.execute(
+            "UPDATE jobs SET taskstatus=?, modifytime=?, continuation_jobid=? WHERE jobid=?",
+            (message, int(time.time()), continuation_jobid, job["jobid"])))
 
 
     def eligible_to_reset(self, job):   #pylint: disable=no-self-use
@@ -793,9 +2119,9 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         if not eligible:
             raise EligibilityError(id, msg)
 
-        self.curs.execute("UPDATE jobs SET taskstatus=?, modifytime=? WHERE jobid=?",
-                          ("Incomplete", int(time.time()), job["jobid"]))
-        self.conn.commit()
+        self._retry(lambda curs: curs.execute(
+            "UPDATE jobs SET taskstatus=?, modifytime=? WHERE jobid=?",
+            ("Incomplete", int(time.time()), job["jobid"])))
 
 
     def eligible_to_complete(self, job):    #pylint: disable=no-self-use
@@ -819,6 +2145,8 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
 
     def complete_job(self, jobid=None, job=None):
         """Mark job taskstatus as 'Complete'
+
+        A pre-queued continuation of the job is cancelled and deleted.
         
         Args:
             jobid (str): ID of job
@@ -835,9 +2163,11 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         if not eligible:
             raise EligibilityError(id, msg)
 
-        self.curs.execute("UPDATE jobs SET taskstatus='Complete', modifytime=?, elapsedtime=?\
-                           WHERE jobid=?", (int(time.time()), None, job["jobid"]))
-        self.conn.commit()
+        self._cancel_prequeued(job)
+        self._retry(lambda curs: curs.execute(
+            "UPDATE jobs SET taskstatus='Complete', modifytime=?, elapsedtime=?,\
+             continuation_jobid='-' WHERE jobid=?",
+            (int(time.time()), None, job["jobid"])))
 
 
 
@@ -860,7 +2190,12 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                 "auto", and "continuation_jobid"
         """
 
-        d = dict(r) #pylint: disable=invalid-name
+        keys = r.keys()
+        d = dict((k, r[k]) for k in SUMMARY_COLUMNS if k in keys) #pylint: disable=invalid-name
+
+        # elapsedtime is not refreshed by update() while a job is running
+        if d["jobstatus"] == "R" and d.get("starttime") is not None:
+            d["elapsedtime"] = int(time.time()) - int(d["starttime"])
 
         for k in ["walltime", "elapsedtime"]:
             if d[k] is None:
@@ -881,7 +2216,7 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
             r (dict): a dict-like object
         """
         print("#Record:")
-        for key in r:
+        for key in r.keys():
             if isinstance(r[key], string_types):
                 s = "\"" + r[key] + "\""    #pylint: disable=invalid-name
                 if re.search("\n", s):
@@ -955,6 +2290,29 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                     self._print_record(r)
 
 
+    def print_records(self, records, full=False, series=False):
+        """Print records, as selected by JobDB.select()
+
+        Args:
+            records: An iterable of records
+            full (bool): If True, print as key:val pair list, If (default) False,
+                print single row summary in 'qstat' style.
+            series (bool): If True, records are grouped by the column 
+                "series_id", as from JobDB.select(series=True), and a blank 
+                line is printed after each series.
+        """
+        print_record = self._print_full_record if full else self._print_record
+        series_id = None
+        for r in records:   #pylint: disable=invalid-name
+            if series and series_id is not None and r["series_id"] != series_id:
+                print("")
+            if series:
+                series_id = r["series_id"]
+            print_record(r)
+        if series_id is not None:
+            print("")
+
+
     def print_untracked(self, full=False):
         """Print untracked jobs.
 
@@ -989,10 +2347,11 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                 series. If (default) False, print in order found.
         """
         print("Tracked:")
-        self.curs.execute("SELECT * FROM jobs")
         if not full:
             self.print_header()
-        self.print_selected(full=full, series=series)
+        self.print_records(
+            self.select(series=series, columns=None if full else SUMMARY_COLUMNS, lazy=full),
+            full=full, series=series)
 
 
     def print_active(self, full=False, series=False):
@@ -1007,11 +2366,12 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                 series. If (default) False, print in order found.
         """
         print("Tracked:")
-        self.curs.execute("SELECT * FROM jobs WHERE taskstatus!='Complete'\
-                           AND taskstatus!='Aborted' AND taskstatus!='Continued'")
         if not full:
             self.print_header()
-        self.print_selected(full=full, series=series)
+        self.print_records(
+            self.select(active=True, series=series, columns=None if full else SUMMARY_COLUMNS,
+                        lazy=full),
+            full=full, series=series)
 
 # end class JobDB
 
@@ -1031,15 +2391,15 @@ def complete_job(jobid=None, dbpath=None,):
     Raises:
         JobsError: If job ID could not be determined
     """
-    db = JobDB(dbpath)  #pylint: disable=invalid-name
+    db = JobDB(dbpath, check_schema=False)  #pylint: disable=invalid-name
 
     if jobid is None:
         jobid = config.software().job_id()
         if jobid is None:
             raise prisms_jobs.JobsError(0, "Could not determine jobid")
 
-    job = db.select_job(jobid)  #pylint: disable=unused-variable
-    db.complete_job(jobid)
+    job = db.select_job(jobid)
+    db.complete_job(job=job)
     db.close()
 
 
@@ -1060,7 +2420,7 @@ def error_job(message, jobid=None, dbpath=None):
     Raises:
         JobsError: If job ID could not be determined
     """
-    db = JobDB(dbpath)  #pylint: disable=invalid-name
+    db = JobDB(dbpath, check_schema=False)  #pylint: disable=invalid-name
     if jobid is None:
         jobid = config.software().job_id()
         if jobid is None:
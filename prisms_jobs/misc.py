@@ -29,7 +29,7 @@ def _decode(val, encoding=None):
         print("sys.stdout.encoding:", sys.stdout.encoding)
         raise e
         
-def run(cmd, input=None, stdin=None, encoding=None):
+def run(cmd, input=None, stdin=None, encoding=None, cwd=None):
     """Run subprocess and return stdout, stderr as text, returncode as int
     
     Args:
@@ -38,13 +38,22 @@ def run(cmd, input=None, stdin=None, encoding=None):
         stdin (stream): Use subprocess.PIPE to pass data via stdin
         encoding (str, optional): Encoding to use to decode stdout, stderr. By
             default, uses sys.stdout.encoding if available, else 'utf-8'.
+        cwd (str, optional): Directory to run the subprocess in, rather than 
+            the current working directory. Unlike os.chdir, this does not 
+            affect other threads.
     
     Returns:
         (stdout, stderr, returncode): With stdout and stderr as strings, and 
             returncode as int
     """
     try:
-        p = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        env = None
+        if cwd is not None:
+            # some commands (qsub) use $PWD as the working directory
+            env = dict(os.environ)
+            env['PWD'] = cwd
+        p = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             cwd=cwd, env=env)
         encoding = _set_encoding(encoding)
         if input is not None:
             input = bytearray(input, encoding=encoding)
@@ -56,9 +65,39 @@ def run(cmd, input=None, stdin=None, encoding=None):
         print("input:", input)
         print("stdin:", stdin)
         print("encoding:", encoding)
+        print("cwd:", cwd)
         print("sys.stdout.encoding:", sys.stdout.encoding)
         raise e
 
+def run_stream(cmd, encoding=None):
+    """Run subprocess and yield its stdout, as decoded lines, as they are written
+
+    Unlike run, the output is never held in memory all at once. As with run,
+    stderr is merged into stdout. The subprocess is waited for once the output
+    is consumed, or the generator is closed.
+
+    Args:
+        cmd (List[str]): Command to run as subprocess
+        encoding (str, optional): Encoding to use to decode stdout. By default,
+            uses sys.stdout.encoding if available, else 'utf-8'.
+
+    Yields:
+        str: Lines of stdout, including the trailing newline
+    """
+    encoding = _set_encoding(encoding)
+    try:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except Exception as e:
+        print("Exception in prisms_jobs.misc.run_stream:", e)
+        print("cmd:", cmd)
+        raise e
+    try:
+        for line in iter(p.stdout.readline, b''):
+            yield _decode(line, encoding)
+    finally:
+        p.stdout.close()
+        p.wait()
+
 def getlogin():
     """Returns os.getlogin(), else os.environ["LOGNAME"], else "?" """
     try:
@@ -0,0 +1,299 @@
+"""Run many small tasks inside a few job allocations
+
+Submitting each short calculation as its own Job wastes scheduler capacity and
+queue time. Instead, tasks (shell commands) are added to a named task pool, in
+the 'tasks' table of the jobs database, and a few worker jobs are submitted.
+Each worker job runs ``pworker``, which claims tasks from the pool and runs
+them, up to ``nodes*ppn`` at once, until the pool is empty. Claims and task
+results are written to the jobs database in batches, so thousands of tasks
+need only a few transactions per worker.
+
+Each task is run with ``sh`` in its rundir, with stdout and stderr written to
+``<rundir>/<pool>.task<id>.out``. A task with exit code 0 is marked 'Complete',
+otherwise 'Error'. Tasks claimed by a worker that is killed before they finish
+are returned to the pool by ``taskmaster`` (JobDB.requeue_tasks).
+
+Example:
+
+    .. code-block:: python
+
+        pool = prisms_jobs.packing.TaskPool("relax")
+        pool.add(["casm-calc --run " + str(i) for i in range(2000)])
+        pool.submit(njobs=4, nodes=1, ppn=16, walltime="4:00:00")
+
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+### External ###
+import os
+import signal
+import subprocess
+import time
+
+from six.moves import shlex_quote
+
+### Local ###
+from prisms_jobs import config, jobdb
+from prisms_jobs.job import Job
+
+class TaskPool(object):
+    """A named pool of tasks, run by worker jobs
+
+    Args:
+        name (str): Name of the task pool
+        dbpath (str, optional): Specify a non-default JobDB database
+
+    Attributes:
+        name (str): Name of the task pool
+        dbpath (str): JobDB database holding the tasks, or None for the default
+
+    """
+
+    def __init__(self, name, dbpath=None):
+        self.name = name
+        self.dbpath = dbpath
+
+    def _db(self):
+        """Return a connection to the jobs database"""
+        return jobdb.JobDB(dbpath=self.dbpath)
+
+    def add(self, commands, rundir=None):
+        """Add tasks to the pool, in one transaction
+
+        Args:
+            commands (List(str)): Shell command of each task
+            rundir (str or List(str), optional): Directory to run all the
+                tasks in, or each task in. Default is the current working
+                directory.
+
+        Returns:
+            List(int): IDs of the tasks added
+        """
+        db = self._db()  #pylint: disable=invalid-name
+        try:
+            return db.add_tasks(self.name, commands, rundir)
+        finally:
+            db.close()
+
+    def job(self, name=None, nodes=1, ppn=1, launcher=None, **kwargs):
+        """Return a worker Job for this pool
+
+        Args:
+            name (str, optional): Job name. Default is the pool name.
+            nodes (int, optional, default=1): Number of nodes
+            ppn (int, optional, default=1): Processors per node. The worker
+                runs up to ``nodes*ppn`` tasks at once.
+            launcher (str, optional): Command prefix used to launch each task,
+                so that tasks are placed on all the nodes of the allocation.
+                Default is ``"srun --nodes=1 --ntasks=1 --exclusive"`` for
+                Slurm jobs with more than one node, and otherwise none (all
+                tasks run on the first node).
+            **kwargs: Other Job arguments (account, walltime, pmem, queue, ...)
+
+        Returns:
+            prisms_jobs.Job: A non-auto Job running ``pworker``
+        """
+        if launcher is None and int(nodes) > 1 and config.software().NAME == "slurm":
+            launcher = "srun --nodes=1 --ntasks=1 --exclusive"
+        command = "pworker {0} --nprocs {1}".format(shlex_quote(self.name), int(nodes)*int(ppn))
+        if self.dbpath is not None:
+            command += " --dbpath {0}".format(shlex_quote(os.path.abspath(self.dbpath)))
+        if launcher:
+            command += " --launcher {0}".format(shlex_quote(launcher))
+        return Job(name=name or self.name, nodes=nodes, ppn=ppn, command=command, auto=False,
+                   **kwargs)
+
+    def submit(self, njobs=1, rundir=None, **kwargs):
+        """Submit worker jobs for this pool
+
+        Args:
+            njobs (int, optional, default=1): Number of worker jobs
+            rundir (str, optional): Directory to submit the worker jobs from.
+                Default is the current working directory.
+            **kwargs: Arguments for TaskPool.job
+
+        Returns:
+            List(prisms_jobs.Job): The worker jobs submitted
+        """
+        jobs = [self.job(**kwargs) for _ in range(njobs)]
+        for job in jobs:
+            job.submit(dbpath=self.dbpath, rundir=rundir)
+        return jobs
+
+    def progress(self):
+        """Return the number of tasks with each status
+
+        Returns:
+            dict: With keys 'tasks', 'pending', 'running', 'complete', and
+                'error'. All 0 if the pool has no tasks.
+        """
+        db = self._db()  #pylint: disable=invalid-name
+        try:
+            rows = db.task_progress(self.name)
+        finally:
+            db.close()
+        keys = ["tasks", "pending", "running", "complete", "error"]
+        if not len(rows):
+            return dict((key, 0) for key in keys)
+        return dict((key, rows[0][key]) for key in keys)
+
+
+def _worker_jobid():
+    """Return the ID of the job running the worker, or "local" if not run in a job"""
+    try:
+        return config.software().job_id() or "local"
+    except Exception:   #pylint: disable=broad-except
+        # the 'default' interface raises if no job management software is found
+        return "local"
+
+
+def _start_task(pool, task, launcher=None):
+    """Start a task in its own process group, and return (Popen, outfile)
+
+    Returns (None, None) if the task could not be started.
+    """
+    command = task["command"]
+    if launcher:
+        command = launcher + " sh -c " + shlex_quote(command)
+    outpath = os.path.join(task["rundir"], "{0}.task{1}.out".format(pool, task["id"]))
+    outfile = None
+    try:
+        outfile = open(outpath, 'w')
+        proc = subprocess.Popen(command, shell=True, cwd=task["rundir"], stdout=outfile,
+                                stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+    except Exception:   #pylint: disable=broad-except
+        if outfile is not None:
+            outfile.close()
+        return (None, None)
+    return (proc, outfile)
+
+
+def _terminate(procs, grace=10.0):
+    """Send SIGTERM to the process groups of running tasks, then SIGKILL after 'grace' seconds
+
+    Returns after all the processes have exited.
+
+    Args:
+        procs (List(subprocess.Popen)): Processes of running tasks
+    """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        for proc in procs:
+            if proc.poll() is None:
+                try:
+                    os.killpg(proc.pid, sig)
+                except OSError:
+                    pass
+        end = time.time() + grace
+        while time.time() < end and any(proc.poll() is None for proc in procs):
+            time.sleep(0.05)
+    for proc in procs:
+        proc.wait()
+
+
+def run_worker(pool, nprocs, dbpath=None, batch_size=None, flush_interval=30.0, launcher=None): #pylint: disable=too-many-arguments, too-many-locals, too-many-branches, too-many-statements
+    """Run tasks from a task pool until it is empty
+
+    Tasks are claimed 'batch_size' at a time, when the worker has no claimed
+    tasks left to start, and the results of finished tasks are recorded in the
+    same transaction. Results are also recorded at least every
+    'flush_interval' seconds while tasks run. On SIGTERM, the tasks still
+    running are terminated (SIGTERM, then SIGKILL after 10 s) and waited for,
+    results are recorded, and then the tasks not finished are returned to the
+    pool, and the worker stops.
+
+    A worker may also be run outside of a job, for example without job
+    management software. Its tasks are then claimed by jobid "local", and
+    are not returned to the pool by ``taskmaster`` if the worker is killed.
+
+    Args:
+        pool (str): Name of the task pool
+        nprocs (int): Maximum number of tasks run at once
+        dbpath (str, optional): Specify a non-default JobDB database
+        batch_size (int, optional): Number of tasks claimed at a time. Default
+            is 'nprocs'.
+        flush_interval (float, optional, default=30.0): Maximum seconds between
+            recording results
+        launcher (str, optional): Command prefix used to launch each task
+
+    Returns:
+        dict: Number of tasks run by this worker, with keys 'complete' and
+            'error'
+    """
+    jobid = _worker_jobid()
+    batch_size = max(batch_size or nprocs, 1)
+
+    stop = []
+    def _sigterm(signum, frame):    #pylint: disable=unused-argument
+        """Stop claiming and running tasks"""
+        stop.append(signum)
+    signal.signal(signal.SIGTERM, _sigterm)
+
+    db = jobdb.JobDB(dbpath, check_schema=False)  #pylint: disable=invalid-name
+    backlog = []
+    running = dict()    # {id: (Popen, outfile)}
+    results = []
+    exhausted = False
+    last_flush = time.time()
+    count = {'complete': 0, 'error': 0}
+
+    def _collect():
+        """Move finished tasks from 'running' to 'results'"""
+        for taskid, (proc, outfile) in list(running.items()):
+            returncode = proc.poll()
+            if returncode is None:
+                continue
+            outfile.close()
+            del running[taskid]
+            results.append((taskid, returncode, int(time.time())))
+            count['complete' if returncode == 0 else 'error'] += 1
+
+    try:
+        while True:
+            _collect()
+
+            if len(stop):
+                _terminate([proc for proc, _ in running.values()])
+                killed = list(running.keys())
+                for _, outfile in running.values():
+                    outfile.close()
+                running.clear()
+                db.release_tasks(killed + [task["id"] for task in backlog], results)
+                break
+
+            # claim more tasks, recording results in the same transaction
+            if not exhausted and not len(backlog) and len(running) < nprocs:
+                nclaim = max(batch_size, nprocs - len(running))
+                backlog = [dict(task) for task in db.claim_tasks(pool, nclaim, jobid, results)]
+                exhausted = len(backlog) < nclaim
+                results = []
+                last_flush = time.time()
+            elif len(results) and (time.time() - last_flush >= flush_interval
+                                   or (exhausted and not len(running))):
+                db.claim_tasks(pool, 0, jobid, results)
+                results = []
+                last_flush = time.time()
+
+            if exhausted and not len(backlog) and not len(running) and not len(results):
+                break
+
+            # start tasks
+            started = False
+            while len(backlog) and len(running) < nprocs:
+                task = backlog.pop(0)
+                proc, outfile = _start_task(pool, task, launcher)
+                if proc is None:
+                    results.append((task["id"], None, int(time.time())))
+                    count['error'] += 1
+                    continue
+                running[task["id"]] = (proc, outfile)
+                started = True
+
+            if not started:
+                time.sleep(0.01)
+    finally:
+        if len(running):
+            _terminate([proc for proc, _ in running.values()])
+        db.close()
+
+    return count
@@ -21,7 +21,9 @@ selected by listing jobids or using --all, --range, or
 --recent, optionally combined with --active. Running 'pstat'
 with no selection is equivalent to selecting '--all --active'.
 The default display style is a summary list. Other options are
---full or --series.
+--full or --series. Use --workflow to print the progress of
+workflows submitted with ``prisms_jobs.Workflow``, or --tasks
+for task pools run by 'pworker'.
 
 Using one of --complete, --continue, --error, --abort, or
 --delete modifies status instead of printing. User
@@ -70,6 +72,10 @@ def make_parser():
                        help='List all fields instead of summary')
     style.add_argument('-s', '--series', default=False, action='store_true',
                        help='List all fields grouped by continuation jobs')
+    style.add_argument('-w', '--workflow', metavar='NAME', type=str, nargs='?', const='',
+                       help='Print the progress of workflows, or of workflow \'NAME\' and its jobs')
+    style.add_argument('-t', '--tasks', metavar='POOL', type=str, nargs='?', const='',
+                       help='Print the progress of task pools, or of task pool \'POOL\'')
 
     group = parser.add_mutually_exclusive_group()
     select = parser.add_mutually_exclusive_group()
@@ -101,6 +107,8 @@ def make_parser():
     group.add_argument('--key', type=str, nargs=1,
                        help='Output data corresponding to \'key\' for selected jobs.')
 
+    parser.add_argument('--refresh', '--no-cache', dest='refresh', default=False, action='store_true',
+                        help='Query the job management software, even if the cached job status is fresh')
     parser.add_argument('--force', default=False, action='store_true',
                         help='Modify jobs without user confirmation')
     
@@ -111,33 +119,44 @@ def main(): #pylint: disable=missing-docstring, too-many-statements
 
     # functions
 
-    def select_job(args):   #pylint: disable=redefined-outer-name
-        """ Select which jobs to operate on """
+    def select_job(args, series=False, columns=None, lazy=False):   #pylint: disable=redefined-outer-name
+        """ Select which jobs to operate on
+
+            Returns an iterator over the selected records. If 'series', records
+            are grouped by series and include the column 'series_id'. See
+            JobDB.select for 'columns' and 'lazy'.
+        """
+        criteria = dict()
         if args.all:
-            job = db.select_all_id()
+            pass
         elif args.range:
-            job = db.select_range_id(args.range[0], args.range[1])
+            criteria["jobrange"] = args.range
         elif args.recent:
-            job = db.select_recent_id(args.recent[0])
+            criteria["recent"] = args.recent[0]
         elif args.regex:
-            job = db.select_regex_id(args.regex[0], args.regex[1])
+            criteria["regex"] = args.regex
         elif args.job != []:
-            job = args.job
+            criteria["jobid"] = args.job
         else:
             args.active = True
-            job = db.select_all_id()
 
-        if args.active:
-            if job == []:
-                return job
-            active = db.select_all_active_id()
-            active_job = []
-            for j in job:
-                if j in active:
-                    active_job.append(j)
-            return active_job
-        else:
-            return job
+        selected = db.select(active=args.active, series=series, columns=columns, lazy=lazy,
+                             **criteria)
+        if args.job != [] and not args.active:
+            return report_missing(selected, args.job)
+        return selected
+
+
+    def report_missing(selected, jobid):
+        """ Yield selected records, then report any jobid that was not found """
+        found = set()
+        for r in selected:  #pylint: disable=invalid-name
+            found.add(r["jobid"])
+            yield r
+        for j in jobid:
+            if j not in found:
+                print("Error in prisms_jobs.JobDB.select_job(). jobid: '"
+                      + j + "' not found in jobs database.")
 
 
     def operate(args, check_eligibility, operation, summary_msg, prompt_msg, action_msg):   #pylint: disable=redefined-outer-name, too-many-arguments
@@ -162,21 +181,14 @@ def main(): #pylint: disable=missing-docstring, too-many-statements
         """
 
 
-        # select jobs
-        selection_id = select_job(args)
-
-        # filter to find eligible jobs
+        # select jobs, and filter to find eligible jobs
         job = []
-        for j in selection_id:
-            try:
-                selected_job = db.select_job(j)
-                eligible, id, msg = check_eligibility(selected_job) #pylint: disable=redefined-builtin, invalid-name
-                if eligible:
-                    job.append(selected_job)
-                else:
-                    print(id + ":", msg)
-            except prisms_jobs.JobDBError as e: #pylint: disable=invalid-name
-                print(e)
+        for selected_job in select_job(args, lazy=True):
+            eligible, id, msg = check_eligibility(selected_job) #pylint: disable=redefined-builtin, invalid-name
+            if eligible:
+                job.append(selected_job)
+            else:
+                print(id + ":", msg)
 
 
         # print jobs to operate on:
@@ -205,41 +217,31 @@ def main(): #pylint: disable=missing-docstring, too-many-statements
     def print_data(args):
         """ Print job data """
         # user defined selection (don't show untracked)
-        jobid = select_job(args)
-        if jobid != []:
-
-            # remove potential duplicates for series
-            if args.series:
-                seriesid = []
-                for j in jobid:
-                    series = db.select_series_id(j)
-                    if not series[-1] in seriesid:
-                        seriesid.append(series[-1])
-                jobid = seriesid
-
-            # print rundir
-            if args.series:
-                for j in jobid:
-                    series = db.select_series_id(j)
-                    for s in series: #pylint: disable=invalid-name
-                        try:
-                            job = db.select_job(s)
-                            print(s, job[args.key[0]])
-                        except prisms_jobs.JobDBError as e: #pylint: disable=invalid-name
-                            print(e)
-                    print("")
-            else:
-                for j in jobid:
-                    try:
-                        job = db.select_job(j)
-                        print(j, job[args.key[0]])
-                    except prisms_jobs.JobDBError as e: #pylint: disable=invalid-name
-                        print(e)
+        series_id = None
+        for r in select_job(args, series=args.series, columns=args.key):  #pylint: disable=invalid-name
+            if args.series and series_id is not None and r["series_id"] != series_id:
+                print("")
+            series_id = r["series_id"] if args.series else None
+            print(r["jobid"], r[args.key[0]])
+        if series_id is not None:
+            print("")
 
 
     def print_jobs(args):
         """ Print jobs """
-        if args.all and not args.active:
+        if args.workflow is not None:
+            # 'pstat --workflow [NAME]' case
+            #    show workflow progress, and the jobs of workflow 'NAME'
+            db.print_workflows(args.workflow or None)
+            if args.workflow:
+                print('\n')
+                db.print_header()
+                db.print_records(db.select(jobid=db.select_workflow(args.workflow),
+                                           columns=prisms_jobs.jobdb.SUMMARY_COLUMNS))
+        elif args.tasks is not None:
+            # 'pstat --tasks [POOL]' case
+            db.print_tasks(args.tasks or None)
+        elif args.all and not args.active:
             # 'pstat --all' case
             #    show all and untracked
             db.print_all(full=args.full, series=args.series)
@@ -254,23 +256,12 @@ def main(): #pylint: disable=missing-docstring, too-many-statements
             db.print_untracked(full=args.full)
         else:
             # user defined selection (don't show untracked)
-            jobid = select_job(args)
-            if jobid != []:
-                if args.series:
-                    seriesid = []
-                    for j in jobid:
-                        series = db.select_series_id(j)
-                        if not series[-1] in seriesid:
-                            seriesid.append(series[-1])
-                    jobid = seriesid
-
-                if not args.full:
-                    db.print_header()
-                for j in jobid:
-                    try:
-                        db.print_job(jobid=j, full=args.full, series=args.series)
-                    except prisms_jobs.JobDBError as e: #pylint: disable=invalid-name
-                        print(e)
+            if not args.full:
+                db.print_header()
+            columns = None if args.full else prisms_jobs.jobdb.SUMMARY_COLUMNS
+            db.print_records(select_job(args, series=args.series, columns=columns,
+                                        lazy=args.full),
+                             full=args.full, series=args.series)
 
     parser = make_parser()
 
@@ -280,7 +271,7 @@ def main(): #pylint: disable=missing-docstring, too-many-statements
 
     # open the Job database
     db = prisms_jobs.JobDB()    #pylint: disable=invalid-name
-    db.update()
+    db.update(refresh=args.refresh)
 
 
     # perform an operation, or print jobs
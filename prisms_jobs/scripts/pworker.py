@@ -0,0 +1,45 @@
+"""Run tasks from a prisms_jobs task pool"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import argparse
+import multiprocessing
+
+from prisms_jobs import packing
+
+DESC = \
+"""
+Run tasks from a `prisms-jobs` task pool.
+
+'pworker' claims tasks from the task pool POOL, in the jobs database, and runs
+them, up to --nprocs at once, until no tasks are left. It is usually the
+command of a worker job submitted by ``prisms_jobs.packing.TaskPool.submit``.
+Task results are recorded in the jobs database in batches. Tasks left
+unfinished when the worker receives SIGTERM are returned to the pool.
+"""
+
+def make_parser():
+    parser = argparse.ArgumentParser(description=DESC,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('pool', metavar='POOL', type=str, help='Name of the task pool')
+    parser.add_argument('-n', '--nprocs', type=int, default=multiprocessing.cpu_count(),
+                        help='Maximum number of tasks to run at once. Default is the number of CPUs.')
+    parser.add_argument('--batch', type=int, default=None,
+                        help='Number of tasks to claim at a time. Default is --nprocs.')
+    parser.add_argument('--interval', type=float, default=30.0,
+                        help='Maximum seconds between recording task results. Default is 30.')
+    parser.add_argument('--launcher', type=str, default=None,
+                        help='Command prefix used to launch each task. Ex: "srun --nodes=1 --ntasks=1 --exclusive"')
+    parser.add_argument('--dbpath', type=str, default=None,
+                        help='Path to a non-default jobs database')
+    return parser
+
+def main():
+    args = make_parser().parse_args()
+    count = packing.run_worker(args.pool, args.nprocs, dbpath=args.dbpath,
+                               batch_size=args.batch, flush_interval=args.interval,
+                               launcher=args.launcher)
+    print("Tasks complete:", count['complete'], "  Tasks with errors:", count['error'])
+
+if __name__ == "__main__":
+    main()
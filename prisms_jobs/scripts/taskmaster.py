@@ -3,22 +3,29 @@ from __future__ import (absolute_import, division, print_function, unicode_liter
 from builtins import *
 
 import argparse
+import fcntl
+import os
+import signal
+import socket
 import sys
 import subprocess
+import time
+import traceback
 from six import iteritems
 
 import prisms_jobs
-from prisms_jobs import config
+from prisms_jobs import config, status_cache
 software = config.software()
 
 def check_for_other():
-    jobid = software.job_id(name="taskmaster")
-    if not len(jobid):
-        return
-    tmaster_status = software.job_status(jobid)
-    for j in jobid:
-        if j != software.job_id() and tmaster_status[j]["jobstatus"] != "C":
-            print("A taskmaster is already running. JobID:", j, "  Status:",  tmaster_status[j]["jobstatus"]) 
+    # one (possibly cached) snapshot of job status, also used by JobDB.update();
+    # taskmaster jobs are found in the same snapshot, in case the cache expires
+    status = status_cache.snapshot()[1]
+    for j, jobstatus in iteritems(status):
+        if jobstatus.get("jobname") != "taskmaster":
+            continue
+        if j != software.job_id() and jobstatus["jobstatus"] != "C":
+            print("A taskmaster is already running. JobID:", j, "  Status:",  jobstatus["jobstatus"]) 
             sys.exit()
 
 DESC = \
@@ -26,19 +33,34 @@ DESC = \
 Automatically resubmit jobs.
 
 'taskmaster' submits itself with instructions to be run after an amount of time
-specified by --delay (default=15:00). When it runs, it continues all auto
+specified by --delay (default=15:00). When it runs, it submits jobs held back
+by the 'submit_limits' setting, as the limits allow, continues all auto
 prisms_jobs jobs in the database that are incomplete and then re-submits itself
-to execute again after the specified delay.
+to execute again after the specified delay. Tasks of task pools claimed by
+'pworker' jobs that ended are returned to the pool.
 
 The specifics of 'taskmaster' submission can be customized by editing the 
 'taskmaster_job_kwargs' object in the prisms_jobs configuration file:
 ``$PRISMS_JOBS_DIR/config.json``.
+
+With --daemon, 'taskmaster' instead runs as one long-lived process (on a login
+node or in a long allocation) that repeats the same steps in a loop. It waits
+until the first running job is expected to end (start time plus walltime),
+but at least --min-delay and at most --delay, between cycles. Only one daemon
+runs per jobs database, on any host; stop it with --kill (on the same host)
+or by sending it SIGTERM. While a daemon runs, a batch 'taskmaster' exits
+without doing anything.
 """
 
 parser = argparse.ArgumentParser(description=DESC, formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument('-d','--delay', type=str, default="15:00", \
                     help='How long to delay ("[[[DD:]HH:]MM:]SS") between executions.  Default is "15:00".')
 
+parser.add_argument('--daemon', action='store_true', \
+                    help='Run as a long-lived process, instead of resubmitting as a job.')
+parser.add_argument('--min-delay', type=str, default="1:00", \
+                    help='With --daemon, the shortest delay ("[[[DD:]HH:]MM:]SS") between cycles.  Default is "1:00".')
+
 group = parser.add_mutually_exclusive_group()
 group.add_argument('--hold', action='store_true', help='Place a hold on the currently running taskmaster')
 group.add_argument('--release', action='store_true', help='Release the currently running taskmaster')
@@ -78,6 +100,99 @@ def taskmaster_job_kwargs(delay, cli_args):
     return data
             
 
+def daemon_pidfile():
+    """Location of the file locked by the taskmaster daemon of the jobs database
+
+    The file is next to the jobs database, so that only one daemon runs per
+    database, on any host. It is locked with POSIX record locks, which also
+    work across hosts on NFS file systems with a working lock manager.
+    """
+    return config.dbpath() + ".taskmaster.pid"
+
+
+def daemon_pid():
+    """Return (hostname, PID) of the running taskmaster daemon, or None"""
+    try:
+        with open(daemon_pidfile(), 'r') as f:
+            try:
+                fcntl.lockf(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                host, pid = f.read().split()
+                return (host, int(pid))
+            fcntl.lockf(f, fcntl.LOCK_UN)
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def check_for_daemon():
+    """Exit if a taskmaster daemon is running for the jobs database"""
+    running = daemon_pid()
+    if running is not None:
+        print("A taskmaster daemon is already running. Host:", running[0], "  PID:", running[1])
+        sys.exit()
+
+
+def poll_interval(db, min_delay, max_delay):
+    """Seconds to wait until the next cycle, based on when the first running job is expected to end"""
+    next_end = db.next_expected_end()
+    if next_end is None:
+        return max_delay
+    return min(max_delay, max(min_delay, next_end - time.time()))
+
+
+def daemon(delay, min_delay):
+    """Update and continue jobs in a loop, with a persistent JobDB connection
+
+    Args:
+        delay (float): Longest time, in seconds, between cycles
+        min_delay (float): Shortest time, in seconds, between cycles
+    """
+    # hold an exclusive lock on the pid file while running
+    lock = open(daemon_pidfile(), 'a+')
+    try:
+        fcntl.lockf(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        lock.close()
+        check_for_daemon()
+        sys.exit()
+    lock.seek(0)
+    lock.truncate()
+    lock.write(socket.gethostname() + " " + str(os.getpid()) + "\n")
+    lock.flush()
+
+    # check if a taskmaster job is also running
+    check_for_other()
+
+    # finish the current cycle before stopping
+    stop = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.append(signum))
+
+    print("taskmaster daemon started. PID:", os.getpid())
+    db = prisms_jobs.JobDB()
+    try:
+        while not stop:
+            interval = delay
+            try:
+                db.update()
+                db.requeue_tasks()
+                db.submit_pending()
+                db.continue_all()
+                interval = poll_interval(db, min_delay, delay)
+            except Exception:   #pylint: disable=broad-except
+                # keep running if the job management software is unavailable
+                traceback.print_exc()
+            print(time.strftime("%Y-%m-%d %H:%M:%S"), "next cycle in", int(interval), "s")
+            sys.stdout.flush()
+            end = time.time() + interval
+            while not stop and time.time() < end:
+                time.sleep(min(5.0, end - time.time()))
+    finally:
+        db.close()
+        lock.close()
+    print("taskmaster daemon stopped")
+
+
 def main():
     args = parser.parse_args()
 
@@ -90,18 +205,29 @@ def main():
         if len(jobid) != 0:
             software.release(jobid[-1])
     elif args.kill:
+        running = daemon_pid()
+        if running is not None and running[0] == socket.gethostname():
+            os.kill(running[1], signal.SIGTERM)
+        elif running is not None:
+            print("The taskmaster daemon is running on another host. Host:", running[0],
+                  "  PID:", running[1])
         jobid = software.job_id(name="taskmaster")
         if len(jobid) != 0:
             software.alter(jobid[-1], "-a " + prisms_jobs.misc.exetime("10:00:00:00") )
             software.delete(jobid[-1])
+    elif args.daemon:
+        daemon(prisms_jobs.misc.seconds(args.delay), prisms_jobs.misc.seconds(args.min_delay))
     else:
         
-        # check if taskmaster already running (besides this one)
+        # check if taskmaster already running (besides this one), or a daemon
         check_for_other()
+        check_for_daemon()
         
         # continue jobs
         db = prisms_jobs.JobDB()
         db.update()
+        db.requeue_tasks()
+        db.submit_pending()
         db.continue_all()
         db.close()
         
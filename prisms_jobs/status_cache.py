@@ -0,0 +1,117 @@
+"""Shared cache of the job management software status snapshot
+
+``JobDB.update()`` and ``pstat`` query the status of all of the user's jobs. To
+avoid repeating identical queries, the result of ``job_status()`` is saved to
+a snapshot file in the configuration directory and re-used by any process
+while it is younger than the 'ttl' of the 'status_cache' setting. Access to
+the snapshot is serialized with a lock file, so that when the snapshot
+expires only one process queries the job management software while others
+wait for its result.
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+import fcntl
+import json
+import os
+import socket
+import time
+
+from six import iteritems
+
+from prisms_jobs import config
+
+
+def snapshot_path():
+    """Return the location of the status snapshot file
+
+    The file name includes the hostname, because the configuration directory
+    may be shared by machines with different job management software.
+    """
+    return os.path.join(config.config_dir(), 'status_cache.' + socket.gethostname() + '.json')
+
+
+def _read(path, ttl):
+    """Return (snapshottime, status) from the snapshot file, or None if missing or older than ttl"""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if data.get('software') != config.settings()['software']:
+        return None
+    if time.time() - data['time'] >= ttl:
+        return None
+    return data['time'], data['status']
+
+
+def _write(path, snapshottime, status):
+    """Write the snapshot file, via a temporary file so readers never see a partial file"""
+    tmppath = path + "." + str(os.getpid())
+    with open(tmppath, 'w') as f:
+        # for python2/3 compatibility don't use json.dump:
+        f.write(json.dumps({'software': config.settings()['software'],
+                            'time': snapshottime,
+                            'status': status}))
+    os.rename(tmppath, path)
+
+
+def snapshot(refresh=False):
+    """Return the status of all of the user's jobs, from the cache if fresh
+
+    Args:
+        refresh (bool, optional, default=False): If True, query the job
+            management software, and update the cache, even if it is fresh.
+
+    Returns:
+        (snapshottime, status): The time (seconds since the epoch) that the
+            job management software was queried, and the dict returned by
+            ``config.software().job_status()``.
+    """
+    ttl = config.status_cache()['ttl']
+    if not ttl:
+        return time.time(), config.software().job_status()
+
+    path = snapshot_path()
+    if not refresh:
+        cached = _read(path, ttl)
+        if cached is not None:
+            return cached
+
+    with open(path + ".lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # another process may have refreshed the snapshot while waiting
+            if not refresh:
+                cached = _read(path, ttl)
+                if cached is not None:
+                    return cached
+            snapshottime = time.time()
+            status = config.software().job_status()
+            _write(path, snapshottime, status)
+            return snapshottime, status
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def job_id(name, refresh=False):
+    """Return the IDs of the user's jobs with the given name, from the cache if fresh
+
+    Args:
+        name (str): Job name
+        refresh (bool, optional, default=False): If True, query the job
+            management software, and update the cache, even if it is fresh.
+
+    Returns:
+        List(str): Job IDs
+    """
+    status = snapshot(refresh=refresh)[1]
+    return [jobid for jobid, jobstatus in iteritems(status) if jobstatus.get("jobname") == name]
+
+
+def invalidate():
+    """Remove the status snapshot, so that the next query is not cached"""
+    try:
+        os.remove(snapshot_path())
+    except OSError:
+        pass
@@ -0,0 +1,198 @@
+""" Class for workflows of dependent Jobs """
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+from builtins import *
+
+### External ###
+import os
+from multiprocessing.pool import ThreadPool
+
+### Local ###
+import prisms_jobs
+from prisms_jobs import config, governor, jobdb, status_cache
+
+class Workflow(object):
+    """A directed acyclic graph of Jobs, submitted with scheduler dependencies
+
+    Each job is submitted to start after all the jobs it depends on complete
+    successfully (``afterok``), so a whole fan-out/fan-in pipeline can be
+    submitted at once. Jobs are submitted in topological batches: all the
+    jobs of a batch depend only on jobs of earlier batches, and are submitted
+    concurrently.
+
+    The jobs are added to the JobDB, and the dependencies are recorded in its
+    'edges' table, so that progress can be shown with ``pstat --workflow``.
+    Dependencies are on the first job of each series: a job that depends on an
+    'auto' job starts after that job, not after its continuations.
+
+    Args:
+        name (str): Name of the workflow
+
+    Attributes:
+        name (str): Name of the workflow
+        jobs (dict): {key: prisms_jobs.Job} for each job added
+        rundir (dict): {key: str} Directory each job is run in
+        after (dict): {key: List(str)} Keys of the jobs each job depends on
+        jobIDs (dict): {key: str} ID of each submitted job. Empty if not
+            submitted.
+
+    Example:
+
+        .. code-block:: python
+
+            wf = prisms_jobs.Workflow("relax")
+            wf.add("setup", setup_job)
+            for i, job in enumerate(calc_jobs):
+                wf.add("calc" + str(i), job, after=["setup"], rundir="calc" + str(i))
+            wf.add("analyze", analyze_job, after=["calc" + str(i) for i in range(len(calc_jobs))])
+            wf.submit()
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.jobs = dict()
+        self.rundir = dict()
+        self.after = dict()
+        self._order = []
+
+        self.jobIDs = dict()    #pylint: disable=invalid-name
+
+    def add(self, key, job, after=None, rundir=None):
+        """Add a job to the workflow
+
+        Args:
+            key (str): Unique key identifying the job in the workflow
+            job (prisms_jobs.Job): The job
+            after (List(str), optional): Keys of the jobs that must complete
+                successfully before this job starts. They may be added later.
+            rundir (str, optional): Directory to run the job in. Default is the
+                current working directory.
+
+        Raises:
+            prisms_jobs.JobsError: If 'key' was already added.
+        """
+        if key in self.jobs:
+            raise prisms_jobs.JobsError(self.name, "Workflow already has a job: '" + key + "'")
+        self.jobs[key] = job
+        self.rundir[key] = os.path.abspath(os.getcwd() if rundir is None else rundir)
+        self.after[key] = list(after or [])
+        self._order.append(key)
+
+    def batches(self):
+        """Return the keys of the jobs, in topological batches
+
+        Returns:
+            List(List(str)): Each batch holds the keys of jobs that depend only
+                on jobs in earlier batches, in the order they were added.
+
+        Raises:
+            prisms_jobs.JobsError: If a job depends on a key not added, or if
+                the dependencies have a cycle.
+        """
+        position = dict((key, i) for i, key in enumerate(self._order))
+        ndepends = dict()
+        dependents = dict((key, []) for key in self._order)
+        for key in self._order:
+            ndepends[key] = len(set(self.after[key]))
+            for parent in set(self.after[key]):
+                if parent not in self.jobs:
+                    raise prisms_jobs.JobsError(
+                        self.name, "Job '" + key + "' depends on unknown job: '" + parent + "'")
+                dependents[parent].append(key)
+
+        batches = []
+        ready = [key for key in self._order if ndepends[key] == 0]
+        nsorted = 0
+        while len(ready):
+            batches.append(ready)
+            nsorted += len(ready)
+            ready = []
+            for parent in batches[-1]:
+                for key in dependents[parent]:
+                    ndepends[key] -= 1
+                    if ndepends[key] == 0:
+                        ready.append(key)
+            ready.sort(key=position.get)
+
+        if nsorted != len(self._order):
+            cycle = [key for key in self._order if ndepends[key] > 0]
+            raise prisms_jobs.JobsError(
+                self.name, "Workflow dependencies have a cycle, involving: " + ", ".join(cycle))
+        return batches
+
+    def submit(self, dbpath=None, nthreads=8):
+        """
+        Submit the workflow using the appropriate command for prisms_jobs.config.software().
+
+        Each batch of jobs is submitted by up to 'nthreads' threads at once, and
+        recorded, with its dependencies, in one JobDB transaction. Workflow jobs
+        are not held by the 'submit_limits' setting, because a held job could
+        not be depended on: if submitting all of them would exceed a limit, an
+        error is raised before any are submitted.
+
+        Args:
+            dbpath (str): Specify a non-default JobDB database
+            nthreads (int, optional, default=8): Maximum number of concurrent
+                submissions
+
+        Raises:
+            prisms_jobs.JobsError: If the dependencies are invalid, if
+                submitting would exceed the 'submit_limits' setting, or if error
+                submitting a job. If a submission fails, the jobs already
+                submitted are recorded, and jobs depending on the failed job
+                are not submitted.
+        """
+        batches = self.batches()
+        if not governor.fits([(job.queue, job.account) for job in self.jobs.values()]):
+            raise prisms_jobs.JobsError(
+                self.name, "Submitting workflow would exceed the 'submit_limits' setting")
+
+        software = config.software()
+        self.jobIDs = dict()
+
+        def _submit(key):
+            """Return (jobid, None), or (None, exception) if submission failed"""
+            parents = sorted(set(self.after[key]))
+            dependency = None
+            if len(parents):
+                dependency = "afterok:" + ":".join([self.jobIDs[p] for p in parents])
+            try:
+                return (software.submit(substr=self.jobs[key].sub_string(),
+                                        rundir=self.rundir[key], dependency=dependency), None)
+            except Exception as e:  #pylint: disable=broad-except, invalid-name
+                return (None, e)
+
+        db = jobdb.JobDB(dbpath=dbpath) #pylint: disable=invalid-name
+        try:
+            for batch in batches:
+                if nthreads > 1 and len(batch) > 1:
+                    pool = ThreadPool(min(nthreads, len(batch)))
+                    try:
+                        results = pool.map(_submit, batch)
+                    finally:
+                        pool.close()
+                        pool.join()
+                else:
+                    results = [_submit(key) for key in batch]
+                status_cache.invalidate()
+
+                job_status_list = []
+                edges = []
+                for key, (jobid, _) in zip(batch, results):
+                    if jobid is None:
+                        continue
+                    job = self.jobs[key]
+                    job.jobID = jobid
+                    self.jobIDs[key] = jobid
+                    governor.record(job.queue, job.account)
+                    job_status_list.append(job._status(self.rundir[key]))  #pylint: disable=protected-access
+                    edges += [(self.jobIDs[p], jobid) for p in sorted(set(self.after[key]))]
+                    if not len(self.after[key]):
+                        edges.append((None, jobid))
+                db.add_workflow_jobs(self.name, job_status_list, edges)
+
+                for _, err in results:
+                    if err is not None:
+                        raise err
+        finally:
+            db.close()